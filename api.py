@@ -0,0 +1,90 @@
+#----------------------------------------------------------------------------#
+# Versioned JSON API, mounted at /api/v1.
+#
+# The views live in app.py next to their HTML counterparts and share the
+# same data builders; this module holds the blueprint and what every API
+# response has in common: the {data, meta, links} envelope, `fields=` sparse
+# fieldsets and JSON encoding.  orjson is used when it is installed (it
+# writes datetimes itself); otherwise the standard library encoder is given
+# a default that writes them as ISO 8601.
+#----------------------------------------------------------------------------#
+
+import json
+from datetime import date, datetime
+
+from flask import Blueprint, Response, request
+from werkzeug.exceptions import HTTPException
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def iso(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError('%r is not JSON serializable' % type(value).__name__)
+
+
+def dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, default=iso, separators=(',', ':')).encode('utf-8')
+
+
+def parse_fields(value):
+    # 'id,name,upcoming_shows.start_time' -> {'id': None, 'name': None,
+    # 'upcoming_shows': {'start_time': None}}; None keeps the whole value
+    tree = {}
+    for path in value.split(','):
+        parts = [part.strip() for part in path.split('.')]
+        if not all(parts):
+            continue
+        node = tree
+        for part in parts[:-1]:
+            if part in node and node[part] is None:
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = None
+    return tree
+
+
+def project(value, tree):
+    # lists are projected item by item, so the same fields apply to each record
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [project(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {key: project(value[key], sub) for key, sub in tree.items() if key in value}
+    return value
+
+
+def requested_fields():
+    value = request.args.get('fields')
+    return parse_fields(value) if value else None
+
+
+def api_response(data, meta=None, links=None, status=200):
+    body = {'data': project(data, requested_fields())}
+    if meta is not None:
+        body['meta'] = meta
+    if links is not None:
+        body['links'] = links
+    return Response(dumps(body), status=status, mimetype='application/json')
+
+
+def api_error(error):
+    body = {'error': {'status': error.code, 'message': error.description}}
+    return Response(dumps(body), status=error.code, mimetype='application/json')
+
+
+# the app's own 404 and 500 pages are registered by code, which Flask
+# prefers over a class handler, so the common codes are named here too
+api.register_error_handler(HTTPException, api_error)
+for code in (400, 404, 405, 500):
+    api.register_error_handler(code, api_error)
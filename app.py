@@ -3,29 +3,75 @@
 #----------------------------------------------------------------------------#
 
 import json
-import dateutil.parser
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
-from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func
-from flask_migrate import Migrate
+import base64
+import hashlib
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, jsonify, stream_with_context
+from sqlalchemy import event, func
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
+from search import NameSearch, Autocomplete
+from cache import PageCache, FragmentCache, make_backend, conditional
+from registry import ReferenceRegistry
+from exporter import FORMATS, buffered, csv_lines, jsonl_lines, ics_lines
+from api import api, api_response
+from instrumentation import SQLInstrumentation
+from metrics import Metrics
+from routing import RoutingSQLAlchemy, RoutingSession
+from dates import DateFormatter
+from assets import Assets
 from datetime import datetime, timedelta
+import os
 import sys
+import click
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.local import LocalProxy
+from werkzeug.utils import import_string
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
 app = Flask(__name__)
-moment = Moment(app)
-app.config.from_object('config')
-db = SQLAlchemy(app)
-
-migrate = Migrate(app,db,compare_type=True)
+#wsgi.create_app() picks the config module through FYYUR_CONFIG
+app.config.from_object(os.environ.get('FYYUR_CONFIG', 'config'))
+db = RoutingSQLAlchemy(app)
+
+#alembic takes long to import and only the `flask db` commands use it.  The flask command loads
+#the app inside a click context, servers and scripts don't.
+if click.get_current_context(silent=True) is not None:
+  from flask_migrate import Migrate
+  migrate = Migrate(app,db,compare_type=True)
+
+#templates get moment as before, flask_moment is imported if one uses it
+app.jinja_env.globals['moment'] = LocalProxy(lambda: import_string('flask_moment._moment'))
+
+#Templates compiled by `flask compile-templates`, when it has been run.  Read only: a template
+#changed since compiles in memory as usual, and workers never race to write the files.
+class PrebuiltBytecodeCache(FileSystemBytecodeCache):
+  def dump_bytecode(self, bucket):
+    pass
+
+if os.path.isdir(app.config['TEMPLATE_CACHE_DIR']):
+  app.jinja_env.bytecode_cache = PrebuiltBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+
+dates = DateFormatter(app)
+page_cache = PageCache(make_backend(app.config), variant=dates.variant)
+fragment_cache = FragmentCache(app, variant=dates.variant)
+#hashed, precompressed static files once `flask build-assets` has run
+assets = Assets(app)
+
+#writers drop the pages, and the fragments of pages, built from what they changed: in this process,
+#and for pages in every process with the redis backend (see cache.py)
+def invalidate(*tags):
+  page_cache.invalidate(*tags)
+  fragment_cache.invalidate(*tags)
+
+sql_stats = SQLInstrumentation(app, db.engine)
+request_metrics = Metrics(app)
+for replica in db.get_replicas(app):
+  sql_stats.watch(replica)
+db.on_pool_wait(lambda database, waited: request_metrics.observe('pool_wait_seconds', (('database', database),), waited))
 
 # TODO: connect to a local postgresql database
 
@@ -35,6 +81,11 @@ migrate = Migrate(app,db,compare_type=True)
 
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+        db.Index('ix_Venue_city_id','city_id'),
+        #search.py looks up the rows other processes wrote by it
+        db.Index('ix_Venue_updated_at','updated_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String,unique=True,nullable=False)
@@ -46,14 +97,20 @@ class Venue(db.Model):
     seeking_talent = db.Column(db.Boolean)
     seeking_description = db.Column(db.String,nullable=True)
     website = db.Column(db.String)
+    upcoming_show_count = db.Column(db.Integer,nullable=False,default=0,server_default='0')
+    updated_at = db.Column(db.DateTime(timezone=True),nullable=False,server_default=func.now(),onupdate=func.now())
 
-    show = db.relationship('Show',backref='vshow',lazy=False)
-    genre = db.relationship('GenreVenue',backref='vgenre',lazy=False)
+    show = db.relationship('Show',backref='vshow',lazy=True)
+    genre = db.relationship('GenreVenue',backref='vgenre',lazy=True)
 
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+        db.Index('ix_Artist_city_id','city_id'),
+        db.Index('ix_Artist_updated_at','updated_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String,unique=True)
@@ -64,45 +121,81 @@ class Artist(db.Model):
     website = db.Column(db.String)
     seeking_venue = db.Column(db.Boolean)
     seeking_description = db.Column(db.String,nullable=True)
+    upcoming_show_count = db.Column(db.Integer,nullable=False,default=0,server_default='0')
+    updated_at = db.Column(db.DateTime(timezone=True),nullable=False,server_default=func.now(),onupdate=func.now())
 
-    show = db.relationship('Show',backref='ashow',lazy=False)
-    genre = db.relationship('GenreArtist',backref='agenre',lazy=False)
+    show = db.relationship('Show',backref='ashow',lazy=True)
+    genre = db.relationship('GenreArtist',backref='agenre',lazy=True)
 
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
 # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 
+#Timelines read a venue's or artist's shows in time order, the feed pages through (time, id).
+#An artist plays a venue at a given time once; that key also serves the venue timeline.
 class Show (db.Model):
   __tablename__ = 'Show'
+  __table_args__ = (
+    db.UniqueConstraint('venue_id','time','artist_id',name='uq_Show_venue_time_artist'),
+    db.Index('ix_Show_artist_id_time','artist_id','time'),
+    db.Index('ix_Show_time_id','time','id'),
+  )
 
   id = db.Column(db.Integer,primary_key=True)
   time = db.Column(db.DateTime(timezone=True),nullable=False)
   artist_id = db.Column(db.Integer,db.ForeignKey('Artist.id'),nullable=False)
   venue_id = db.Column(db.Integer,db.ForeignKey('Venue.id'),nullable=False)
+  updated_at = db.Column(db.DateTime(timezone=True),nullable=False,server_default=func.now(),onupdate=func.now())
+
+#Venue and Artist upcoming_show_count count the shows starting at or after as_of, which the
+#roll-forward job moves up to now.  One row, id 1.
+class ShowCounterClock(db.Model):
+  __tablename__ = 'ShowCounterClock'
+
+  id = db.Column(db.Integer,primary_key=True)
+  as_of = db.Column(db.DateTime(timezone=True),nullable=False)
+
+#When rows of each versioned table were last deleted.  A delete leaves no updated_at behind, so
+#the conditional GET validators read this too.  One row per table, written by note_deletes.
+class DeleteClock(db.Model):
+  __tablename__ = 'DeleteClock'
+
+  table_name = db.Column(db.String,primary_key=True)
+  deleted_at = db.Column(db.DateTime(timezone=True),nullable=False)
 
 #Noticed that there was sorting based on city.  Its easier that it is its own table.
 class City(db.Model):
   __tablename__ = 'City'
+  __table_args__ = (
+    db.UniqueConstraint('name','state',name='uq_City_name_state'),
+    db.Index('ix_City_updated_at','updated_at'),
+  )
 
   id = db.Column(db.Integer,primary_key=True)
   name = db.Column(db.String,nullable=False)
   state = db.Column(db.String(2),nullable=False)
+  updated_at = db.Column(db.DateTime(timezone=True),nullable=False,server_default=func.now(),onupdate=func.now())
 
-  venue_rel = db.relationship('Venue',backref='cvenues',lazy=False)
-  artist_rel = db.relationship('Artist',backref='cartists',lazy=False)
+  venue_rel = db.relationship('Venue',backref='cvenues',lazy=True)
+  artist_rel = db.relationship('Artist',backref='cartists',lazy=True)
 
 #A venue and artist can have many genres, and a genre can be done by many venues and artists.
 class Genre (db.Model):
   __tablename__ = 'Genre'
+  __table_args__ = (db.UniqueConstraint('name',name='uq_Genre_name'),)
 
   id = db.Column(db.Integer,primary_key=True)
   name = db.Column(db.String,nullable=False)
 
-  g_venue = db.relationship('GenreVenue',backref='cvenue',lazy=False)
-  a_venue = db.relationship('GenreArtist',backref='cartist',lazy=False)
+  g_venue = db.relationship('GenreVenue',backref='cvenue',lazy=True)
+  a_venue = db.relationship('GenreArtist',backref='cartist',lazy=True)
 
 class GenreVenue(db.Model):
   __tablename__ = 'GenreVenue'
+  __table_args__ = (
+    db.UniqueConstraint('genre_id','venue_id',name='uq_GenreVenue_genre_venue'),
+    db.Index('ix_GenreVenue_venue_id','venue_id'),
+  )
 
   id = db.Column(db.Integer,primary_key=True)
   genre_id = db.Column(db.Integer,db.ForeignKey(Genre.id))
@@ -110,133 +203,641 @@ class GenreVenue(db.Model):
 
 class GenreArtist (db.Model):
   __tablename__ = 'GenreArtist'
+  __table_args__ = (
+    db.UniqueConstraint('genre_id','artist_id',name='uq_GenreArtist_genre_artist'),
+    db.Index('ix_GenreArtist_artist_id','artist_id'),
+  )
   id = db.Column(db.Integer,primary_key=True)
   genre_id = db.Column(db.Integer,db.ForeignKey(Genre.id))
   artist_id = db.Column(db.Integer,db.ForeignKey(Artist.id))
 
+#Deletes through the session, one object at a time or in bulk, move the clock of their table
+#in the same transaction.  Rows deleted in plain SQL don't; their counts still change the ETag.
+VERSIONED = ('Venue', 'Artist', 'Show', 'City')
+
+def note_deletes(session, tables):
+  for name in set(tables).intersection(VERSIONED):
+    session.merge(DeleteClock(table_name=name, deleted_at=func.now()))
+
+@event.listens_for(RoutingSession, 'before_flush')
+def deleting(session, flush_context, instances):
+  note_deletes(session, [obj.__table__.name for obj in session.deleted])
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def bulk_deleting(state):
+  if state.is_delete:
+    note_deletes(state.session, [state.bind_mapper.local_table.name])
+
+#----------------------------------------------------------------------------#
+# Loading strategies.
+#----------------------------------------------------------------------------#
+
+#Relationships load lazily by default.  The read pages select the columns they render
+#(see the *_statement functions); the edit forms, which load the models, opt into what
+#they show with one of these option sets, e.g. Venue.query.options(*VENUE_DETAIL).
+#Backrefs (cvenues, ashow, ...) only exist once the mappers are configured.
+db.configure_mappers()
+
+#edit forms need the city and the genre names
+VENUE_DETAIL = (
+  db.joinedload(Venue.cvenues),
+  db.selectinload(Venue.genre).joinedload(GenreVenue.cvenue)
+)
+ARTIST_DETAIL = (
+  db.joinedload(Artist.cartists),
+  db.selectinload(Artist.genre).joinedload(GenreArtist.cartist)
+)
+
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = value if not isinstance(value,str) else dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format, locale='en')
+#the datetime filter is DateFormatter.format, memoized and in the request's locale and
+#timezone (see dates.py)
+
+#dateutil is only needed by the few views that take a date
+def parse_datetime(value):
+  import dateutil.parser
+  return dateutil.parser.parse(value)
+
+#----------------------------------------------------------------------------#
+# Queries.
+#----------------------------------------------------------------------------#
+
+#The read pages are built in two steps: *_statement(s) make the selects and the function
+#next to them shapes their rows.  The views below run the selects through db.session, the
+#async mode in asgi.py runs the same ones through its async engine.
+
+#The city -> venues -> num_upcoming_shows tree for /venues comes from a single query, reading
+#the counts off the venue rows.  With a limit it is paged by keyset on (city id, venue id), the
+#way the shows feed is; a city whose venues straddle two pages shows up on both.
+def venues_statement(after=None, limit=None):
+  q = db.select(
+    City.id, City.name, City.state,
+    Venue.id, Venue.name,
+    Venue.upcoming_show_count
+  ).outerjoin(Venue, Venue.city_id==City.id
+  ).order_by(City.id, Venue.id)
+  if after:
+    city_id, venue_id = decode_cursor(after, int, int)
+    #a city without venues has a null venue id, which no later venue id compares past
+    q = q.where(db.or_(City.id>city_id, db.and_(City.id==city_id, Venue.id>venue_id)))
+  #one extra row tells us whether there is another page
+  return q if limit is None else q.limit(limit + 1)
+
+def venue_areas(rows):
+  data = []
+  area = None
+  for city_id, city_name, state, venue_id, venue_name, upcoming in rows:
+    if area is None or area['id'] != city_id:
+      area = {
+        'id':city_id,
+        'city':city_name,
+        'state':state,
+        'venues':[]
+      }
+      data.append(area)
+    #a city without venues still comes back once, with a null venue
+    if venue_id is not None:
+      area['venues'].append({
+        'id':venue_id,
+        'name':venue_name,
+        'num_upcoming_shows':upcoming
+      })
+  return data
+
+def venues_by_city():
+  return venue_areas(db.session.execute(venues_statement()))
+
+def venues_page(after=None, limit=50):
+  rows = db.session.execute(venues_statement(after, limit)).all()
+  more = len(rows) > limit
+  rows = rows[:limit]
+  #a venueless city's row is keyed (city id, 0)
+  next_cursor = encode_cursor(rows[-1][0], rows[-1][3] or 0) if more else None
+  return {'data':venue_areas(rows), 'next':next_cursor}
+
+#A venue or artist page: header and city, genres, then the show timeline with the counterpart
+#joined in.  Three queries no matter how many shows, independent of each other.
+def timeline_statements(model, entity_id, now=None):
+  now = datetime.today() if now is None else now
+  if model is Venue:
+    link, link_key, show_key, other, other_key = GenreVenue, GenreVenue.venue_id, Show.venue_id, Artist, Show.artist_id
+  else:
+    link, link_key, show_key, other, other_key = GenreArtist, GenreArtist.artist_id, Show.artist_id, Venue, Show.venue_id
+
+  header = db.select(
+    *model.__table__.columns,
+    City.name.label('city'),
+    City.state.label('state')
+  ).join(City, model.city_id==City.id).where(model.id==entity_id)
+
+  genres = db.select(Genre.name).join(link, link.genre_id==Genre.id
+  ).where(link_key==entity_id).order_by(link.id)
+
+  #the database decides which side of "now" each show falls on
+  shows = db.select(
+    other.id, other.name, other.image_link, other.updated_at, Show.time,
+    (Show.time>=now).label('upcoming')
+  ).join(other, other_key==other.id
+  ).where(show_key==entity_id).order_by(Show.time, Show.id)
+  return header, genres, shows
+
+#The page data from the rows of the three statements, or None if the id is unknown.
+def timeline_data(model, header, genres, shows):
+  if not header:
+    return None
+  header = header[0]
+  prefix = 'artist' if model is Venue else 'venue'
+  sc = []
+  ps = []
+  for other_id, name, image_link, updated_at, time, upcoming in shows:
+    (sc if upcoming else ps).append({
+      prefix + '_id': other_id,
+      prefix + '_name': name,
+      prefix + '_image_link': image_link,
+      prefix + '_updated_at': updated_at,
+      'start_time': time
+    })
+
+  data = header._asdict()
+  data.update({
+    'genres':[g.name for g in genres],
+    'upcoming_shows':sc,
+    'past_shows':ps,
+    'past_shows_count':len(ps),
+    'upcoming_shows_count':len(sc)
+  })
+  return data
+
+#The *_updated_at of the show tiles key their page fragments, the JSON views leave them out.
+def without_tile_versions(shows):
+  for s in shows:
+    s.pop('artist_updated_at', None)
+    s.pop('venue_updated_at', None)
+  return shows
+
+def entity_timeline(model, entity_id, now=None):
+  return timeline_data(model, *[db.session.execute(q).all() for q in timeline_statements(model, entity_id, now)])
+
+#Artist cards for the /artists listing, optionally one slice of them.
+def artist_cards_statement(offset=0, limit=None):
+  q = db.select(Artist.id, Artist.name).order_by(Artist.id)
+  if offset:
+    q = q.offset(offset)
+  if limit is not None:
+    q = q.limit(limit)
+  return q
+
+def artist_cards_data(rows):
+  return [{
+    'id':key,
+    'name':name
+  } for key, name in rows]
+
+def artist_cards(offset=0, limit=None):
+  return artist_cards_data(db.session.execute(artist_cards_statement(offset, limit)))
+
+#Keyset cursors are the sort key of a boundary row, urlsafe base64 encoded: (time, id) for
+#/shows, (city id, venue id) for the API's venue list.  decode_cursor parses each part with
+#the matching function of parsers.
+def encode_cursor(*key):
+  raw = '|'.join(part.isoformat() if isinstance(part, datetime) else str(part) for part in key)
+  return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, *parsers):
+  try:
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    parts = raw.split('|')
+    if len(parts) != len(parsers):
+      raise ValueError(raw)
+    return tuple(parse(part) for parse, part in zip(parsers, parts))
+  except (ValueError, UnicodeDecodeError):
+    abort(400)
+
+#Date range and city filters shared by the shows feed and the exports.
+def filter_shows(q, start=None, end=None, city_id=None):
+  if start is not None:
+    q = q.filter(Show.time>=start)
+  if end is not None:
+    q = q.filter(Show.time<end)
+  if city_id is not None:
+    q = q.filter(Venue.city_id==city_id)
+  return q
+
+#One page of the shows feed ordered by (time, id), from a single joined projection of the
+#columns pages/shows.html renders.  `after` pages forward, `before` pages backward.
+def shows_statement(after=None, before=None, start=None, end=None, city_id=None, limit=30):
+  q = db.select(
+    Show.id,
+    Show.time.label('start_time'),
+    Show.venue_id,
+    Venue.name.label('venue_name'),
+    Show.artist_id,
+    Artist.name.label('artist_name'),
+    Artist.image_link.label('artist_image_link'),
+    Artist.updated_at.label('artist_updated_at'),
+    Venue.updated_at.label('venue_updated_at')
+  ).join(Venue, Show.venue_id==Venue.id).join(Artist, Show.artist_id==Artist.id)
+  q = filter_shows(q, start, end, city_id)
+
+  if before:
+    time, show_id = decode_cursor(before, datetime.fromisoformat, int)
+    q = q.filter(db.or_(Show.time<time, db.and_(Show.time==time, Show.id<show_id)))
+    q = q.order_by(Show.time.desc(), Show.id.desc())
+  else:
+    if after:
+      time, show_id = decode_cursor(after, datetime.fromisoformat, int)
+      q = q.filter(db.or_(Show.time>time, db.and_(Show.time==time, Show.id>show_id)))
+    q = q.order_by(Show.time, Show.id)
+
+  #one extra row tells us whether there is another page in this direction
+  return q.limit(limit + 1)
+
+def shows_result(rows, after=None, before=None, limit=30):
+  more = len(rows) > limit
+  rows = rows[:limit]
+  if before:
+    rows.reverse()
+
+  next_cursor = prev_cursor = None
+  if rows:
+    first = encode_cursor(rows[0].start_time, rows[0].id)
+    last = encode_cursor(rows[-1].start_time, rows[-1].id)
+    if before:
+      prev_cursor = first if more else None
+      next_cursor = last
+    else:
+      next_cursor = last if more else None
+      prev_cursor = first if after else None
+  return {
+    'shows':[r._asdict() for r in rows],
+    'next':next_cursor,
+    'prev':prev_cursor
+  }
+
+def shows_page(after=None, before=None, limit=30, **filters):
+  rows = db.session.execute(shows_statement(after, before, limit=limit, **filters)).all()
+  return shows_result(rows, after, before, limit)
+
+#Upcoming show counts, denormalized.  upcoming_show_count holds a venue's or artist's shows
+#starting at or after the clock's as_of rather than now, so a show only leaves the counts when
+#roll_upcoming_counts moves as_of past it; between rolls a count can include a show that has
+#just begun.  Writers read as_of under a shared row lock and the roll takes it exclusively,
+#so a show can't be counted against one as_of and rolled off against another.
+COUNTED = ((Venue, Show.venue_id), (Artist, Show.artist_id))
+
+def counter_clock(exclusive=False):
+  clock = ShowCounterClock.query.filter_by(id=1).with_for_update(read=not exclusive).first()
+  if clock is None:
+    #a database made with create_all rather than the migrations
+    clock = ShowCounterClock(id=1, as_of=datetime.today())
+    db.session.add(clock)
+    db.session.flush()
+  return clock
+
+#Moves the counts of the venues and artists with upcoming shows matching criteria by delta per
+#show, one correlated update per table, in the caller's transaction.
+def shift_upcoming_counts(delta, *criteria, as_of=None):
+  as_of = counter_clock().as_of if as_of is None else as_of
+  shows = (Show.time>=as_of,) + criteria
+  for model, key in COUNTED:
+    n = db.session.query(func.count(Show.id)).filter(key==model.id, *shows).scalar_subquery()
+    db.session.query(model).filter(model.id.in_(db.session.query(key).filter(*shows))
+    ).update({model.upcoming_show_count:model.upcoming_show_count + delta * n}, synchronize_session=False)
+
+#The scheduled roll-forward: takes the shows that started since the last roll off the counts
+#and moves as_of up to now.  Returns how many shows passed.
+def roll_upcoming_counts(now=None):
+  now = datetime.today() if now is None else now
+  clock = counter_clock(exclusive=True)
+  passed = db.session.query(func.count(Show.id)).filter(Show.time>=clock.as_of, Show.time<now).scalar()
+  if passed:
+    shift_upcoming_counts(-1, Show.time<now, as_of=clock.as_of)
+  #never backwards, a late or overlapping run leaves the clock alone
+  ShowCounterClock.query.filter(ShowCounterClock.id==clock.id, ShowCounterClock.as_of<now
+  ).update({ShowCounterClock.as_of:now}, synchronize_session=False)
+  return passed
+
+#Compares the counts with the shows, for the given ids or everything, and with repair sets the
+#ones that drifted.  Returns {'venue':[(id, stored, actual), ...], 'artist':[...]}.
+def reconcile_upcoming_counts(venue_ids=None, artist_ids=None, repair=True):
+  as_of = counter_clock().as_of
+  drift = {}
+  for (model, key), ids in zip(COUNTED, (venue_ids, artist_ids)):
+    actual = db.session.query(func.count(Show.id)).filter(key==model.id, Show.time>=as_of).scalar_subquery()
+    criteria = (model.upcoming_show_count!=actual,) if ids is None else (model.upcoming_show_count!=actual, model.id.in_(ids))
+    drift[model.__tablename__.lower()] = [tuple(r) for r in db.session.query(
+      model.id, model.upcoming_show_count, actual).filter(*criteria).order_by(model.id)]
+    if repair and drift[model.__tablename__.lower()]:
+      db.session.query(model).filter(*criteria).update({model.upcoming_show_count:actual}, synchronize_session=False)
+  return drift
+
+#Upcoming show counts for a batch of venues or artists, by primary key.
+def upcoming_counts_statement(model, ids):
+  return db.select(model.id, model.upcoming_show_count).where(model.id.in_(ids))
+
+def upcoming_show_counts(model, ids):
+  if not ids:
+    return {}
+  return dict(db.session.execute(upcoming_counts_statement(model, ids)).all())
+
+#Exports.  The queries run with yield_per, so rows come off a server-side cursor on
+#Postgres in batches of EXPORT_BATCH_SIZE and are written out as they arrive.
+SHOW_EXPORT = ('id', 'start_time', 'artist_id', 'artist_name', 'venue_id', 'venue_name', 'venue_address', 'city', 'state')
+VENUE_EXPORT = ('id', 'name', 'city', 'state', 'address', 'phone', 'genres', 'image_link', 'facebook_link', 'website_link', 'seeking_talent', 'seeking_description')
+ARTIST_EXPORT = ('id', 'name', 'city', 'state', 'phone', 'genres', 'image_link', 'facebook_link', 'website_link', 'seeking_venue', 'seeking_description')
+
+#A venue's or artist's genres as one ';' separated column, the way `flask import` reads them.
+def genre_names(link, key, owner_id):
+  if db.engine.dialect.name == 'postgresql':
+    names = func.string_agg(Genre.name, ';')
+  else:
+    names = func.group_concat(Genre.name, ';')
+  return db.session.query(names).join(link, link.genre_id==Genre.id).filter(key==owner_id).label('genres')
+
+def export_shows(start=None, end=None, city_id=None, venue_id=None, artist_id=None):
+  q = db.session.query(
+    Show.id,
+    Show.time.label('start_time'),
+    Show.artist_id,
+    Artist.name.label('artist_name'),
+    Show.venue_id,
+    Venue.name.label('venue_name'),
+    Venue.address.label('venue_address'),
+    City.name.label('city'),
+    City.state
+  ).join(Venue, Show.venue_id==Venue.id).join(Artist, Show.artist_id==Artist.id
+  ).join(City, Venue.city_id==City.id)
+  q = filter_shows(q, start, end, city_id)
+  if venue_id is not None:
+    q = q.filter(Show.venue_id==venue_id)
+  if artist_id is not None:
+    q = q.filter(Show.artist_id==artist_id)
+  return q.order_by(Show.time, Show.id).yield_per(app.config['EXPORT_BATCH_SIZE'])
+
+def export_venues():
+  q = db.session.query(
+    Venue.id,
+    Venue.name,
+    City.name.label('city'),
+    City.state,
+    Venue.address,
+    Venue.phone,
+    genre_names(GenreVenue, GenreVenue.venue_id, Venue.id),
+    Venue.image_link,
+    Venue.facebook_link,
+    Venue.website.label('website_link'),
+    Venue.seeking_talent,
+    Venue.seeking_description
+  ).join(City, Venue.city_id==City.id)
+  return q.order_by(Venue.id).yield_per(app.config['EXPORT_BATCH_SIZE'])
+
+def export_artists():
+  q = db.session.query(
+    Artist.id,
+    Artist.name,
+    City.name.label('city'),
+    City.state,
+    Artist.phone,
+    genre_names(GenreArtist, GenreArtist.artist_id, Artist.id),
+    Artist.image_link,
+    Artist.facebook_link,
+    Artist.website.label('website_link'),
+    Artist.seeking_venue,
+    Artist.seeking_description
+  ).join(City, Artist.city_id==City.id)
+  return q.order_by(Artist.id).yield_per(app.config['EXPORT_BATCH_SIZE'])
+
+def show_events(rows, url=None):
+  for r in rows:
+    yield {
+      'id':r.id,
+      'start_time':r.start_time,
+      'summary':'%s at %s' % (r.artist_name, r.venue_name),
+      'location':', '.join(part for part in (r.venue_address, r.city, r.state) if part),
+      'url':url(r) if url else None
+    }
+
+#Text of an export, one row at a time.  iCalendar is only offered for shows.
+def export_lines(fmt, columns, rows, name=None, url=None):
+  if fmt == 'ics':
+    return ics_lines(name, show_events(rows, url))
+  rows = (r._asdict() for r in rows)
+  if fmt == 'jsonl':
+    return jsonl_lines(columns, rows)
+  return csv_lines(columns, rows)
+
+venue_search = NameSearch(db, Venue, app.config['SEARCH_REFRESH_SECONDS'])
+artist_search = NameSearch(db, Artist, app.config['SEARCH_REFRESH_SECONDS'])
+
+def city_label(city):
+  return '%s, %s' % (city.name, city.state)
+
+autocomplete = Autocomplete(db, {
+  'venue':(Venue, lambda v: v.name, (Venue.name,)),
+  'artist':(Artist, lambda a: a.name, (Artist.name,)),
+  'city':(City, city_label, (City.name, City.state))
+}, app.config['SEARCH_REFRESH_SECONDS'])
+
+#City and Genre ids by natural key for the write paths
+reference_data = ReferenceRegistry(db, City, Genre)
+
+def reference_committed(kind, rows):
+  if kind == 'city':
+    autocomplete.update('city', [(key, '%s, %s' % natural) for key, natural in rows])
+
+reference_data.subscribe(reference_committed)
+
+#One page of ranked search hits with their upcoming show counts.
+def search_window(offset=None, limit=None):
+  offset = max(request.form.get('offset', 0, type=int), 0) if offset is None else offset
+  limit = app.config['SEARCH_PAGE_SIZE'] if limit is None else limit
+  return offset, limit
+
+def search_page(searcher, term, offset=None, limit=None):
+  offset, limit = search_window(offset, limit)
+  total, hits = searcher.search(term, limit=limit, offset=offset)
+  counts = upcoming_show_counts(searcher.model, [key for key, name in hits])
+  return search_result(total, hits, counts, offset, limit)
+
+def search_result(total, hits, counts, offset, limit):
+  return {
+    'count':total,
+    'offset':offset,
+    'limit':limit,
+    'data':[{
+      'id':key,
+      'name':name,
+      'num_upcoming_shows':counts.get(key, 0)
+    } for key, name in hits]
+  }
 
-app.jinja_env.filters['datetime'] = format_datetime
+#Brings an entity's genre links in line with genre_ids using set differences: one select,
+#then at most one bulk insert and one bulk delete, all inside the caller's transaction.
+#link is GenreVenue or GenreArtist and key its venue_id/artist_id column.
+def sync_genres(link, key, entity_id, genre_ids):
+  wanted = set(genre_ids)
+  current = {genre_id for genre_id, in db.session.query(link.genre_id).filter(key==entity_id)}
+  added = wanted - current
+  removed = current - wanted
+  if added:
+    db.session.execute(link.__table__.insert(), [{'genre_id':genre_id, key.key:entity_id} for genre_id in added])
+  if removed:
+    db.session.query(link).filter(key==entity_id, link.genre_id.in_(removed)).delete(synchronize_session=False)
+  return added, removed
+
+#Validators for conditional GETs, from one round trip of scalar subqueries: per source a
+#row count, max(updated_at) and the time of the table's last delete, and for shows the start
+#of the latest show already under way, since the past/upcoming split moves with the clock.
+#The count alone would catch a delete for the ETag, but Last-Modified has to move too.
+def version_statement(*sources, now=None):
+  now = datetime.today() if now is None else now
+  cols = []
+  for model, criteria in sources:
+    cols.append(db.select(func.count(model.id)).where(*criteria).scalar_subquery().label('v%d' % len(cols)))
+    cols.append(db.select(func.max(model.updated_at)).where(*criteria).scalar_subquery().label('v%d' % len(cols)))
+    cols.append(db.select(DeleteClock.deleted_at).where(DeleteClock.table_name==model.__tablename__
+      ).scalar_subquery().label('v%d' % len(cols)))
+    if model is Show:
+      cols.append(db.select(func.max(Show.time)).where(Show.time<now, *criteria).scalar_subquery().label('v%d' % len(cols)))
+  return db.select(*cols)
+
+def version_of(row):
+  row = tuple(row)
+  #pages are rendered per locale and timezone, so is the etag
+  etag = hashlib.md5(repr((row, dates.variant())).encode()).hexdigest()
+  stamps = [v for v in row if isinstance(v, datetime)]
+  return etag, max(stamps) if stamps else None
+
+def page_version(*sources, now=None):
+  return version_of(db.session.execute(version_statement(*sources, now=now)).one())
+
+#What each page is built from, as (model, criteria) sources for version_statement.
+def venues_sources():
+  #the counts are venue columns, a change to them moves updated_at
+  return (Venue, ()), (City, ())
+
+def artists_sources():
+  return ((Artist, ()),)
+
+def shows_sources():
+  return (Show, ()), (Venue, ()), (Artist, ())
+
+def venue_sources(venue_id):
+  artist_ids = db.select(Show.artist_id).where(Show.venue_id==venue_id)
+  return (
+    (Venue, (Venue.id==venue_id,)),
+    (Show, (Show.venue_id==venue_id,)),
+    (Artist, (Artist.id.in_(artist_ids),))
+  )
+
+def artist_sources(artist_id):
+  venue_ids = db.select(Show.venue_id).where(Show.artist_id==artist_id)
+  return (
+    (Artist, (Artist.id==artist_id,)),
+    (Show, (Show.artist_id==artist_id,)),
+    (Venue, (Venue.id.in_(venue_ids),))
+  )
+
+def venues_version():
+  return page_version(*venues_sources())
+
+def artists_version():
+  return page_version(*artists_sources())
+
+def shows_version():
+  return page_version(*shows_sources())
+
+def venue_version(venue_id):
+  return page_version(*venue_sources(venue_id))
+
+def artist_version(artist_id):
+  return page_version(*artist_sources(artist_id))
 
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
+#What a worker would otherwise do on its first requests: load the search and reference indexes and
+#compile the templates.  wsgi.create_app() runs it before traffic arrives, in the parent process
+#when the server preloads the app, so the workers forked from it share the result.
+def warm_up():
+  autocomplete.warm()
+  venue_search.warm()
+  artist_search.warm()
+  reference_data.warm()
+  for name in app.jinja_env.list_templates(extensions=['html']):
+    app.jinja_env.get_template(name)
+  db.session.remove()
+
+@app.before_first_request
+def warm_caches():
+  #unless a warm_up() got there first
+  if not reference_data.warmed:
+    warm_up()
+
 @app.route('/')
 def index():
   return render_template('pages/home.html')
 
+@app.route('/api/autocomplete')
+def autocomplete_names():
+  # type-ahead suggestions straight from the in-memory prefix index, no db round trip but
+  # the occasional look for other processes' writes (SEARCH_REFRESH_SECONDS)
+  q = request.args.get('q', '')
+  limit = max(1, min(request.args.get('limit', app.config['AUTOCOMPLETE_LIMIT'], type=int), app.config['AUTOCOMPLETE_MAX_LIMIT']))
+  kinds = request.args.get('types')
+  kinds = set(kinds.split(',')) if kinds else None
+  suggestions = []
+  for kind, key, label in autocomplete.complete(q, limit, kinds):
+    suggestions.append({
+      'type':kind,
+      'id':key,
+      'name':label,
+      'url':url_for('show_' + kind, **{kind + '_id':key}) if kind != 'city' else None
+    })
+  return jsonify({'q':q, 'suggestions':suggestions})
+
 
 #  Venues
 #  ----------------------------------------------------------------
 
+#The read pages render through render_* so the async views in asgi.py produce the same pages.
+def render_venues(data):
+  page_cache.tag('venues', 'shows', *['city:%d' % area['id'] for area in data])
+  return render_template('pages/venues.html', areas=data)
+
+def render_venue(data):
+  if data is None:
+    abort(404)
+  page_cache.tag('venue:%d' % data['id'], 'city:%d' % data['city_id'],
+    *['artist:%d' % s['artist_id'] for s in data['upcoming_shows'] + data['past_shows']])
+  return render_template('pages/show_venue.html', venue=data)
+
+def render_search(kind, results):
+  return render_template('pages/search_%s.html' % kind, results=results, search_term=request.form.get('search_term', ''))
+
 @app.route('/venues')
+@conditional(venues_version)
+@page_cache.page
 def venues():
-  # TODO: replace with real venues data.
-  #       num_upcoming_shows should be aggregated based on number of upcoming shows per venue.
-  data = []
-  for c in City.query.all():
-    venues = []
-    for v in Venue.query.filter_by(city_id=c.id):
-      s = Show.query.filter_by(venue_id=v.id).filter(Show.time>=datetime.today()).all()
-      venues.append({
-        'id':v.id,
-        'name':v.name,
-        'num_upcoming_shows':0 if s is None else len(s)
-      })
-    data.append({
-      'city':c.name,
-      'state':c.state,
-      'venues':venues
-    })
-
-  return render_template('pages/venues.html', areas=data)
+  return render_venues(venues_by_city())
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
   # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for Hop should return "The Musical Hop".
   # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
-  term = request.form.get('search_term','')
-  venues = Venue.query.filter(func.lower(Venue.name).contains(term.lower())).all()
-  data = []
-  for v in venues:
-    c = Show.query.filter_by(venue_id=v.id).filter(Show.time>=datetime.today())
-    data.append({
-      'id':v.id,
-      'name':v.name,
-      'num_upcoming_shows':0 if c is None else len(c)
-    })
-  response = {
-    'count':len(venues),
-    'data':data
-  }
-
-  return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
+  return render_search('venues', search_page(venue_search, request.form.get('search_term','')))
 
 @app.route('/venues/<int:venue_id>')
+@conditional(venue_version)
+@page_cache.page
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
-  # TODO: replace with real venue data from the venues table, using venue_id
-
-  venue = Venue.query.filter_by(id=venue_id).first()
-  genres = Genre.query.join(GenreVenue).filter(GenreVenue.venue_id==venue.id).all()
-  shows_coming = Show.query.filter_by(venue_id=venue.id).filter(Show.time>=datetime.today()).all()
-  past_shows = Show.query.filter_by(venue_id=venue.id).filter(Show.time<datetime.today()).all()
-  vg = []
-  sc = []
-  ps = []
-  for g in genres:
-    vg.append(g.name)
-  for s in shows_coming:
-    artist = Artist.query.filter_by(id=s.artist_id).first()
-    sc.append({
-      "artist_id": artist.id,
-      "artist_name": artist.name,
-      "artist_image_link": artist.image_link,
-      "start_time": s.time
-    })
-
-  for s in past_shows:
-    artist = Artist.query.filter_by(id=s.artist_id).first()
-    ps.append({
-      "artist_id": artist.id,
-      "artist_name": artist.name,
-      "artist_image_link": artist.image_link,
-      "start_time": s.time
-    })
-  city = City.query.filter_by(id=venue.city_id).first()
-
-  data = {
-    "id": venue.id,
-    "name": venue.name,
-    "genres": vg,
-    "address": venue.address,
-    "city": city.name,
-    "state": city.state,
-    "phone": venue.phone,
-    "website": venue.website,
-    "facebook_link": venue.facebook_link,
-    "seeking_talent": venue.seeking_talent,
-    "seeking_description": venue.seeking_description,
-    "image_link": venue.image_link,
-    "upcoming_shows":sc,
-    "past_shows":ps,
-    "past_shows_count":len(ps),
-    "upcoming_shows_count":len(sc)
-  }
-  return render_template('pages/show_venue.html', venue=data)
+  return render_venue(entity_timeline(Venue, venue_id))
 
 #  Create Venue
 #  ----------------------------------------------------------------
@@ -252,27 +853,14 @@ def create_venue_submission():
   # TODO: modify data to be the data object returned from db insertion
   # on successful db insert, flash success
   try:
-    #City first
-    city = City.query.filter_by(name=request.form['city'],state=request.form['state']).first()
-    if city is None:
-      city = City(name=request.form['city'],state=request.form['state'])
-      db.session.add(city)
-      db.session.commit()
-    #Next genres
-    genres = []
     if len(request.form.getlist('genres')) == 0:
       flash ("Please select a genre")
       return render_template("/venues/create")
-    for genre in request.form.getlist('genres'):
-      g = Genre.query.filter_by(name=genre).first()
-      if g is None:
-        g = Genre(name=genre)
-        db.session.add(g)
-        db.session.commit()
-      genres.append(g)
+    #City and genres in one go, nothing is committed until the venue is
+    city_id, genres = reference_data.resolve((request.form['city'],request.form['state']), request.form.getlist('genres'))
     venue = Venue(
       name=request.form['name'],
-      city_id=city.id,
+      city_id=city_id,
       address=request.form['address'],
       phone=request.form['phone'],
       image_link = request.form['image_link'],
@@ -281,14 +869,11 @@ def create_venue_submission():
       seeking_description = request.form.get('seeking_description',False),
       website = request.form.get('website_link',False)
     )
+    for genre_id in genres.values():
+      venue.genre.append(GenreVenue(genre_id=genre_id))
     db.session.add(venue)
-    for g in genres:
-      gv = GenreVenue(
-        venue_id = venue.id,
-        genre_id = g.id
-      )
-      db.session.add(gv)
     db.session.commit()
+    invalidate('venues', 'city:%d' % city_id)
     flash('Venue ' + request.form['name'] + ' was successfully listed!')
   # TODO: on unsuccessful db insert, flash an error instead.
   except :
@@ -307,11 +892,14 @@ def delete_venue(venue_id):
     gv = GenreVenue.query.filter_by(venue_id=venue_id).all()
     for g in gv:
       db.session.delete(g)
+    #the venue's upcoming shows come off its artists' counts
+    shift_upcoming_counts(-1, Show.venue_id==venue_id)
     sv = Show.query.filter_by(venue_id=venue_id).all()
     for s in sv:
       db.session.delete(s)
     db.session.delete(v)
     db.session.commit()
+    invalidate('venue:%s' % venue_id, 'venues', 'shows')
     flash ("Delete operation successful.")
   except:
     flash("Delete operation failed.")
@@ -323,91 +911,37 @@ def delete_venue(venue_id):
 
 #  Artists
 #  ----------------------------------------------------------------
+def render_artists(data):
+  page_cache.tag('artists')
+  return render_template('pages/artists.html', artists=data)
+
+def render_artist(data):
+  if data is None:
+    abort(404)
+  page_cache.tag('artist:%d' % data['id'], 'city:%d' % data['city_id'],
+    *['venue:%d' % s['venue_id'] for s in data['upcoming_shows'] + data['past_shows']])
+  return render_template('pages/show_artist.html', artist=data)
+
 @app.route('/artists')
+@conditional(artists_version)
+@page_cache.page
 def artists():
   # TODO: replace with real data returned from querying the database
-  data = []
-  artists = Artist.query.all()
-  for a in artists:
-    data.append({
-      'id':a.id,
-      'name':a.name
-    })
-  return render_template('pages/artists.html', artists=data)
+  return render_artists(artist_cards())
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
   # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
   # search for "band" should return "The Wild Sax Band".
-  term = request.form.get('search_term','')
-  artists = Artist.query.filter(func.lower(Artist.name).contains(term.lower())).all()
-  data = []
-  for a in artists:
-    c = Show.query.filter_by(artist_id=a.id).filter(Show.time>=datetime.today()).all()
-    data.append({
-     'id':a.id,
-      'name':a.name,
-      'num_upcoming_shows':0 if c is None else len(c)
-    })
-  response={
-    "count":len(artists),
-    'data':data
-  }
-  return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+  return render_search('artists', search_page(artist_search, request.form.get('search_term','')))
 
 @app.route('/artists/<int:artist_id>')
+@conditional(artist_version)
+@page_cache.page
 def show_artist(artist_id):
   # shows the artist page with the given artist_id
-  # TODO: replace with real artist data from the artist table, using artist_id
-
-  artist = Artist.query.filter_by(id=artist_id).first()
-  genres = Genre.query.join(GenreArtist).filter(GenreArtist.artist_id==artist.id).all()
-  shows_coming = Show.query.filter_by(artist_id=artist.id).filter(Show.time>=datetime.today()).all()
-  past_shows = Show.query.filter_by(artist_id=artist.id).filter(Show.time<datetime.today()).all()
-  vg = []
-  sc = []
-  ps = []
-  for g in genres:
-    vg.append(g.name)
-  for s in shows_coming:
-    venue = Venue.query.filter_by(id=s.venue_id).first()
-    sc.append({
-      "venue_id": venue.id,
-      "venue_name": venue.name,
-      "venue_image_link": venue.image_link,
-      "start_time": s.time
-    })
-
-  for s in past_shows:
-    venue = Venue.query.filter_by(id=s.venue_id).first()
-    ps.append({
-      "venue_id": venue.id,
-      "venue_name": venue.name,
-      "venue_image_link": venue.image_link,
-      "start_time": s.time
-    })
-  city = City.query.filter_by(id=artist.city_id).first()
-
-  data = {
-    "id": artist.id,
-    "name": artist.name,
-    "genres": vg,
-    "city": city.name,
-    "state": city.state,
-    "phone": artist.phone,
-    "website": artist.website,
-    "facebook_link": artist.facebook_link,
-    "seeking_venue": artist.seeking_venue,
-    "seeking_description": artist.seeking_description,
-    "image_link": artist.image_link,
-    "upcoming_shows":sc,
-    "past_shows":ps,
-    "past_shows_count":len(ps),
-    "upcoming_shows_count":len(sc)
-  }
-
-  return render_template('pages/show_artist.html', artist=data)
+  return render_artist(entity_timeline(Artist, artist_id))
 
 #  Update
 #  ----------------------------------------------------------------
@@ -415,12 +949,11 @@ def show_artist(artist_id):
 def edit_artist(artist_id):
   form = ArtistForm()
 
-  a = Artist.query.filter_by(id=artist_id).first()
-  c = City.query.filter_by(id=a.city_id).first()
-  genre = GenreArtist.query.filter_by(artist_id=a.id).all()
+  a = Artist.query.options(*ARTIST_DETAIL).filter_by(id=artist_id).first()
+  c = a.cartists
   g = []
-  for gv in genre:
-    g.append(Genre.query.filter_by(id=gv.genre_id).first().name)
+  for gv in a.genre:
+    g.append(gv.cartist.name)
   artist = {
     'id':a.id,
     'name':a.name,
@@ -455,46 +988,23 @@ def edit_artist_submission(artist_id):
   form = request.form
   artist = Artist.query.filter_by(id=artist_id).first()
   try:
-    genreA = form.getlist('genres')
-    genreB = []
-    #did the city change?
-    c = City.query.filter_by(name=form.get('city'),state=form.get('state')).first()
-    if c is None:
-      c = City(name=form.get('city'),state=form.get('state'))
-      db.session.add(c)
-      db.session.commit()
-
-    for g in GenreArtist.query.filter_by(artist_id=artist.id).all():
-      genreB.append(Genre.query.filter_by(id=g.genre_id).first().name)
-
-
-    #if a genre is in the before but not after, it is to be removed
-    #if a genre is in the after but not before it needs to be added
-    for g in genreA:
-      if g not in genreB:
-        genre = Genre.query.filter_by(name=g).first()
-        if genre is None:
-          genre = Genre(name=g)
-          db.session.add(genre)
-          db.session.commit()
-          genre = Genre.query.filter_by(name=g).first()
-        gr = GenreArtist(genre_id=genre.id,artist_id=artist.id)
-        db.session.add(gr)
-    for g in genreB:
-      if g not in genreA:
-        toberemoved = GenreArtist.query.filter_by(artist_id=artist.id,genre_id=Genre.query.filter_by(name=g).first().id).first()
-        db.session.delete(toberemoved)
+    #did the city change? city and genres resolve in one go
+    city_id, genres = reference_data.resolve((form.get('city'),form.get('state')), form.getlist('genres'))
+    sync_genres(GenreArtist, GenreArtist.artist_id, artist.id, genres.values())
 
     artist.name = form.get('name')
-    artist.city_id = c.id
+    artist.city_id = city_id
     artist.phone = form.get('phone')
     artist.image_link = form.get('image_link')
     artist.facebook_link = form.get('facebook_link')
     artist.website = form.get('website_link')
     artist.seeking_venue = False if form.get('seeking_venue') is None else True
     artist.seeking_description = form.get('seeking_description')
+    #genre links are separate rows, so touch the artist for its version to move
+    artist.updated_at = func.now()
 
     db.session.commit()
+    invalidate('artist:%d' % artist_id, 'artists')
     flash('Artist ' + request.form['name'] + ' was successfully edited!')
   except:
     db.session.rollback()
@@ -505,12 +1015,11 @@ def edit_artist_submission(artist_id):
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
   form = VenueForm()
-  v = Venue.query.filter_by(id=venue_id).first()
-  c = City.query.filter_by(id=v.city_id).first()
-  genre = GenreVenue.query.filter_by(venue_id=v.id).all()
+  v = Venue.query.options(*VENUE_DETAIL).filter_by(id=venue_id).first()
+  c = v.cvenues
   g = []
-  for gv in genre:
-    g.append(Genre.query.filter_by(id=gv.genre_id).first().name)
+  for gv in v.genre:
+    g.append(gv.cvenue.name)
   venue = {
     'id':v.id,
     'name':v.name,
@@ -547,46 +1056,23 @@ def edit_venue_submission(venue_id):
   form = request.form
   venue = Venue.query.filter_by(id=venue_id).first()
   try:
-    genreA = form.getlist('genres')
-    genreB = []
-    #did the city change?
-    c = City.query.filter_by(name=form.get('city'),state=form.get('state')).first()
-    if c is None:
-      c = City(name=form.get('city'),state=form.get('state'))
-      db.session.add(c)
-      db.session.commit()
-
-    for g in GenreVenue.query.filter_by(venue_id=venue.id).all():
-      genreB.append(Genre.query.filter_by(id=g.genre_id).first().name)
-
-
-    #if a genre is in the before but not after, it is to be removed
-    #if a genre is in the after but not before it needs to be added
-    for g in genreA:
-      if g not in genreB:
-        genre = Genre.query.filter_by(name=g).first()
-        if genre is None:
-          genre = Genre(name=g)
-          db.session.add(genre)
-          db.session.commit()
-          genre = Genre.query.filter_by(name=g).first()
-        gr = GenreVenue(genre_id=genre.id,venue_id=venue.id)
-        db.session.add(gr)
-    for g in genreB:
-      if g not in genreA:
-        toberemoved = GenreVenue.query.filter_by(venue_id=venue.id,genre_id=Genre.query.filter_by(name=g).first().id).first()
-        db.session.delete(toberemoved)
+    #did the city change? city and genres resolve in one go
+    city_id, genres = reference_data.resolve((form.get('city'),form.get('state')), form.getlist('genres'))
+    sync_genres(GenreVenue, GenreVenue.venue_id, venue.id, genres.values())
 
     venue.name = form.get('name')
-    venue.city_id = c.id
+    venue.city_id = city_id
     venue.phone = form.get('phone')
     venue.image_link = form.get('image_link')
     venue.facebook_link = form.get('facebook_link')
     venue.website = form.get('website_link')
     venue.seeking_talent = False if form.get('seeking_talent') is None else True
     venue.seeking_description = form.get('seeking_description')
+    #genre links are separate rows, so touch the venue for its version to move
+    venue.updated_at = func.now()
 
     db.session.commit()
+    invalidate('venue:%d' % venue_id, 'venues')
     flash('venue ' + request.form['name'] + ' was successfully edited!')
   except:
     db.session.rollback()
@@ -608,24 +1094,11 @@ def create_artist_submission():
   # called upon submitting the new artist listing form
   # TODO: insert form data as a new Artist record in the db, instead
   try:
-    #City first
-    city = City.query.filter_by(name=request.form['city'],state=request.form['state']).first()
-    if city is None:
-      city = City(name=request.form['city'],state=request.form['state'])
-      db.session.add(city)
-      db.session.commit()
-    #Next genres
-    genres = []
-    for genre in request.form.getlist('genres'):
-      g = Genre.query.filter_by(name=genre).first()
-      if g is None:
-        g = Genre(name=genre)
-        db.session.add(g)
-        db.session.commit()
-      genres.append(g)
+    #City and genres in one go, nothing is committed until the artist is
+    city_id, genres = reference_data.resolve((request.form['city'],request.form['state']), request.form.getlist('genres'))
     artist = Artist(
       name=request.form['name'],
-      city_id=city.id,
+      city_id=city_id,
       phone=request.form['phone'],
       image_link = request.form['image_link'],
       facebook_link = request.form.get('facebook_link',False),
@@ -633,15 +1106,11 @@ def create_artist_submission():
       seeking_description = None if 'seeking_description' not in request.form.keys() else request.form.get('seeking_description'),
       website = request.form.get('website_link',False)
     )
+    for genre_id in genres.values():
+      artist.genre.append(GenreArtist(genre_id=genre_id))
     db.session.add(artist)
     db.session.commit()
-    for g in genres:
-      gv = GenreArtist(
-        artist_id = artist.id,
-        genre_id = g.id
-      )
-      db.session.add(gv)
-    db.session.commit()
+    invalidate('artists')
   # TODO: modify data to be the data object returned from db insertion
 
     # on successful db insert, flash success
@@ -656,23 +1125,101 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
+#Filters and page size shared by the /shows page and its JSON variant.
+def shows_request_args():
+  args = request.args
+  filters = {}
+  try:
+    for key in ('start', 'end'):
+      if args.get(key):
+        filters[key] = parse_datetime(args[key])
+  except (ValueError, OverflowError):
+    abort(400)
+  filters['city_id'] = args.get('city_id', type=int)
+  limit = args.get('limit', app.config['SHOWS_PAGE_SIZE'], type=int)
+  filters['limit'] = max(1, min(limit, app.config['SHOWS_MAX_PAGE_SIZE']))
+  #keep the raw filter values so the pager links carry them along
+  keep = {k: args[k] for k in ('start', 'end', 'city_id', 'limit') if args.get(k)}
+  return filters, keep
+
+#Shows pages render artist and venue names, so they go stale with any of them.
+def tag_shows_page(page):
+  page_cache.tag('shows')
+  for s in page['shows']:
+    page_cache.tag('venue:%d' % s['venue_id'], 'artist:%d' % s['artist_id'])
+
+def render_shows(page, keep):
+  tag_shows_page(page)
+  return render_template('pages/shows.html',
+    shows=page['shows'],
+    next_url=url_for('shows', after=page['next'], **keep) if page['next'] else None,
+    prev_url=url_for('shows', before=page['prev'], **keep) if page['prev'] else None
+  )
+
 @app.route('/shows')
+@conditional(shows_version)
+@page_cache.page
 def shows():
   # displays list of shows at /shows
-  # TODO: replace with real venues data.
-  data=[]
-  shows = Show.query.all()
-  for s in shows:
-    a = Artist.query.filter_by(id=s.artist_id).first()
-    data.append({
-      'venue_id':s.venue_id,
-      'venue_name':Venue.query.filter_by(id=s.venue_id).first().name,
-      'artist_id':s.artist_id,
-      'artist_name':a.name,
-      'artist_image_link':a.image_link,
-      'start_time':s.time
-    })
-  return render_template('pages/shows.html', shows=data)
+  filters, keep = shows_request_args()
+  return render_shows(shows_page(request.args.get('after'), request.args.get('before'), **filters), keep)
+
+@app.route('/shows.json')
+@conditional(shows_version)
+@page_cache.page
+def shows_json():
+  filters, keep = shows_request_args()
+  page = shows_page(request.args.get('after'), request.args.get('before'), **filters)
+  tag_shows_page(page)
+  for s in without_tile_versions(page['shows']):
+    s['start_time'] = s['start_time'].isoformat()
+  return jsonify(page)
+
+#Exports are streamed as they are read, so they skip the page cache.
+def export_response(lines, filename, fmt):
+  response = Response(stream_with_context(buffered(lines)), mimetype=FORMATS[fmt])
+  response.headers['Content-Disposition'] = 'attachment; filename=%s' % filename
+  return response
+
+def venue_page_url(show):
+  return url_for('show_venue', venue_id=show.venue_id, _external=True)
+
+@app.route('/shows/export.<fmt>')
+def export_shows_file(fmt):
+  if fmt not in FORMATS:
+    abort(404)
+  filters, keep = shows_request_args()
+  filters.pop('limit')
+  rows = export_shows(**filters)
+  return export_response(export_lines(fmt, SHOW_EXPORT, rows, 'Fyyur shows', venue_page_url), 'shows.' + fmt, fmt)
+
+@app.route('/venues/<int:venue_id>/shows.ics')
+def export_venue_calendar(venue_id):
+  name = db.session.query(Venue.name).filter(Venue.id==venue_id).scalar()
+  if name is None:
+    abort(404)
+  rows = export_shows(venue_id=venue_id)
+  return export_response(export_lines('ics', SHOW_EXPORT, rows, name, venue_page_url), 'venue-%d.ics' % venue_id, 'ics')
+
+@app.route('/artists/<int:artist_id>/shows.ics')
+def export_artist_calendar(artist_id):
+  name = db.session.query(Artist.name).filter(Artist.id==artist_id).scalar()
+  if name is None:
+    abort(404)
+  rows = export_shows(artist_id=artist_id)
+  return export_response(export_lines('ics', SHOW_EXPORT, rows, name, venue_page_url), 'artist-%d.ics' % artist_id, 'ics')
+
+@app.route('/venues/export.<fmt>')
+def export_venues_file(fmt):
+  if fmt not in ('csv', 'jsonl'):
+    abort(404)
+  return export_response(export_lines(fmt, VENUE_EXPORT, export_venues()), 'venues.' + fmt, fmt)
+
+@app.route('/artists/export.<fmt>')
+def export_artists_file(fmt):
+  if fmt not in ('csv', 'jsonl'):
+    abort(404)
+  return export_response(export_lines(fmt, ARTIST_EXPORT, export_artists()), 'artists.' + fmt, fmt)
 
 @app.route('/shows/create')
 def create_shows():
@@ -686,9 +1233,12 @@ def create_show_submission():
   # TODO: insert form data as a new Show record in the db, instead
   try:
     form = request.form
-    s = Show(artist_id=form.get('artist_id'),venue_id=form.get('venue_id'),time=form.get('start_time'))
+    s = Show(artist_id=int(form.get('artist_id')),venue_id=int(form.get('venue_id')),time=parse_datetime(form.get('start_time')))
     db.session.add(s)
+    db.session.flush()
+    shift_upcoming_counts(1, Show.id==s.id)
     db.session.commit()
+    invalidate('shows', 'venue:%d' % s.venue_id, 'artist:%d' % s.artist_id)
     # on successful db insert, flash success
     flash('Show was successfully listed!')
   # TODO: on unsuccessful db insert, flash an error instead.
@@ -698,6 +1248,102 @@ def create_show_submission():
   # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
   return render_template('pages/home.html')
 
+#Cache keys and hit rates, for development only: anyone could read them, so they are not
+#served with debug mode off.
+if app.config['DEBUG']:
+  @app.route('/cache/stats')
+  def cache_stats():
+    return jsonify(dict(page_cache.stats(), fragments=fragment_cache.stats()))
+
+#  API v1
+#  ----------------------------------------------------------------
+#  The same builders as the pages above, as JSON.  Every response is {data, meta, links};
+#  `fields=id,name,...` trims each record and `limit` pages the lists, with `offset` or, for
+#  /venues and /shows, the `after` cursor from meta.next.
+
+def api_limit(default):
+  limit = request.args.get('limit', default, type=int)
+  return max(1, min(limit, app.config['API_MAX_PAGE_SIZE']))
+
+def api_page_args(default):
+  offset = max(request.args.get('offset', 0, type=int), 0)
+  return offset, api_limit(default)
+
+#Carries the filters and field selection over into the pager links.
+def api_links(endpoint, keep, **pages):
+  if request.args.get('fields'):
+    keep = dict(keep, fields=request.args['fields'])
+  return {name: url_for(endpoint, **dict(keep, **args)) if args else None for name, args in pages.items()}
+
+def offset_links(endpoint, keep, offset, limit, total):
+  return api_links(endpoint, keep,
+    next={'offset':offset + limit, 'limit':limit} if offset + limit < total else None,
+    prev={'offset':max(offset - limit, 0), 'limit':limit} if offset > 0 else None)
+
+@api.route('/venues')
+@conditional(venues_version)
+def api_venues():
+  limit = api_limit(app.config['API_PAGE_SIZE'])
+  page = venues_page(request.args.get('after'), limit)
+  keep = {'limit':request.args['limit']} if request.args.get('limit') else {}
+  links = api_links('api.api_venues', keep, next={'after':page['next']} if page['next'] else None)
+  return api_response(page['data'], {'limit':limit, 'next':page['next']}, links)
+
+@api.route('/venues/<int:venue_id>')
+@conditional(venue_version)
+def api_venue(venue_id):
+  data = entity_timeline(Venue, venue_id)
+  if data is None:
+    abort(404)
+  without_tile_versions(data['upcoming_shows'] + data['past_shows'])
+  return api_response(data)
+
+@api.route('/venues/search')
+def api_search_venues():
+  term = request.args.get('q', '')
+  offset, limit = api_page_args(app.config['SEARCH_PAGE_SIZE'])
+  page = search_page(venue_search, term, offset, limit)
+  meta = {'count':page['count'], 'offset':offset, 'limit':limit}
+  return api_response(page['data'], meta, offset_links('api.api_search_venues', {'q':term}, offset, limit, page['count']))
+
+@api.route('/artists')
+@conditional(artists_version)
+def api_artists():
+  offset, limit = api_page_args(app.config['API_PAGE_SIZE'])
+  total = db.session.query(func.count(Artist.id)).scalar()
+  meta = {'count':total, 'offset':offset, 'limit':limit}
+  return api_response(artist_cards(offset, limit), meta, offset_links('api.api_artists', {}, offset, limit, total))
+
+@api.route('/artists/<int:artist_id>')
+@conditional(artist_version)
+def api_artist(artist_id):
+  data = entity_timeline(Artist, artist_id)
+  if data is None:
+    abort(404)
+  without_tile_versions(data['upcoming_shows'] + data['past_shows'])
+  return api_response(data)
+
+@api.route('/artists/search')
+def api_search_artists():
+  term = request.args.get('q', '')
+  offset, limit = api_page_args(app.config['SEARCH_PAGE_SIZE'])
+  page = search_page(artist_search, term, offset, limit)
+  meta = {'count':page['count'], 'offset':offset, 'limit':limit}
+  return api_response(page['data'], meta, offset_links('api.api_search_artists', {'q':term}, offset, limit, page['count']))
+
+@api.route('/shows')
+@conditional(shows_version)
+def api_shows():
+  filters, keep = shows_request_args()
+  page = shows_page(request.args.get('after'), request.args.get('before'), **filters)
+  meta = {'limit':filters['limit'], 'next':page['next'], 'prev':page['prev']}
+  links = api_links('api.api_shows', keep,
+    next={'after':page['next']} if page['next'] else None,
+    prev={'before':page['prev']} if page['prev'] else None)
+  return api_response(without_tile_versions(page['shows']), meta, links)
+
+app.register_blueprint(api)
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -708,7 +1354,7 @@ def server_error(error):
 
 
 if not app.debug:
-    file_handler = FileHandler('error.log')
+    file_handler = FileHandler(app.config['ERROR_LOG'])
     file_handler.setFormatter(
         Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
     )
@@ -717,6 +1363,90 @@ if not app.debug:
     app.logger.addHandler(file_handler)
     app.logger.info('errors')
 
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+@app.cli.command('import')
+@click.argument('kind', type=click.Choice(['venues', 'artists', 'shows']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--chunk-size', default=1000, show_default=True, help='Rows per upsert and commit.')
+def import_command(kind, path, fmt, chunk_size):
+  """Bulk import venues, artists or shows from a CSV or JSONL file."""
+  from importer import import_file
+  import_file(kind, path, fmt, chunk_size)
+
+@app.cli.command('export')
+@click.argument('kind', type=click.Choice(['venues', 'artists', 'shows']))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl', 'ics']), default='csv', show_default=True, help='ics is for shows only.')
+@click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-', help='Defaults to stdout.')
+@click.option('--start', type=click.DateTime(), help='Shows starting at or after this time.')
+@click.option('--end', type=click.DateTime(), help='Shows starting before this time.')
+@click.option('--city-id', type=int, help='Shows at venues in this city.')
+@click.option('--venue-id', type=int, help='Shows at this venue.')
+@click.option('--artist-id', type=int, help='Shows by this artist.')
+def export_command(kind, fmt, output, **filters):
+  """Stream venues, artists or shows out as CSV, JSONL or iCalendar."""
+  if kind == 'shows':
+    lines = export_lines(fmt, SHOW_EXPORT, export_shows(**filters), 'Fyyur shows')
+  elif fmt == 'ics':
+    raise click.BadParameter('only shows can be exported as ics', param_hint='--format')
+  elif kind == 'venues':
+    lines = export_lines(fmt, VENUE_EXPORT, export_venues())
+  else:
+    lines = export_lines(fmt, ARTIST_EXPORT, export_artists())
+  for chunk in buffered(lines):
+    output.write(chunk)
+
+@app.cli.command('roll-upcoming')
+def roll_upcoming_command():
+  """Take shows that have started off the upcoming show counts.  Run it on a schedule."""
+  passed = roll_upcoming_counts()
+  db.session.commit()
+  #reaches a shared (redis) cache; the servers' memory caches pass over their old pages by version
+  invalidate('venues')
+  click.echo('%d shows moved into the past' % passed)
+
+@app.cli.command('reconcile-upcoming')
+@click.option('--check', is_flag=True, help='Only report drift, and exit 1 if there is any.')
+def reconcile_upcoming_command(check):
+  """Compare the upcoming show counts with the shows and repair any drift."""
+  drift = reconcile_upcoming_counts(repair=not check)
+  db.session.commit()
+  for kind, rows in drift.items():
+    for key, stored, actual in rows:
+      click.echo('%s %d: counted %d, actually %d' % (kind, key, stored, actual))
+  found = sum(len(rows) for rows in drift.values())
+  if found and not check:
+    #as in roll-upcoming, only a shared cache hears of it
+    invalidate('venues')
+  click.echo('%d counts %s' % (found, 'off' if check else 'repaired'))
+  if check and found:
+    sys.exit(1)
+
+@app.cli.command('compile-templates')
+def compile_templates_command():
+  """Compile every template into TEMPLATE_CACHE_DIR.  Run it at build time, in the directory the app is served from."""
+  cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+  os.makedirs(cache.directory, exist_ok=True)
+  cache.clear()
+  app.jinja_env.bytecode_cache = cache
+  names = app.jinja_env.list_templates(extensions=['html'])
+  for name in names:
+    app.jinja_env.get_template(name)
+  click.echo('%d templates compiled into %s' % (len(names), cache.directory))
+
+@app.cli.command('build-assets')
+@click.option('--clean', is_flag=True, help='Remove earlier builds first.')
+def build_assets_command(clean):
+  """Bundle, minify, hash and precompress the static files into static/ASSETS_DIR.  Run it at build time."""
+  written = assets.build(clean=clean)
+  click.echo('%d files, %d bytes, %d .br and %d .gz copies written into %s' % (
+    written['files'], written['bytes'], written['br'], written['gzip'], assets.directory))
+  if not written['br']:
+    click.echo('.br copies need the brotli package')
+
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
@@ -0,0 +1,273 @@
+#----------------------------------------------------------------------------#
+# Async serving mode.
+#
+#   uvicorn asgi:application --workers N
+#
+# The read pages (venues, artists, shows, the venue and artist pages and both
+# searches) are served by coroutines reading through an async SQLAlchemy
+# engine, asyncpg on Postgres and aiosqlite on SQLite, so a worker waiting on
+# the database goes on serving other requests.  Queries that don't depend on
+# each other run at the same time, each on its own pooled connection: the
+# header, genres and show timeline of a detail page, and the count and hits
+# of a Postgres search.  The statements, the page cache, the conditional GET
+# validators and the templates are the ones the sync views use.
+#
+# Every other request goes to the WSGI app through asgiref's WsgiToAsgi,
+# which runs them one at a time on a worker thread, so write-heavy or
+# export-heavy deployments are better off on the sync server.  The request
+# metrics middleware only sees those requests.
+#
+# Needs asgiref, an ASGI server such as uvicorn and the async driver.
+#----------------------------------------------------------------------------#
+
+import asyncio
+import io
+import sys
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import make_response, request
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.exceptions import HTTPException
+
+from app import (app, page_cache, sql_stats, Venue, Artist, venue_search, artist_search,
+                 venues_statement, venue_areas, timeline_statements, timeline_data,
+                 artist_cards_statement, artist_cards_data, shows_request_args, shows_statement,
+                 shows_result, search_window, search_result, upcoming_counts_statement,
+                 version_statement, version_of, venues_sources, venue_sources, artists_sources,
+                 artist_sources, shows_sources, render_venues, render_venue, render_artists,
+                 render_artist, render_shows, render_search)
+from cache import cacheable, not_modified, stamp, validators
+
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+
+
+def async_url(url):
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+def make_engine(config):
+    url = make_url(config['ASYNC_DATABASE_URI'] or async_url(config['SQLALCHEMY_DATABASE_URI']))
+    options = {}
+    if url.get_backend_name() != 'sqlite':
+        options.update(pool_size=config['ASYNC_POOL_SIZE'], max_overflow=config['ASYNC_MAX_OVERFLOW'])
+    return create_async_engine(url, **options)
+
+
+engine = make_engine(app.config)
+sql_stats.watch(engine.sync_engine)
+
+
+async def fetch(statement):
+    async with engine.connect() as connection:
+        return (await connection.execute(statement)).all()
+
+
+async def fetch_all(*statements):
+    return await asyncio.gather(*[fetch(statement) for statement in statements])
+
+
+#----------------------------------------------------------------------------#
+# Views.
+#----------------------------------------------------------------------------#
+
+# endpoint -> coroutine taking the view args
+VIEWS = {}
+
+
+def read(endpoint, sources=None):
+    # registers the async twin of a read view; with sources it gets the
+    # conditional GET and page cache its sync twin has
+    def decorator(view):
+        async def wrapper(**view_args):
+            if sources is None or not cacheable():
+                return await view(**view_args)
+            rows = await fetch(version_statement(*sources(**view_args)))
+            etag, last_modified = validators(*version_of(rows[0]))
+            response = not_modified(etag, last_modified) or page_cache.lookup(etag)
+            if response is None:
+                response = page_cache.store(make_response(await view(**view_args)), etag)
+            return stamp(response, etag, last_modified)
+        VIEWS[endpoint] = wrapper
+        return view
+    return decorator
+
+
+@read('venues', venues_sources)
+async def venues():
+    return render_venues(venue_areas(await fetch(venues_statement())))
+
+
+@read('show_venue', venue_sources)
+async def show_venue(venue_id):
+    return render_venue(timeline_data(Venue, *await fetch_all(*timeline_statements(Venue, venue_id))))
+
+
+@read('artists', artists_sources)
+async def artists():
+    return render_artists(artist_cards_data(await fetch(artist_cards_statement())))
+
+
+@read('show_artist', artist_sources)
+async def show_artist(artist_id):
+    return render_artist(timeline_data(Artist, *await fetch_all(*timeline_statements(Artist, artist_id))))
+
+
+@read('shows', shows_sources)
+async def shows():
+    filters, keep = shows_request_args()
+    after, before = request.args.get('after'), request.args.get('before')
+    rows = await fetch(shows_statement(after, before, **filters))
+    return render_shows(shows_result(rows, after, before, filters['limit']), keep)
+
+
+async def search_page(searcher):
+    term = request.form.get('search_term', '')
+    offset, limit = search_window()
+    if engine.dialect.name == 'postgresql':
+        total, hits = await fetch_all(*searcher.trigram_statements(term, limit, offset))
+        total = total[0][0]
+        hits = [tuple(hit) for hit in hits]
+    else:
+        # the in-process n-gram index, no database round trip
+        total, hits = searcher.search(term, limit=limit, offset=offset)
+    counts = {}
+    if hits:
+        counts = dict(await fetch(upcoming_counts_statement(searcher.model, [key for key, name in hits])))
+    return search_result(total, hits, counts, offset, limit)
+
+
+@read('search_venues')
+async def search_venues():
+    return render_search('venues', await search_page(venue_search))
+
+
+@read('search_artists')
+async def search_artists():
+    return render_search('artists', await search_page(artist_search))
+
+
+#----------------------------------------------------------------------------#
+# ASGI.
+#----------------------------------------------------------------------------#
+
+def wsgi_environ(scope, body=b''):
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope['http_version'],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    server = scope.get('server') or ('localhost', 80)
+    environ['SERVER_NAME'] = server[0]
+    environ['SERVER_PORT'] = str(server[1] or 80)
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin-1')
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def dispatch(environ, view):
+    # Flask.wsgi_app with the view awaited
+    ctx = app.request_context(environ)
+    error = None
+    try:
+        try:
+            ctx.push()
+            app.try_trigger_before_first_request_functions()
+            response = app.preprocess_request()
+            if response is None:
+                response = await view(**request.view_args)
+        except Exception as e:
+            response = app.handle_user_exception(e)
+        return app.finalize_request(response)
+    except Exception as e:
+        error = e
+        return app.handle_exception(e)
+    finally:
+        ctx.auto_pop(error)
+
+
+async def send_response(send, response, method):
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in response.headers.items()]
+    })
+    await send({'type': 'http.response.body', 'body': b'' if method == 'HEAD' else response.get_data()})
+    response.close()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+def closing(wsgi_app):
+    # asgiref sends the response body but never closes it, as a WSGI server
+    # must; the request metrics record a request when its body is closed
+    def application(environ, start_response):
+        body = wsgi_app(environ, start_response)
+        try:
+            yield from body
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+    return application
+
+
+wsgi_application = WsgiToAsgi(closing(app))
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] == 'http':
+        environ = wsgi_environ(scope)
+        try:
+            endpoint, view_args = app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            endpoint = None
+        view = VIEWS.get(endpoint)
+        if view is not None:
+            body = await read_body(receive)
+            # the whole body, however it came: a chunked request has no
+            # Content-Length, and werkzeug reads none without one
+            environ['wsgi.input'] = io.BytesIO(body)
+            environ['wsgi.input_terminated'] = True
+            environ['CONTENT_LENGTH'] = str(len(body))
+            return await send_response(send, await dispatch(environ, view), scope['method'])
+    await wsgi_application(scope, receive, send)
@@ -0,0 +1,245 @@
+#----------------------------------------------------------------------------#
+# Static assets: bundles, content-hashed names and precompressed copies.
+#
+#   flask build-assets [--clean]      (writes static/ASSETS_DIR)
+#
+# layouts/main.html loads its stylesheets and scripts as the BUNDLES below.
+# The build joins each bundle's files, minifies what isn't already, and
+# writes the result and a copy of every other file under static/ with a
+# hash of its contents in the name, e.g. dist/img/front-splash.3c9a1f0e2b4d.jpg.
+# Text files also get .gz and, with the brotli package installed, .br
+# copies, kept when they are smaller.  url() references in stylesheets are
+# pointed at the hashed names.  manifest.json records it all.
+#
+# With a manifest, url_for('static', filename=...) gives the hashed name
+# and bundle(name) in templates the bundle's one URL; without one, they give
+# the files as they are, so a checkout runs unbuilt.  A hashed name's
+# contents never change, so it is sent cacheable for ASSETS_MAX_AGE and
+# immutable, as the .br or .gz copy when Accept-Encoding takes it.  Other
+# static files keep Flask's defaults.
+#
+# Rebuilding leaves earlier hashed files in place, for pages cached or open
+# in a browser that still name them; --clean removes them first.
+#----------------------------------------------------------------------------#
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+
+from flask import request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# bundle -> its files under static/, in load order
+BUNDLES = {
+    'site.css': ['css/bootstrap.min.css', 'css/layout.main.css', 'css/main.css', 'css/main.responsive.css',
+                 'css/main.quickfix.css'],
+    # loaded in <head>, before the page renders
+    'head.js': ['js/libs/modernizr-2.8.2.min.js', 'js/libs/moment.min.js'],
+    # deferred, after jQuery
+    'site.js': ['js/script.js', 'js/libs/bootstrap-3.1.1.min.js', 'js/plugins.js']
+}
+COMPRESSIBLE = ('.css', '.js', '.map', '.svg', '.eot', '.ttf', '.otf', '.ico', '.json', '.txt')
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+MANIFEST = 'manifest.json'
+
+CSS_TOKENS = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|(/\*.*?\*/)|(\s+)|([^"'/\s]+|/)''', re.S)
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+def minify_css(text):
+    pieces = []
+    for string, comment, space, other in CSS_TOKENS.findall(text):
+        if comment:
+            # licences, /*! ... */, stay
+            if comment.startswith('/*!'):
+                pieces.append(comment + '\n')
+        elif space:
+            if pieces and pieces[-1] != ' ':
+                pieces.append(' ')
+        else:
+            pieces.append(string or other)
+    out = []
+    for i, piece in enumerate(pieces):
+        if piece == ' ':
+            after = pieces[i + 1] if i + 1 < len(pieces) else ''
+            # no space is needed next to punctuation; not before ':' though,
+            # 'a :hover' and 'a:hover' are different selectors
+            if not out or not after or out[-1][-1] in '{};:,>(\n' or after[0] in '{};,>)':
+                continue
+        out.append(piece)
+    return ''.join(out).strip() + '\n'
+
+
+def minify_js(text):
+    # Only what can't change what a script means: indentation, blank lines
+    # and lines that are just a // comment.  The libraries ship minified.
+    lines = (line.strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//')) + '\n'
+
+
+def fingerprint(name, data):
+    root, ext = posixpath.splitext(name)
+    return '%s.%s%s' % (root, hashlib.sha256(data).hexdigest()[:12], ext)
+
+
+def point_urls(css, source, target, files):
+    # url()s in css, relative to source, made relative to target and to
+    # the hashed names where there are some
+    def replace(match):
+        path = match.group(2).strip()
+        if path.startswith(('data:', '#', '/')) or '://' in path:
+            return match.group(0)
+        # font urls carry ?#iefix and #svgid suffixes
+        path, suffix = re.match(r'([^?#]*)(.*)', path).groups()
+        found = posixpath.normpath(posixpath.join(posixpath.dirname(source), path))
+        found = files.get(found, found)
+        return 'url("%s%s")' % (posixpath.relpath(found, posixpath.dirname(target)), suffix)
+    return CSS_URL.sub(replace, css)
+
+
+def compressed(data):
+    # {encoding: bytes}, for the encodings that make data smaller, the
+    # one to send first
+    found = {}
+    if brotli is not None:
+        found['br'] = brotli.compress(data, quality=11)
+    found['gzip'] = gzip.compress(data, 9, mtime=0)
+    return {encoding: body for encoding, body in found.items() if len(body) < len(data)}
+
+
+class Assets:
+
+    def __init__(self, app=None):
+        self.app = None
+        self.files = {}
+        self.bundles = {}
+        self.encodings = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_DIR', 'dist')
+        app.config.setdefault('ASSETS_MAX_AGE', 365 * 24 * 3600)
+        self.app = app
+        self.load()
+        app.url_defaults(self.hashed)
+        app.view_functions['static'] = self.send
+        app.jinja_env.globals['bundle'] = self.urls
+
+    @property
+    def directory(self):
+        return os.path.join(self.app.static_folder, self.app.config['ASSETS_DIR'])
+
+    def load(self):
+        # the manifest of the last build, if any
+        try:
+            with open(os.path.join(self.directory, MANIFEST)) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+        self.files = manifest.get('files', {})
+        self.bundles = manifest.get('bundles', {})
+        self.encodings = manifest.get('encodings', {})
+
+    def hashed(self, endpoint, values):
+        # url_for('static', filename=...) names the hashed copy
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = self.files.get(values['filename'], values['filename'])
+
+    def urls(self, name):
+        if name in self.bundles:
+            return [url_for('static', filename=self.bundles[name])]
+        return [url_for('static', filename=filename) for filename in BUNDLES[name]]
+
+    def send(self, filename):
+        encodings = self.encodings.get(filename)
+        if encodings is None:
+            return self.app.send_static_file(filename)
+        encoding = request.accept_encodings.best_match(encodings) if encodings else None
+        response = send_from_directory(self.app.static_folder, filename + SUFFIXES[encoding] if encoding else filename,
+                                       mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                                       max_age=self.app.config['ASSETS_MAX_AGE'])
+        if encoding:
+            response.content_encoding = encoding
+        if encodings:
+            response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    def build(self, clean=False):
+        static = self.app.static_folder
+        prefix = self.app.config['ASSETS_DIR']
+        if clean:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        sources = []
+        for root, dirs, names in os.walk(static):
+            rel = os.path.relpath(root, static)
+            # neither this build nor any other
+            if rel == prefix or MANIFEST in names:
+                dirs[:] = []
+                continue
+            for name in names:
+                if not name.startswith('.'):
+                    sources.append(posixpath.normpath(posixpath.join(rel.replace(os.sep, '/'), name)))
+
+        files, encodings, written = {}, {}, {'files': 0, 'bytes': 0, 'br': 0, 'gzip': 0}
+
+        def write(name, data):
+            hashed = posixpath.join(prefix, fingerprint(name, data))
+            path = os.path.join(static, hashed)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+            encodings[hashed] = []
+            if name.endswith(COMPRESSIBLE):
+                for encoding, body in compressed(data).items():
+                    with open(path + SUFFIXES[encoding], 'wb') as f:
+                        f.write(body)
+                    encodings[hashed].append(encoding)
+                    written[encoding] += 1
+            written['files'] += 1
+            written['bytes'] += len(data)
+            return hashed
+
+        def read(name):
+            with open(os.path.join(static, name), 'rb') as f:
+                return f.read()
+
+        # stylesheets last, they name the others
+        for name in sorted(sources, key=lambda name: (name.endswith('.css'), name)):
+            data = read(name)
+            if name.endswith('.css'):
+                # the hashed copy sits under prefix, a level or more deeper
+                target = posixpath.join(prefix, name)
+                data = point_urls(data.decode('utf-8'), name, target, files).encode('utf-8')
+            files[name] = write(name, data)
+
+        bundles = {}
+        for bundle, names in BUNDLES.items():
+            target = posixpath.join(prefix, 'bundles', bundle)
+            if bundle.endswith('.css'):
+                text = ''.join(minify_css(point_urls(read(name).decode('utf-8'), name, target, files)) for name in names)
+            else:
+                # a ; between scripts, for one that leaves its last statement open
+                text = ';\n'.join(read(name).decode('utf-8') if name.endswith('.min.js') else minify_js(read(name).decode('utf-8'))
+                                  for name in names)
+            bundles[bundle] = write(posixpath.join('bundles', bundle), text.encode('utf-8'))
+
+        manifest = {'files': files, 'bundles': bundles, 'encodings': encodings}
+        path = os.path.join(self.directory, MANIFEST)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        # workers starting meanwhile read the old manifest or the new one
+        os.replace(path + '.tmp', path)
+        self.load()
+        return written
@@ -0,0 +1,102 @@
+#----------------------------------------------------------------------------#
+# What a page costs in static files, before and after `flask build-assets`.
+#
+#   python -m benchmarks.assets --database sqlite:////tmp/fyyur-bench.db \
+#       [--reseed] [--output FILE]
+#
+# Renders each page in a fresh interpreter, then fetches every /static/ URL
+# it names through the test client, as a browser that takes br and gzip
+# would.  Counted are the requests, the bytes of their bodies, and the
+# requests a repeat visit makes again, those not sent cacheable with a
+# max-age.  It runs with the files as they are ('unbuilt'), and with a
+# build written for the run into a scratch directory under static/
+# ('built').  Files from other hosts (the CDN jQuery, Font Awesome's kit)
+# aren't counted.
+#----------------------------------------------------------------------------#
+
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+from benchmarks.dataset import DEFAULTS, add_arguments, seed, use_database
+
+PATHS = ('/', '/venues', '/shows')
+STATIC = re.compile(r'''(?:href|src)=["'](/static/[^"']+)''')
+
+
+def child(paths):
+    # one page load per path, as JSON on stdout
+    import logging
+    import app
+    logging.getLogger(app.app.logger.name).setLevel(logging.WARNING)
+    client = app.app.test_client()
+    result = {}
+    for path in paths:
+        urls = STATIC.findall(client.get(path).get_data(as_text=True))
+        found = {'requests': 0, 'bytes': 0, 'repeated': 0, 'missing': 0}
+        for url in urls:
+            response = client.get(url, headers={'Accept-Encoding': 'gzip, deflate, br'})
+            if response.status_code == 404:
+                found['missing'] += 1
+            else:
+                found['requests'] += 1
+                found['bytes'] += len(response.get_data())
+                if not response.cache_control.max_age:
+                    found['repeated'] += 1
+            response.close()
+        result[path] = found
+    json.dump(result, sys.stdout)
+
+
+def run(database, paths, assets_dir):
+    env = dict(os.environ, DATABASE_URL=database, ASSETS_DIR=assets_dir)
+    out = subprocess.run([sys.executable, '-m', 'benchmarks.assets', '--database', database, '--child', json.dumps(paths)],
+                         env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    return json.loads(out.stdout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Static files a page costs, before and after building them.')
+    add_arguments(parser)
+    parser.add_argument('--reseed', action='store_true', help='drop and seed the database first')
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    use_database(args.database)
+    if args.child:
+        return child(json.loads(args.child))
+    from app import app, db
+    if args.reseed:
+        with app.app_context():
+            seed(db, {key: getattr(args, key) for key in DEFAULTS}, echo=lambda line: print(line, file=sys.stderr))
+
+    scratch = '.bench-assets-%d' % os.getpid()
+    result = {}
+    try:
+        subprocess.run([sys.executable, '-m', 'flask', 'build-assets'], check=True, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, env=dict(os.environ, FLASK_APP='app', ASSETS_DIR=scratch))
+        # a directory that doesn't exist leaves the files as they are
+        for mode, assets_dir in (('unbuilt', scratch + '-none'), ('built', scratch)):
+            result[mode] = run(args.database, list(PATHS), assets_dir)
+            for path, found in result[mode].items():
+                print('%-8s %-8s %2d requests  %8d bytes  %2d again on a repeat visit' % (
+                    mode, path, found['requests'], found['bytes'], found['repeated']), file=sys.stderr)
+    finally:
+        shutil.rmtree(os.path.join(app.static_folder, scratch), ignore_errors=True)
+
+    text = json.dumps(result, indent=2, sort_keys=True) + '\n'
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
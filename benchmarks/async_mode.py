@@ -0,0 +1,187 @@
+#----------------------------------------------------------------------------#
+# Sync against async serving under many concurrent clients.
+#
+#   python -m benchmarks.async_mode --database sqlite:////tmp/fyyur-bench.db \
+#       [--reseed] [--clients 128] [--requests 3000] [--warm-cache] [--output FILE]
+#
+# Serves the app twice, each in a child process: the sync mode on werkzeug's
+# threaded server (what app.run() does) and the async mode (asgi.py) on
+# uvicorn.  Both get the same requests to the read pages asgi.py serves,
+# from --clients connections open at once, and report latency percentiles
+# and throughput per mode.  The page cache is off in both unless
+# --warm-cache is given, so they do the database work every time.  Needs
+# uvicorn and the async driver for the database.
+#----------------------------------------------------------------------------#
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from itertools import count
+from urllib.parse import urlencode
+
+from benchmarks.dataset import DEFAULTS, add_arguments, seed, use_database
+from benchmarks.run import requests_for, summary
+
+MODES = ('sync', 'async')
+
+
+def serve(mode, port, warm_cache):
+    from app import app, page_cache
+    from cache import MemoryCache
+    logging.getLogger(app.logger.name + '.sql').setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    if not warm_cache:
+        page_cache.backend = MemoryCache(maxsize=0)
+    if mode == 'sync':
+        from werkzeug.serving import run_simple
+        run_simple('127.0.0.1', port, app, threaded=True)
+    else:
+        import uvicorn
+        from asgi import application
+        uvicorn.run(application, host='127.0.0.1', port=port, log_level='warning')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('server exited with %d' % process.returncode)
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server did not come up on port %d' % port)
+
+
+async def fetch(port, method, path, data):
+    # one request on its own connection, returns the status
+    body = urlencode(data).encode() if data is not None else b''
+    head = '%s %s HTTP/1.1\r\nHost: 127.0.0.1:%d\r\nConnection: close\r\n' % (method, path, port)
+    if data is not None:
+        head += 'Content-Type: application/x-www-form-urlencoded\r\nContent-Length: %d\r\n' % len(body)
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(head.encode() + b'\r\n' + body)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    return int(response.split(b' ', 2)[1])
+
+
+async def load(port, flat, total, clients):
+    tickets = count()
+    timings = defaultdict(list)
+    errors = []
+
+    async def client():
+        while True:
+            n = next(tickets)
+            if n >= total:
+                return
+            endpoint, method, path, data = flat[n % len(flat)]
+            started = time.perf_counter()
+            try:
+                status = await fetch(port, method, path, data)
+            except OSError as e:
+                errors.append('%s %s: %s' % (method, path, e))
+                continue
+            if status >= 400:
+                errors.append('%s %s answered %d' % (method, path, status))
+                continue
+            timings[endpoint].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[client() for i in range(clients)])
+    elapsed = time.perf_counter() - started
+    everything = [t for latencies in timings.values() for t in latencies]
+    return dict(summary(everything), **{
+        'errors': len(errors),
+        'throughput_rps': round(len(everything) / elapsed, 1),
+        'routes': {endpoint: summary(latencies) for endpoint, latencies in timings.items()}
+    }), errors
+
+
+def run_mode(mode, database, flat, args):
+    port = free_port()
+    command = [sys.executable, '-m', 'benchmarks.async_mode', '--database', database,
+               '--serve', mode, '--port', str(port)]
+    if args.warm_cache:
+        command.append('--warm-cache')
+    process = subprocess.Popen(command, env=dict(os.environ, DATABASE_URL=database))
+    try:
+        wait_for(port, process)
+        # one pass over the plan warms both servers up, it is not measured
+        asyncio.run(load(port, flat, len(flat), args.clients))
+        return asyncio.run(load(port, flat, args.requests, args.clients))
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the sync and async serving modes.')
+    add_arguments(parser)
+    parser.add_argument('--reseed', action='store_true', help='drop and seed the database first')
+    parser.add_argument('--clients', type=int, default=128, help='connections open at once')
+    parser.add_argument('--requests', type=int, default=3000, help='requests per mode')
+    parser.add_argument('--warm-cache', action='store_true', help='leave the page cache on')
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    parser.add_argument('--serve', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    use_database(args.database)
+    if args.serve:
+        return serve(args.serve, args.port, args.warm_cache)
+
+    from app import app, db
+    from asgi import VIEWS
+    params = {key: getattr(args, key) for key in DEFAULTS}
+    with app.app_context():
+        if args.reseed:
+            seed(db, params, echo=lambda line: print(line, file=sys.stderr))
+        plan = [variants for variants in requests_for(app, db) if variants[0][0] in VIEWS]
+    flat = [request for variants in plan for request in variants]
+
+    result = {
+        'database': db.engine.dialect.name,
+        'dataset': params,
+        'clients': args.clients,
+        'warm_cache': args.warm_cache
+    }
+    failed = False
+    for mode in MODES:
+        result[mode], errors = run_mode(mode, args.database, flat, args)
+        for error in errors[:10]:
+            print('%s: %s' % (mode, error), file=sys.stderr)
+        failed = failed or bool(errors)
+        print('%-5s %8.1f req/s  p50 %.1fms  p95 %.1fms  p99 %.1fms' % (
+            mode, result[mode]['throughput_rps'], result[mode]['p50_ms'],
+            result[mode]['p95_ms'], result[mode]['p99_ms']), file=sys.stderr)
+
+    text = json.dumps(result, indent=2, sort_keys=True) + '\n'
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+#----------------------------------------------------------------------------#
+# Diff two benchmark results and fail on regressions.
+#
+#   python -m benchmarks.compare BASELINE.json CURRENT.json [--tolerance 0.25] [--floor-ms 1.0]
+#       [--queries-only]
+#
+# A route regresses when its p95 latency grows by more than the tolerance
+# and by more than the floor (so sub-millisecond jitter does not count), or
+# when it runs more queries than before.  Query counts do not depend on the
+# machine, so they are the part of a checked-in baseline every run can hold
+# to; --queries-only holds a run to nothing else.
+#----------------------------------------------------------------------------#
+
+import argparse
+import json
+import sys
+
+
+def latency_regressed(old, new, tolerance, floor_ms):
+    return new['p95_ms'] > old['p95_ms'] * (1 + tolerance) and new['p95_ms'] - old['p95_ms'] > floor_ms
+
+
+def compare(baseline, current, tolerance=0.25, floor_ms=1.0, latency=True):
+    # returns [(section, endpoint, message, regressed), ...]
+    report = []
+    sections = (
+        ('client', baseline.get('client', {}), current.get('client', {})),
+        ('http', baseline.get('http', {}).get('routes', {}), current.get('http', {}).get('routes', {}))
+    )
+    for section, old_routes, new_routes in sections:
+        for endpoint in sorted(set(old_routes) | set(new_routes)):
+            old, new = old_routes.get(endpoint), new_routes.get(endpoint)
+            if old is None or new is None:
+                report.append((section, endpoint, 'only in %s' % ('current' if old is None else 'baseline'), False))
+                continue
+            regressed = latency and latency_regressed(old, new, tolerance, floor_ms)
+            message = 'p95 %.2fms -> %.2fms' % (old['p95_ms'], new['p95_ms'])
+            if 'queries' in old and 'queries' in new:
+                message += ', queries %d -> %d' % (old['queries'], new['queries'])
+                regressed = regressed or new['queries'] > old['queries']
+            report.append((section, endpoint, message, regressed))
+    if 'throughput_rps' in baseline.get('http', {}) and 'throughput_rps' in current.get('http', {}):
+        old, new = baseline['http']['throughput_rps'], current['http']['throughput_rps']
+        report.append(('http', '*', 'throughput %.1f -> %.1f req/s' % (old, new),
+                       latency and new < old * (1 - tolerance)))
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two benchmark results.')
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slowdown')
+    parser.add_argument('--floor-ms', type=float, default=1.0, help='latency changes below this never count')
+    parser.add_argument('--queries-only', action='store_true', help='only query counts can regress')
+    args = parser.parse_args(argv)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if baseline.get('dataset') != current.get('dataset'):
+        print('warning: the runs used different datasets', file=sys.stderr)
+    report = compare(baseline, current, args.tolerance, args.floor_ms, latency=not args.queries_only)
+    for section, endpoint, message, regressed in report:
+        print('%-4s %-6s %-28s %s' % ('FAIL' if regressed else 'ok', section, endpoint, message))
+    return 1 if any(regressed for section, endpoint, message, regressed in report) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,169 @@
+#----------------------------------------------------------------------------#
+# Synthetic dataset for the benchmarks.
+#
+#   python -m benchmarks.dataset --database sqlite:////tmp/fyyur-bench.db \
+#       [--cities N] [--venues N] [--artists N] [--shows N] [--seed N]
+#
+# The same parameters and seed give the same rows on a given day (show times
+# are placed around today, so the upcoming share holds).  Popularity is
+# skewed the way real listings are: a few cities hold most venues and
+# artists, and shows follow a Zipf curve over venues and artists, so some
+# detail pages carry hundreds of shows while most carry a handful.  About a
+# third of the shows are upcoming.  The schema is dropped and recreated.
+#----------------------------------------------------------------------------#
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+DEFAULTS = {'cities': 50, 'venues': 500, 'artists': 1000, 'shows': 20000, 'seed': 1}
+
+ADJECTIVES = ('Blue', 'Golden', 'Velvet', 'Electric', 'Silver', 'Wild', 'Crimson', 'Midnight',
+              'Rusty', 'Lucky', 'Hollow', 'Neon', 'Broken', 'Little', 'Grand', 'Jazz')
+NOUNS = ('Room', 'Note', 'Hall', 'Lounge', 'Garage', 'Owl', 'Tavern', 'Cellar',
+         'Sax Band', 'Collective', 'Trio', 'Petals', 'Hop', 'Social', 'Club', 'Quartet')
+BATCH = 5000
+# shows fall between a year ago and half a year ahead
+PAST = timedelta(days=365)
+FUTURE = timedelta(days=182)
+
+
+def zipf_weights(n, s=1.1):
+    return list(accumulate(1 / (rank ** s) for rank in range(1, n + 1)))
+
+
+def name(rng, kind, i):
+    # unique through the counter, searchable through the words
+    words = '%s %s %d' % (rng.choice(ADJECTIVES), rng.choice(NOUNS), i)
+    if kind == 'venue' and rng.random() < 0.5:
+        return 'The ' + words
+    return words
+
+
+def generate(cities, venues, artists, shows, seed, genres, states, now=None):
+    # returns {table name: [row dict, ...]} with ids assigned from 1
+    rng = random.Random(seed)
+    # shows are placed relative to midnight today, so upcoming stays upcoming
+    now = (now or datetime.today()).replace(hour=0, minute=0, second=0, microsecond=0)
+    data = {}
+    data['Genre'] = [{'id': i + 1, 'name': g} for i, g in enumerate(genres)]
+    data['City'] = [{'id': i + 1, 'name': 'City %d' % (i + 1), 'state': rng.choice(states)}
+                    for i in range(cities)]
+    city_weights = zipf_weights(cities, 0.8)
+
+    data['Venue'] = [{
+        'id': i + 1,
+        'name': name(rng, 'venue', i + 1),
+        'city_id': rng.choices(range(1, cities + 1), cum_weights=city_weights)[0],
+        'address': '%d %s St' % (rng.randint(1, 9999), rng.choice(NOUNS)),
+        'phone': '%03d-%03d-%04d' % (rng.randint(200, 999), rng.randint(0, 999), rng.randint(0, 9999)),
+        'image_link': 'https://images.example.com/venue/%d.jpg' % (i + 1),
+        'facebook_link': 'https://www.facebook.com/venue%d' % (i + 1),
+        'website': 'https://venue%d.example.com' % (i + 1),
+        'seeking_talent': rng.random() < 0.4,
+        'seeking_description': 'We are looking for local acts.' if rng.random() < 0.4 else None
+    } for i in range(venues)]
+
+    data['Artist'] = [{
+        'id': i + 1,
+        'name': name(rng, 'artist', i + 1),
+        'city_id': rng.choices(range(1, cities + 1), cum_weights=city_weights)[0],
+        'phone': '%03d-%03d-%04d' % (rng.randint(200, 999), rng.randint(0, 999), rng.randint(0, 9999)),
+        'image_link': 'https://images.example.com/artist/%d.jpg' % (i + 1),
+        'facebook_link': 'https://www.facebook.com/artist%d' % (i + 1),
+        'website': 'https://artist%d.example.com' % (i + 1),
+        'seeking_venue': rng.random() < 0.5,
+        'seeking_description': 'Looking for shows this season.' if rng.random() < 0.5 else None
+    } for i in range(artists)]
+
+    data['GenreVenue'] = [{'genre_id': g, 'venue_id': v['id']}
+                          for v in data['Venue']
+                          for g in rng.sample(range(1, len(genres) + 1), rng.randint(1, 3))]
+    data['GenreArtist'] = [{'genre_id': g, 'artist_id': a['id']}
+                           for a in data['Artist']
+                           for g in rng.sample(range(1, len(genres) + 1), rng.randint(1, 3))]
+
+    venue_weights = zipf_weights(venues)
+    artist_weights = zipf_weights(artists)
+    span = int((PAST + FUTURE).total_seconds() // 60)
+    seen = set()
+    rows = []
+    while len(rows) < shows:
+        venue_id = rng.choices(range(1, venues + 1), cum_weights=venue_weights)[0]
+        artist_id = rng.choices(range(1, artists + 1), cum_weights=artist_weights)[0]
+        # on the hour, in the evening
+        start = now - PAST + timedelta(minutes=rng.randrange(span))
+        start = start.replace(hour=rng.randint(18, 23), minute=0)
+        key = (venue_id, start, artist_id)
+        if key in seen:
+            continue
+        seen.add(key)
+        rows.append({'venue_id': venue_id, 'artist_id': artist_id, 'time': start})
+    rows.sort(key=lambda r: r['time'])
+    data['Show'] = [dict(r, id=i + 1) for i, r in enumerate(rows)]
+    return data
+
+
+def seed(db, params, now=None, echo=print):
+    from forms import VenueForm
+    genres = [value for value, label in VenueForm.genres.kwargs['choices']]
+    states = [value for value, label in VenueForm.state.kwargs['choices']]
+    started = time.perf_counter()
+    data = generate(params['cities'], params['venues'], params['artists'], params['shows'],
+                    params['seed'], genres, states, now)
+    db.drop_all()
+    db.create_all()
+    tables = db.metadata.tables
+    for table in ('Genre', 'City', 'Venue', 'Artist', 'GenreVenue', 'GenreArtist', 'Show'):
+        rows = data[table]
+        for i in range(0, len(rows), BATCH):
+            db.session.execute(tables[table].insert(), rows[i:i + BATCH])
+    # rows went in behind the app's back, so the upcoming show counts start from a recount
+    from app import reconcile_upcoming_counts
+    reconcile_upcoming_counts()
+    db.session.commit()
+    if db.engine.dialect.name == 'postgresql':
+        # explicit ids leave the sequences behind
+        for table in ('Genre', 'City', 'Venue', 'Artist', 'Show'):
+            db.session.execute(db.text(
+                'SELECT setval(pg_get_serial_sequence(\'"%s"\', \'id\'), (SELECT max(id) FROM "%s"))' % (table, table)))
+        db.session.commit()
+    echo('seeded %s in %.1fs' % (', '.join('%d %s' % (len(data[t]), t) for t in data), time.perf_counter() - started))
+    return data
+
+
+def add_arguments(parser):
+    parser.add_argument('--database', required=True, help='SQLAlchemy URL of the database to (re)create')
+    for key, value in DEFAULTS.items():
+        parser.add_argument('--' + key, type=int, default=value)
+
+
+def use_database(url):
+    # config.py reads DATABASE_URL, so this has to happen before app is imported
+    if 'app' in sys.modules:
+        raise RuntimeError('set the benchmark database before importing app')
+    os.environ['DATABASE_URL'] = url
+    # with debug mode off the app wants a SECRET_KEY, which a scratch
+    # database's sessions don't need, and logs to a file, which shouldn't be
+    # the checkout's error.log
+    os.environ.setdefault('SECRET_KEY', 'benchmarks')
+    os.environ.setdefault('ERROR_LOG', os.devnull)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Seed a synthetic fyyur dataset.')
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    use_database(args.database)
+    from app import app, db
+    with app.app_context():
+        seed(db, {key: getattr(args, key) for key in DEFAULTS})
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
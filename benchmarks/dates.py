@@ -0,0 +1,81 @@
+#----------------------------------------------------------------------------#
+# Per-call cost of the datetime filter on a page of 10k shows.
+#
+#   python -m benchmarks.dates [--shows N] [--number N] [--min-speedup X]
+#
+# Formats the start times of a synthetic shows page (benchmarks.dataset's
+# times, on the hour over a year and a half) three ways: the old filter,
+# straight through babel.dates.format_datetime; dates.DateFormatter on its
+# first page, with empty caches; and DateFormatter again once warm.  Each is
+# also timed rendering the page's tiles through a Jinja template.  Exits
+# non-zero when the output differs from babel's or the warm filter is less
+# than --min-speedup times faster.  Needs no database.
+#----------------------------------------------------------------------------#
+
+import argparse
+import sys
+import time
+
+import babel.dates
+from jinja2 import Environment
+
+from benchmarks.dataset import DEFAULTS, generate
+from dates import FORMATS, DateFormatter
+
+TEMPLATE = "{% for time in times %}<h4>{{ time|datetime('full') }}</h4>{% endfor %}"
+
+
+def legacy(value, format='medium'):
+    # the filter as it was
+    return babel.dates.format_datetime(value, FORMATS.get(format, format), locale='en')
+
+
+def timed(function, times):
+    started = time.perf_counter()
+    out = [function(t, 'full') for t in times]
+    return time.perf_counter() - started, out
+
+
+def rendered(filter, times, number):
+    env = Environment(autoescape=True)
+    env.filters['datetime'] = filter
+    template = env.from_string(TEMPLATE)
+    best = None
+    for i in range(number):
+        started = time.perf_counter()
+        template.render(times=times)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Per-call cost of the datetime filter.')
+    parser.add_argument('--shows', type=int, default=10000, help='show tiles on the page')
+    parser.add_argument('--number', type=int, default=5, help='timed page renders, the best counts')
+    parser.add_argument('--min-speedup', type=float, default=2.0, help='required warm speedup over babel')
+    args = parser.parse_args(argv)
+
+    data = generate(1, DEFAULTS['venues'], DEFAULTS['artists'], args.shows, DEFAULTS['seed'],
+                    ['Jazz', 'Folk', 'Blues'], ['CA'])
+    times = [show['time'] for show in data['Show']]
+    n = len(times)
+    before, expected = timed(legacy, times)
+    formatter = DateFormatter()
+    cold, first = timed(formatter.format, times)
+    warm, second = timed(formatter.format, times)
+    if first != expected or second != expected:
+        print('DateFormatter output differs from babel.dates.format_datetime', file=sys.stderr)
+        return 1
+
+    print('%d shows, %d distinct times' % (n, len(set(times))))
+    print('babel          %6.2fus per call' % (before / n * 1e6))
+    print('cold           %6.2fus per call' % (cold / n * 1e6))
+    print('warm           %6.2fus per call  (%.1fx)' % (warm / n * 1e6, before / warm))
+    print('page, babel    %6.1fms' % (rendered(legacy, times, args.number) * 1000))
+    print('page, warm     %6.1fms' % (rendered(formatter.format, times, args.number) * 1000))
+    return 1 if before / warm < args.min_speedup else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
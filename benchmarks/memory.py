@@ -0,0 +1,135 @@
+#----------------------------------------------------------------------------#
+# Memory per worker, with and without preloading the app.
+#
+#   python -m benchmarks.memory --database sqlite:////tmp/fyyur-bench.db \
+#       [--reseed] [--workers 4] [--requests 400] [--output FILE]
+#
+# Serves the app through gunicorn.conf.py twice, preloaded in the parent and
+# forked (PRELOAD=1) and built in every worker (PRELOAD=0).  Each server
+# gets --requests requests spread over the read pages, then the memory of
+# its processes is read from /proc/<pid>/smaps_rollup:
+#   rss   resident, counting pages shared with other processes in full;
+#   pss   shared pages divided between the processes sharing them;
+#   uss   pages only this process has, what another worker really costs.
+# Needs gunicorn and Linux.
+#----------------------------------------------------------------------------#
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+from benchmarks.async_mode import free_port, wait_for
+from benchmarks.dataset import DEFAULTS, add_arguments, seed, use_database
+from benchmarks.run import requests_for
+
+FIELDS = {'Rss': 'rss', 'Pss': 'pss', 'Private_Clean': 'uss', 'Private_Dirty': 'uss'}
+
+
+def memory(pid):
+    # {'rss': MiB, 'pss': MiB, 'uss': MiB}
+    found = {'rss': 0, 'pss': 0, 'uss': 0}
+    with open('/proc/%d/smaps_rollup' % pid) as f:
+        for line in f:
+            name, _, rest = line.partition(':')
+            if name in FIELDS:
+                found[FIELDS[name]] += int(rest.split()[0])
+    return {key: round(kb / 1024, 1) for key, kb in found.items()}
+
+
+def children(pid):
+    found = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open('/proc/%s/stat' % entry) as f:
+                    # the command name is in parentheses and may hold spaces
+                    fields = f.read().rpartition(')')[2].split()
+            except OSError:
+                continue
+            if int(fields[1]) == pid:
+                found.append(int(entry))
+    return sorted(found)
+
+
+def average(samples):
+    return {key: round(sum(s[key] for s in samples) / len(samples), 1) for key in samples[0]}
+
+
+def serve(database, preload, workers, flat, total):
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=database, PRELOAD='1' if preload else '0', PORT=str(port),
+               WEB_CONCURRENCY=str(workers))
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-b', '127.0.0.1:%d' % port],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(port, process, timeout=120)
+        deadline = time.monotonic() + 120
+        while len(children(process.pid)) < workers and time.monotonic() < deadline:
+            time.sleep(0.2)
+        base = 'http://127.0.0.1:%d' % port
+
+        def fetch(n):
+            endpoint, method, path, data = flat[n % len(flat)]
+            body = urlencode(data).encode() if data is not None else None
+            with urlopen(base + path, data=body) as response:
+                response.read()
+
+        # as many clients as workers, so every worker serves its share
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(fetch, range(total)))
+        pids = children(process.pid)
+        per_worker = [memory(pid) for pid in pids]
+        return {
+            'workers': len(pids),
+            'parent': memory(process.pid),
+            'per_worker': average(per_worker),
+            'total_pss': round(sum(s['pss'] for s in per_worker) + memory(process.pid)['pss'], 1)
+        }
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Memory per worker with and without preloading.')
+    add_arguments(parser)
+    parser.add_argument('--reseed', action='store_true', help='drop and seed the database first')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=400, help='requests per server before measuring')
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    args = parser.parse_args(argv)
+
+    use_database(args.database)
+    from app import app, db
+    params = {key: getattr(args, key) for key in DEFAULTS}
+    with app.app_context():
+        if args.reseed:
+            seed(db, params, echo=lambda line: print(line, file=sys.stderr))
+        # the heavy exports would swamp what the pages themselves keep
+        plan = [variants for variants in requests_for(app, db) if 'export' not in variants[0][0]]
+    flat = [request for variants in plan for request in variants]
+
+    result = {'dataset': params}
+    for name, preload in (('preload', True), ('per_worker', False)):
+        result[name] = serve(args.database, preload, args.workers, flat, args.requests)
+        print('%-10s %d workers  uss %6.1fMiB  pss %6.1fMiB  rss %6.1fMiB per worker, pss %6.1fMiB in all' % (
+            name, result[name]['workers'], result[name]['per_worker']['uss'], result[name]['per_worker']['pss'],
+            result[name]['per_worker']['rss'], result[name]['total_pss']), file=sys.stderr)
+
+    text = json.dumps(result, indent=2, sort_keys=True) + '\n'
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
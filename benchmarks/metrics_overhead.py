@@ -0,0 +1,87 @@
+#----------------------------------------------------------------------------#
+# Per-request cost of the request metrics.
+#
+#   python -m benchmarks.metrics_overhead [--number N] [--budget MICROSECONDS]
+#
+# Times the two pieces metrics.py adds to a request against the same call
+# without them: the WSGI middleware around a trivial app, and a template
+# render through TimedTemplate.  Each is the best of several timeit runs,
+# since a whole Flask request is too noisy to show a few microseconds.
+# Exits non-zero when the total is over the budget.  Needs no database.
+#----------------------------------------------------------------------------#
+
+import argparse
+import sys
+import timeit
+
+from jinja2 import Environment, Template
+
+import metrics
+from metrics import REQUEST_KEY, Metrics, TimedTemplate
+
+
+class Rule:
+    endpoint = 'venues'
+
+
+class Request:
+    url_rule = Rule()
+
+
+def hello(environ, start_response):
+    environ[REQUEST_KEY] = Request()
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'ok']
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def serve(app, environ):
+    # as a WSGI server does: the body is sent, then closed
+    body = app(environ, start_response)
+    try:
+        for chunk in body:
+            pass
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+
+def best(stmt, number, namespace, repeat=7):
+    return min(timeit.repeat(stmt, number=number, repeat=repeat, globals=namespace)) / number
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Per-request cost of the request metrics.')
+    parser.add_argument('--number', type=int, default=100000, help='calls per timing run')
+    parser.add_argument('--budget', type=float, default=5.0, help='allowed overhead per request in microseconds')
+    args = parser.parse_args(argv)
+
+    template = '<p>{{ name }}</p>'
+    namespace = {
+        'bare': hello,
+        'measured': Metrics().middleware(hello),
+        'environ': {'REQUEST_METHOD': 'GET'},
+        'serve': serve,
+        'plain': Environment(autoescape=True).from_string(template, template_class=Template),
+        'timed': Environment(autoescape=True).from_string(template, template_class=TimedTemplate)
+    }
+    middleware = (best('serve(measured, environ)', args.number, namespace)
+                  - best('serve(bare, environ)', args.number, namespace))
+    # as inside a measured request, so the render time is added up
+    metrics.current.started = 0.0
+    metrics.current.render = 0.0
+    rendering = (best("timed.render(name='venue')", args.number // 10, namespace)
+                 - best("plain.render(name='venue')", args.number // 10, namespace))
+
+    total = (middleware + rendering) * 1e6
+    print('middleware     %.2fus per request' % (middleware * 1e6))
+    print('render timing  %.2fus per template' % (rendering * 1e6))
+    print('total          %.2fus (budget %.1fus)' % (total, args.budget))
+    return 1 if total > args.budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,238 @@
+#----------------------------------------------------------------------------#
+# Route benchmark: latency, throughput and query counts for every page.
+#
+#   python -m benchmarks.run --database sqlite:////tmp/fyyur-bench.db --reseed \
+#       [--iterations N] [--concurrency N] [--http-requests N] [--output FILE]
+#
+# Every GET route in app.py (and the two search forms) is driven twice:
+#   client  sequentially through the Flask test client, recording latency
+#           percentiles and the queries each request ran;
+#   http    through a threaded HTTP server hit by --concurrency clients at
+#           once, recording latency percentiles and overall throughput.
+# The page cache is cleared before each client request unless --warm-cache
+# is given, so the numbers are for the real work.  Routes that write
+# (create, edit, delete) are left out.  The result is JSON with sorted keys
+# and no timestamps, ready for benchmarks.compare to diff against a
+# baseline.
+#----------------------------------------------------------------------------#
+
+import argparse
+import json
+import logging
+import platform
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+from sqlalchemy import event
+
+from benchmarks.dataset import DEFAULTS, add_arguments, seed, use_database
+
+# never driven: they change data or are not pages
+SKIP = {'static', 'delete_venue'}
+POSTS = {'search_venues', 'search_artists'}
+SEARCH_TERM = 'the'
+# query strings for routes that need one
+QUERIES = {
+    'autocomplete_names': {'q': SEARCH_TERM},
+    'api.api_search_venues': {'q': SEARCH_TERM},
+    'api.api_search_artists': {'q': SEARCH_TERM},
+}
+FORMATS = {'fmt': 'csv'}
+
+
+def percentile(ordered, p):
+    # nearest rank
+    if not ordered:
+        return None
+    k = max(0, min(len(ordered) - 1, int(round(p / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+def summary(latencies):
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'p50_ms': round(percentile(ordered, 50) * 1000, 3),
+        'p95_ms': round(percentile(ordered, 95) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 99) * 1000, 3),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3)
+    }
+
+
+def sample_ids(db, model, show_key):
+    # the busiest, a middling and the quietest entity with shows, plus the last id
+    from app import Show
+    ranked = [key for key, n in db.session.query(show_key, db.func.count(Show.id))
+              .group_by(show_key).order_by(db.func.count(Show.id).desc(), show_key)]
+    last = db.session.query(db.func.max(model.id)).scalar()
+    ids = [ranked[0], ranked[len(ranked) // 2], ranked[-1]] if ranked else []
+    return list(dict.fromkeys(ids + ([last] if last else [])))
+
+
+def requests_for(app, db):
+    # [(endpoint, method, path, form data or None), ...], one list per route
+    from flask import url_for
+    from app import Venue, Artist, Show
+    ids = {
+        'venue_id': sample_ids(db, Venue, Show.venue_id),
+        'artist_id': sample_ids(db, Artist, Show.artist_id)
+    }
+    plan = []
+    with app.test_request_context():
+        for rule in sorted(app.url_map.iter_rules(), key=lambda r: r.endpoint):
+            endpoint = rule.endpoint
+            if endpoint in SKIP:
+                continue
+            if endpoint in POSTS:
+                plan.append([(endpoint, 'POST', url_for(endpoint), {'search_term': SEARCH_TERM})])
+                continue
+            if 'GET' not in rule.methods:
+                continue
+            variants = [{}]
+            for arg in rule.arguments:
+                if arg in ids:
+                    variants = [dict(v, **{arg: key}) for v in variants for key in ids[arg]]
+                elif arg in FORMATS:
+                    variants = [dict(v, **{arg: FORMATS[arg]}) for v in variants]
+                else:
+                    variants = []
+            if variants:
+                plan.append([(endpoint, 'GET', url_for(endpoint, **dict(v, **QUERIES.get(endpoint, {}))), None)
+                             for v in variants])
+    return plan
+
+
+def run_client(app, db, page_cache, plan, iterations, warm_cache):
+    queries = [0]
+
+    def counted(*args):
+        queries[0] += 1
+
+    # replicas too, when DATABASE_REPLICA_URLS sends the reads there
+    engines = [db.engine] + db.get_replicas(app)
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', counted)
+    client = app.test_client()
+    results = {}
+    try:
+        for variants in plan:
+            endpoint = variants[0][0]
+            latencies = []
+            per_request = []
+            for i in range(iterations):
+                endpoint, method, path, data = variants[i % len(variants)]
+                if not warm_cache:
+                    page_cache.clear()
+                queries[0] = 0
+                started = time.perf_counter()
+                response = client.open(path, method=method, data=data)
+                response.get_data()
+                latencies.append(time.perf_counter() - started)
+                per_request.append(queries[0])
+                if response.status_code >= 400:
+                    raise RuntimeError('%s %s answered %d' % (method, path, response.status_code))
+            results[endpoint] = dict(summary(latencies), queries=max(per_request))
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', counted)
+    return results
+
+
+def run_http(app, plan, total, concurrency):
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = 'http://127.0.0.1:%d' % server.server_port
+    flat = [request for variants in plan for request in variants]
+    tickets = count()
+    timings = defaultdict(list)
+    errors = []
+
+    def worker():
+        while True:
+            n = next(tickets)
+            if n >= total:
+                return
+            endpoint, method, path, data = flat[n % len(flat)]
+            body = urlencode(data).encode() if data is not None else None
+            started = time.perf_counter()
+            try:
+                with urlopen(base + path, data=body) as response:
+                    response.read()
+            except Exception as e:
+                errors.append('%s %s: %s' % (method, path, e))
+                continue
+            timings[endpoint].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(concurrency) as pool:
+            for i in range(concurrency):
+                pool.submit(worker)
+    finally:
+        server.shutdown()
+    elapsed = time.perf_counter() - started
+    everything = [t for latencies in timings.values() for t in latencies]
+    return dict(summary(everything), **{
+        'concurrency': concurrency,
+        'errors': len(errors),
+        'throughput_rps': round(len(everything) / elapsed, 1),
+        'routes': {endpoint: summary(latencies) for endpoint, latencies in timings.items()}
+    }), errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark every route of the app.')
+    add_arguments(parser)
+    parser.add_argument('--reseed', action='store_true', help='drop and seed the database first')
+    parser.add_argument('--iterations', type=int, default=30, help='test client requests per route')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--http-requests', type=int, default=2000)
+    parser.add_argument('--warm-cache', action='store_true', help='keep the page cache between requests')
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    args = parser.parse_args(argv)
+
+    use_database(args.database)
+    from app import app, db, page_cache
+    # the per-request SQL log line would drown the output
+    logging.getLogger(app.logger.name + '.sql').setLevel(logging.WARNING)
+    params = {key: getattr(args, key) for key in DEFAULTS}
+    with app.app_context():
+        if args.reseed:
+            seed(db, params, echo=lambda line: print(line, file=sys.stderr))
+        plan = requests_for(app, db)
+        # first hits warm the in-process indexes, they are not measured
+        run_client(app, db, page_cache, plan, 1, args.warm_cache)
+        client = run_client(app, db, page_cache, plan, args.iterations, args.warm_cache)
+    http, errors = run_http(app, plan, args.http_requests, args.concurrency)
+    for error in errors[:10]:
+        print(error, file=sys.stderr)
+
+    result = {
+        'database': db.engine.dialect.name,
+        'dataset': params,
+        'python': platform.python_version(),
+        'iterations': args.iterations,
+        'warm_cache': args.warm_cache,
+        'client': client,
+        'http': http
+    }
+    text = json.dumps(result, indent=2, sort_keys=True) + '\n'
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
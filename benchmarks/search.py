@@ -0,0 +1,116 @@
+#----------------------------------------------------------------------------#
+# Name search and autocomplete latency as the number of names grows.
+#
+#   python -m benchmarks.search --database sqlite:////tmp/fyyur-bench.db \
+#       [--names 1000,10000,100000] [--number 50] [--output FILE]
+#
+# For each count the database is reseeded with that many venues (and as
+# many artists and shows), then venue_search.search(term) is timed for a
+# handful of terms: common and rare words, a two-word phrase, a term too
+# short to have a trigram and one nothing matches.  'build' is the first
+# search, which builds the n-gram index on SQLite; 'like' is the same term
+# as a plain ILIKE scan of the table, what the search page ran before
+# NameSearch.  On Postgres both are queries and there is no build.
+# autocomplete.complete(prefix), what /api/autocomplete answers from, is
+# timed the same way for a few prefixes, over the venues, artists and cities
+# together; its 'build' is the prefix index's.  Exits non-zero when an
+# autocomplete p99 is over --max-autocomplete-ms.
+# The schema is dropped and recreated.
+#----------------------------------------------------------------------------#
+
+import argparse
+import json
+import sys
+import time
+
+from benchmarks.dataset import DEFAULTS, seed, use_database
+from benchmarks.run import summary
+
+TERMS = ('jazz', 'the', 'velvet room', 'ow', 'no such venue')
+PREFIXES = ('t', 'ja', 'the ve', 'velvet room 1', 'zz')
+
+
+def timed(function, number):
+    latencies = []
+    for i in range(number):
+        started = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - started)
+    return summary(latencies)
+
+
+def measure(app, db, names, number):
+    from app import Venue, autocomplete, venue_search
+    from search import like_pattern
+    params = dict(DEFAULTS, venues=names, artists=names, shows=names)
+    result = {'terms': {}, 'autocomplete': {}}
+    with app.app_context():
+        seed(db, params, echo=lambda line: print(line, file=sys.stderr))
+        # seeded behind the ORM's back
+        venue_search.invalidate()
+        autocomplete.invalidate()
+        started = time.perf_counter()
+        venue_search.search(TERMS[0])
+        result['build_ms'] = round((time.perf_counter() - started) * 1000, 3)
+
+        for term in TERMS:
+            def like():
+                found = Venue.query.with_entities(Venue.id, Venue.name) \
+                    .filter(Venue.name.ilike(like_pattern(term), escape='\\'))
+                return found.count(), found.order_by(Venue.name).limit(20).all()
+            total, hits = venue_search.search(term)
+            result['terms'][term] = {
+                'hits': total,
+                'search': timed(lambda: venue_search.search(term), number),
+                'like': timed(like, number)
+            }
+
+        started = time.perf_counter()
+        autocomplete.warm()
+        result['autocomplete_build_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        for prefix in PREFIXES:
+            result['autocomplete'][prefix] = dict(timed(lambda: autocomplete.complete(prefix), number),
+                                                  hits=len(autocomplete.complete(prefix)))
+        db.session.remove()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Name search and autocomplete latency as the number of names grows.')
+    parser.add_argument('--database', required=True, help='SQLAlchemy URL of the database to (re)create')
+    parser.add_argument('--names', default='1000,10000,100000', help='comma separated venue counts')
+    parser.add_argument('--number', type=int, default=50, help='timed searches per term')
+    parser.add_argument('--max-autocomplete-ms', type=float, default=2.0, help='allowed autocomplete p99')
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    args = parser.parse_args(argv)
+
+    use_database(args.database)
+    import logging
+    from app import app, db
+    logging.getLogger(app.logger.name).setLevel(logging.WARNING)
+
+    result = {}
+    for names in (int(n) for n in args.names.split(',')):
+        found = result[str(names)] = measure(app, db, names, args.number)
+        print('%7d names  build %8.1fms' % (names, found['build_ms']), file=sys.stderr)
+        for term, timing in found['terms'].items():
+            print('%7d names  %-14r %6d hits  search p50 %7.3fms p99 %7.3fms  like p50 %7.3fms' % (
+                names, term, timing['hits'], timing['search']['p50_ms'], timing['search']['p99_ms'],
+                timing['like']['p50_ms']), file=sys.stderr)
+        print('%7d names  autocomplete build %8.1fms' % (names, found['autocomplete_build_ms']), file=sys.stderr)
+        for prefix, timing in found['autocomplete'].items():
+            print('%7d names  %-14r %6d hits  autocomplete p50 %7.3fms p99 %7.3fms' % (
+                names, prefix, timing['hits'], timing['p50_ms'], timing['p99_ms']), file=sys.stderr)
+
+    text = json.dumps(result, indent=2, sort_keys=True) + '\n'
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+    slowest = max(timing['p99_ms'] for found in result.values() for timing in found['autocomplete'].values())
+    return 1 if slowest > args.max_autocomplete_ms else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+#----------------------------------------------------------------------------#
+# Cold start: importing the app and the first request to each page.
+#
+#   python -m benchmarks.startup --database sqlite:////tmp/fyyur-bench.db \
+#       [--reseed] [--runs N] [--output FILE]
+#
+# Every run is a fresh interpreter that imports app, then requests each page
+# once through the test client, the way the first visitors after a deploy
+# do; the detail pages are those of a middling venue and artist.  It runs
+# twice over: with the templates compiled on first use ('cold'), and with a
+# bundle from `flask compile-templates` ('compiled').  The medians of --runs
+# runs are reported, along with the modules the import left out.  Run it on
+# two commits to compare them.
+#----------------------------------------------------------------------------#
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.dataset import DEFAULTS, add_arguments, seed, use_database
+from benchmarks.run import sample_ids
+
+PATHS = ('/', '/venues', '/venues/%(venue_id)d', '/artists', '/artists/%(artist_id)d', '/shows', '/venues/create')
+# imported only where they are used
+LAZY = ('alembic', 'flask_migrate', 'flask_moment', 'babel.dates', 'dateutil.parser')
+
+
+def child(paths):
+    # one cold start, as JSON on stdout
+    import logging
+    import time
+    started = time.perf_counter()
+    import app
+    imported = time.perf_counter()
+    logging.getLogger(app.app.logger.name + '.sql').setLevel(logging.WARNING)
+    skipped = [name for name in LAZY if name not in sys.modules]
+    client = app.app.test_client()
+    first = {}
+    for path in paths:
+        t = time.perf_counter()
+        response = client.get(path)
+        first[path] = (time.perf_counter() - t) * 1000
+        if response.status_code >= 400:
+            raise RuntimeError('%s answered %d' % (path, response.status_code))
+    json.dump({'import_ms': (imported - started) * 1000, 'first_ms': first, 'not_imported': skipped}, sys.stdout)
+
+
+def run(database, paths, cache_dir, number):
+    env = dict(os.environ, DATABASE_URL=database, TEMPLATE_CACHE_DIR=cache_dir)
+    results = []
+    for i in range(number):
+        out = subprocess.run([sys.executable, '-m', 'benchmarks.startup', '--database', database, '--child', json.dumps(paths)],
+                             env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+        results.append(json.loads(out.stdout))
+    return {
+        'import_ms': round(statistics.median(r['import_ms'] for r in results), 1),
+        'first_ms': {path: round(statistics.median(r['first_ms'][path] for r in results), 1) for path in paths},
+        'total_ms': round(statistics.median(r['import_ms'] + sum(r['first_ms'].values()) for r in results), 1),
+        'not_imported': results[0]['not_imported']
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time importing the app and the first requests.')
+    add_arguments(parser)
+    parser.add_argument('--reseed', action='store_true', help='drop and seed the database first')
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per mode')
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    use_database(args.database)
+    if args.child:
+        return child(json.loads(args.child))
+    from app import app, db, Venue, Artist, Show
+    with app.app_context():
+        if args.reseed:
+            seed(db, {key: getattr(args, key) for key in DEFAULTS}, echo=lambda line: print(line, file=sys.stderr))
+        ids = {'venue_id': sample_ids(db, Venue, Show.venue_id)[1], 'artist_id': sample_ids(db, Artist, Show.artist_id)[1]}
+    paths = [path % ids for path in PATHS]
+
+    result = {}
+    with tempfile.TemporaryDirectory() as scratch:
+        compiled = os.path.join(scratch, 'templates')
+        subprocess.run([sys.executable, '-m', 'flask', 'compile-templates'], check=True, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, env=dict(os.environ, FLASK_APP='app', TEMPLATE_CACHE_DIR=compiled))
+        # a directory that doesn't exist turns the bundle off
+        for mode, cache_dir in (('cold', os.path.join(scratch, 'none')), ('compiled', compiled)):
+            result[mode] = run(args.database, paths, cache_dir, args.runs)
+            print('%-8s import %6.1fms  first requests %6.1fms' % (
+                mode, result[mode]['import_ms'], result[mode]['total_ms'] - result[mode]['import_ms']), file=sys.stderr)
+
+    text = json.dumps(result, indent=2, sort_keys=True) + '\n'
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,431 @@
+#----------------------------------------------------------------------------#
+# Response cache for the read-heavy pages.
+#
+# Entries are tagged with the entities they were built from ('venue:12',
+# 'artist:7', 'city:3', 'shows', ...) and the write controllers invalidate
+# exactly those tags.  MemoryCache is the per-process default; RedisCache is
+# shared between workers and takes any client speaking the handful of redis
+# commands below, including FakeRedis for local runs and tests.
+#
+# invalidate() reaches the backend of the process that calls it, and only
+# RedisCache is seen by the others.  With MemoryCache, what another worker or
+# a CLI command wrote leaves the old entries of this process in place until
+# they age out or are evicted.  Invalidation frees them early, it isn't what
+# keeps pages fresh: see the version in the page key below.
+#
+# conditional() answers If-None-Match / If-Modified-Since with a 304 from a
+# cheap version lookup before the view (or the cache) is consulted.  The
+# version is also part of the page cache key, so a page is only ever served
+# from an entry built at the version its ETag names: a write the cache never
+# heard of (another worker's, a CLI command's) just makes a new key.
+#
+# FragmentCache keeps pieces of pages, the markup inside a Jinja
+# {% cache %} block, so a page missing from the response cache re-renders
+# only the parts whose entities changed.
+#----------------------------------------------------------------------------#
+
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import timezone
+from functools import wraps
+
+from flask import Response, g, make_response, request, session
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+
+class CacheBackend:
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, tags=()):
+        raise NotImplementedError
+
+    def invalidate(self, *tags):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    # LRU with a per-entry TTL; a tag -> keys map lets invalidate() drop
+    # just the entries built from a given entity.
+
+    def __init__(self, maxsize=1024, ttl=300, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.tags = {}
+        self.lock = threading.RLock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < self.clock():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, tags=()):
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (self.clock() + self.ttl, value, tuple(tags))
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.maxsize:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, *tags):
+        with self.lock:
+            for tag in tags:
+                for key in self.tags.pop(tag, ()):
+                    self._drop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tags.clear()
+
+    def stats(self):
+        return {
+            'backend': 'memory',
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+    def _drop(self, key):
+        # called with the lock held
+        expires, value, tags = self.entries.pop(key)
+        for tag in tags:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+
+class SizedMemoryCache(MemoryCache):
+    # MemoryCache of strings, also bounded by the UTF-8 bytes it holds.
+
+    def __init__(self, max_bytes, maxsize=100000, ttl=3600, clock=time.monotonic):
+        super().__init__(maxsize, ttl, clock)
+        self.max_bytes = max_bytes
+        self.sizes = {}
+        self.bytes = 0
+
+    def set(self, key, value, tags=()):
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            super().set(key, value, tags)
+            self.sizes[key] = size
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            super().clear()
+            self.sizes.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return dict(super().stats(), bytes=self.bytes, max_bytes=self.max_bytes)
+
+    def _drop(self, key):
+        self.bytes -= self.sizes.pop(key, 0)
+        super()._drop(key)
+
+
+class RedisCache(CacheBackend):
+    # Values under <prefix>v:<key>, members of each tag in the set
+    # <prefix>t:<tag>.  Evictions are redis' business and are not counted.
+
+    def __init__(self, client, ttl=300, prefix='fyyur:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + 'v:' + key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(raw)
+
+    def set(self, key, value, tags=()):
+        self.client.setex(self.prefix + 'v:' + key, self.ttl, pickle.dumps(value))
+        for tag in tags:
+            self.client.sadd(self.prefix + 't:' + tag, key)
+            self.client.expire(self.prefix + 't:' + tag, self.ttl)
+
+    def invalidate(self, *tags):
+        for tag in tags:
+            tag_key = self.prefix + 't:' + tag
+            members = self.client.smembers(tag_key)
+            keys = [self.prefix + 'v:' + (m.decode() if isinstance(m, bytes) else m) for m in members]
+            self.client.delete(tag_key, *keys)
+
+    def clear(self):
+        for key in self.client.keys(self.prefix + '*'):
+            self.client.delete(key)
+
+    def stats(self):
+        return {
+            'backend': 'redis',
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': 0
+        }
+
+
+class FakeRedis:
+    # In-memory stand-in for the redis commands RedisCache uses.
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.data = {}
+        self.expiry = {}
+
+    def _live(self, key):
+        if key in self.expiry and self.expiry[key] < self.clock():
+            self.data.pop(key, None)
+            self.expiry.pop(key, None)
+        return key in self.data
+
+    def get(self, key):
+        return self.data[key] if self._live(key) else None
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+        self.expiry[key] = self.clock() + ttl
+
+    def sadd(self, key, *members):
+        if not self._live(key):
+            self.data[key] = set()
+        self.data[key].update(m.encode() for m in members)
+
+    def smembers(self, key):
+        return set(self.data[key]) if self._live(key) else set()
+
+    def expire(self, key, ttl):
+        if self._live(key):
+            self.expiry[key] = self.clock() + ttl
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+            self.expiry.pop(key, None)
+
+    def keys(self, pattern):
+        prefix = pattern.rstrip('*')
+        return [k for k in list(self.data) if k.startswith(prefix) and self._live(k)]
+
+
+def make_backend(config):
+    backend = config.get('CACHE_BACKEND', 'memory')
+    ttl = config.get('CACHE_TTL', 300)
+    if backend == 'memory':
+        return MemoryCache(config.get('CACHE_MAX_ENTRIES', 1024), ttl)
+    if backend == 'redis':
+        import redis
+        return RedisCache(redis.Redis.from_url(config['CACHE_REDIS_URL']), ttl)
+    if backend == 'fakeredis':
+        return RedisCache(FakeRedis(), ttl)
+    raise ValueError('unknown CACHE_BACKEND %r' % backend)
+
+
+class PageCache:
+    # Caches whole GET responses.  Views add the tags of what they render
+    # with tag(); writers call invalidate() with the tags they touched.
+    # variant() names what else a page depends on besides its URL, and the
+    # version conditional() computed (in g.page_version) what it was built at.
+
+    def __init__(self, backend, variant=None):
+        self.backend = backend
+        self.variant = variant
+
+    def page(self, view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            version = g.get('page_version')
+            hit = self.lookup(version)
+            if hit is not None:
+                return hit
+            return self.store(make_response(view(*args, **kwargs)), version)
+        return wrapper
+
+    def lookup(self, version=None):
+        # the cached response to this request, or None; on a miss the
+        # view's tags are collected from here until store()
+        if not cacheable():
+            return None
+        hit = self.backend.get(self.key(version))
+        if hit is not None:
+            body, mimetype = hit
+            return Response(body, mimetype=mimetype)
+        g.cache_tags = set()
+        return None
+
+    def store(self, response, version=None):
+        tags = g.pop('cache_tags', None)
+        if tags is not None and response.status_code == 200 and not response.direct_passthrough:
+            self.backend.set(self.key(version), (response.get_data(), response.mimetype), tags)
+        return response
+
+    def key(self, version=None):
+        parts = [request.full_path]
+        if version is not None:
+            parts.insert(0, version)
+        if self.variant is not None:
+            parts.insert(0, self.variant())
+        return 'page:' + ':'.join(parts)
+
+    def tag(self, *tags):
+        if 'cache_tags' in g:
+            g.cache_tags.update(tags)
+
+    def invalidate(self, *tags):
+        self.backend.invalidate(*tags)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return self.backend.stats()
+
+
+class FragmentCache:
+    # Backs the {% cache %} tag:
+    #
+    #   {% cache 'show', show.id, show.artist_updated_at tags 'artist:%d' % show.artist_id %}
+    #     ...
+    #   {% endcache %}
+    #
+    # The key is the list of values before `tags`; putting the updated_at of
+    # what the block shows in it means an edit makes a new key, in every
+    # process.  The writers also invalidate() the tags, so in their own
+    # process the old markup goes at once instead of ageing out.  variant() names what else the
+    # markup depends on, added to every key.
+
+    def __init__(self, app=None, max_bytes=16 * 1024 * 1024, variant=None):
+        self.backend = SizedMemoryCache(max_bytes)
+        self.variant = variant
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = SizedMemoryCache(app.config.get('FRAGMENT_CACHE_BYTES', self.backend.max_bytes))
+        app.jinja_env.add_extension(FragmentCacheExtension)
+        app.jinja_env.fragment_cache = self
+
+    def fetch(self, key, tags, render):
+        key = repr(tuple(key) if self.variant is None else (self.variant(),) + tuple(key))
+        markup = self.backend.get(key)
+        if markup is None:
+            markup = render()
+            self.backend.set(key, markup, tags)
+        return Markup(markup)
+
+    def invalidate(self, *tags):
+        self.backend.invalidate(*tags)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return self.backend.stats()
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = self.parse_values(parser)
+        tags = self.parse_values(parser) if parser.stream.skip_if('name:tags') else nodes.List([])
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('fetch', [key, tags]), [], [], body).set_lineno(lineno)
+
+    def parse_values(self, parser):
+        values = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            values.append(parser.parse_expression())
+        return nodes.List(values)
+
+    def fetch(self, key, tags, caller):
+        return self.environment.fragment_cache.fetch(key, tags, caller)
+
+
+def cacheable():
+    # pages carrying flashed messages are one-off, never serve or store them
+    return request.method == 'GET' and '_flashes' not in session
+
+
+def as_utc(value):
+    # naive timestamps from the database are taken to be UTC
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def not_modified(etag, last_modified):
+    # a 304 when the client's copy is current, else None
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+    else:
+        since = request.if_modified_since
+        fresh = (last_modified is not None and since is not None
+                 and last_modified <= as_utc(since))
+    return Response(status=304) if fresh else None
+
+
+def stamp(response, etag, last_modified):
+    if response.status_code in (200, 304):
+        response.set_etag(etag, weak=True)
+        if last_modified is not None:
+            response.last_modified = last_modified
+    return response
+
+
+def validators(etag, last_modified):
+    if last_modified is not None:
+        last_modified = as_utc(last_modified).replace(microsecond=0)
+    return etag, last_modified
+
+
+def conditional(version):
+    # version(**view_args) returns (etag, last_modified or None)
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not cacheable():
+                return view(*args, **kwargs)
+            etag, last_modified = validators(*version(*args, **kwargs))
+            # for the page cache below
+            g.page_version = etag
+            response = not_modified(etag, last_modified) or make_response(view(*args, **kwargs))
+            return stamp(response, etag, last_modified)
+        return wrapper
+    return decorator
@@ -0,0 +1,144 @@
+#----------------------------------------------------------------------------#
+# The datetime template filter.
+#
+# Formatting a show time through babel.dates.format_datetime resolves the
+# locale and re-parses the pattern on every call, and the shows page and the
+# detail timelines format hundreds of them.  Here each (format, locale) pair
+# is compiled to a babel DateTimePattern once, and formatted strings are kept
+# in a bounded LRU keyed by (value, format, locale, timezone).  Show times
+# sit on the hour, so a page of thousands of shows formats far fewer
+# distinct values than it has tiles.
+#
+# Each request gets the first of LOCALES its Accept-Language asks for and
+# the timezone named by its tz cookie, else DISPLAY_TIMEZONE.  Stored times
+# are naive UTC.  variant() names the pair, for the page cache key and the
+# ETag, so a cached page is only served to requests that would render it
+# the same way.
+#
+# babel and dateutil are imported on the first date formatted, not with the
+# app, since most processes and pages never need them.
+#----------------------------------------------------------------------------#
+
+import threading
+from datetime import timezone
+from functools import lru_cache
+
+from flask import g, has_request_context, request
+
+# the app's own names; babel's 'long' and 'short' keep their CLDR meaning
+FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma"
+}
+NAMED = ('full', 'long', 'medium', 'short')
+TZ_COOKIE = 'tz'
+
+
+def datetime_pattern(format, locale):
+    # the pattern babel.dates.format_datetime would use
+    from babel.dates import get_datetime_format, get_date_format, get_time_format
+    if format in FORMATS:
+        return FORMATS[format]
+    if format in NAMED:
+        return (get_datetime_format(format, locale=locale)
+                .replace('{0}', get_time_format(format, locale=locale).pattern)
+                .replace('{1}', get_date_format(format, locale=locale).pattern))
+    return format
+
+
+class DateFormatter:
+
+    def __init__(self, app=None, maxsize=4096):
+        self.locales = {}
+        self.patterns = {}
+        self.timezones = {}
+        self.lock = threading.Lock()
+        self.cached = lru_cache(maxsize)(self.render)
+        self.default_locale = 'en'
+        self.default_timezone = 'UTC'
+        self.supported = ['en']
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LOCALES', ['en'])
+        app.config.setdefault('DISPLAY_TIMEZONE', 'UTC')
+        app.config.setdefault('DATE_FORMAT_CACHE_SIZE', 4096)
+        self.supported = list(app.config['LOCALES'])
+        self.default_locale = self.supported[0]
+        self.default_timezone = app.config['DISPLAY_TIMEZONE']
+        self.cached = lru_cache(app.config['DATE_FORMAT_CACHE_SIZE'])(self.render)
+        app.jinja_env.filters['datetime'] = self.format
+        if len(self.supported) > 1:
+            app.after_request(self.vary)
+
+    def locale(self, identifier):
+        found = self.locales.get(identifier)
+        if found is None:
+            from babel import Locale
+            found = self.locales[identifier] = Locale.parse(identifier)
+        return found
+
+    def pattern(self, format, locale):
+        key = (format, locale)
+        found = self.patterns.get(key)
+        if found is None:
+            from babel.dates import parse_pattern
+            found = self.patterns[key] = parse_pattern(datetime_pattern(format, self.locale(locale)))
+        return found
+
+    def zone(self, name):
+        # None for unknown names
+        try:
+            return self.timezones[name]
+        except KeyError:
+            pass
+        from babel.dates import get_timezone
+        try:
+            found = get_timezone(name)
+        except LookupError:
+            found = None
+        with self.lock:
+            # a cookie can name anything, don't let them pile up
+            if len(self.timezones) < 1000:
+                self.timezones[name] = found
+        return found
+
+    def current(self):
+        # (locale, timezone name) for this request, worked out once
+        if not has_request_context():
+            return self.default_locale, self.default_timezone
+        found = g.get('date_display')
+        if found is None:
+            locale = request.accept_languages.best_match(self.supported) or self.default_locale
+            name = request.cookies.get(TZ_COOKIE)
+            if not name or self.zone(name) is None:
+                name = self.default_timezone
+            found = g.date_display = (locale, name)
+        return found
+
+    def variant(self):
+        return '%s,%s' % self.current()
+
+    def format(self, value, format='medium'):
+        locale, name = self.current()
+        return self.cached(value, format, locale, name)
+
+    def render(self, value, format, locale, name):
+        date = value
+        if isinstance(date, str):
+            import dateutil.parser
+            date = dateutil.parser.parse(date)
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=timezone.utc)
+        if name != 'UTC':
+            date = date.astimezone(self.zone(name))
+        return self.pattern(format, locale).apply(date, self.locale(locale))
+
+    def vary(self, response):
+        response.vary.add('Accept-Language')
+        return response
+
+    def stats(self):
+        info = self.cached.cache_info()
+        return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize, 'maxsize': info.maxsize}
@@ -0,0 +1,119 @@
+#----------------------------------------------------------------------------#
+# Streaming export of shows, venues and artists as CSV, JSONL or iCalendar.
+#
+# Each writer turns an iterator of row dicts into an iterator of text, one
+# row at a time, so a query run with yield_per() can be handed straight to a
+# streaming response (or a file) without the result set ever being held in
+# memory.  buffered() batches the small pieces into larger writes.
+#----------------------------------------------------------------------------#
+
+import csv
+import io
+import json
+from datetime import date, datetime, timezone
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'ics': 'text/calendar'
+}
+
+# iCalendar content lines are folded at 75 octets
+ICS_LINE = 75
+
+
+def plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def csv_lines(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(values):
+        writer.writerow(values)
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    yield line(columns)
+    for row in rows:
+        yield line([plain(row[c]) for c in columns])
+
+
+def jsonl_lines(columns, rows):
+    for row in rows:
+        yield json.dumps({c: plain(row[c]) for c in columns}) + '\n'
+
+
+def ics_text(value):
+    return (value.replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\n', '\\n'))
+
+
+def ics_time(value):
+    # aware times go out in UTC, naive ones as floating local time
+    if value.tzinfo is None:
+        return value.strftime('%Y%m%dT%H%M%S')
+    return value.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def ics_fold(line):
+    data = line.encode('utf-8')
+    if len(data) <= ICS_LINE:
+        return line + '\r\n'
+    parts = []
+    width = ICS_LINE
+    while data:
+        cut = min(width, len(data))
+        # never split a multi-byte character
+        while cut < len(data) and data[cut] & 0xC0 == 0x80:
+            cut -= 1
+        parts.append(data[:cut].decode('utf-8'))
+        data = data[cut:]
+        width = ICS_LINE - 1
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def ics_lines(name, events, domain='fyyur', now=None):
+    # events are dicts with id, start_time, summary and optionally location/url
+    stamp = ics_time((now or datetime.now(timezone.utc)).astimezone(timezone.utc))
+    yield ics_fold('BEGIN:VCALENDAR')
+    yield ics_fold('VERSION:2.0')
+    yield ics_fold('PRODID:-//Fyyur//Shows//EN')
+    yield ics_fold('X-WR-CALNAME:' + ics_text(name))
+    for event in events:
+        yield ics_fold('BEGIN:VEVENT')
+        yield ics_fold('UID:show-%d@%s' % (event['id'], domain))
+        yield ics_fold('DTSTAMP:' + stamp)
+        yield ics_fold('DTSTART:' + ics_time(event['start_time']))
+        yield ics_fold('SUMMARY:' + ics_text(event['summary']))
+        if event.get('location'):
+            yield ics_fold('LOCATION:' + ics_text(event['location']))
+        if event.get('url'):
+            yield ics_fold('URL:' + event['url'])
+        yield ics_fold('END:VEVENT')
+    yield ics_fold('END:VCALENDAR')
+
+
+def buffered(pieces, size=64 * 1024):
+    # joins small pieces into chunks of about `size` characters; the first
+    # piece goes out on its own so the response starts straight away
+    pieces = iter(pieces)
+    for piece in pieces:
+        yield piece
+        break
+    chunk = []
+    length = 0
+    for piece in pieces:
+        chunk.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield ''.join(chunk)
+            chunk = []
+            length = 0
+    if chunk:
+        yield ''.join(chunk)
@@ -4,11 +4,31 @@ from fabric.contrib.console import confirm
 # prepare for deployment
 
 
+BENCH_DATABASE = "sqlite:////tmp/fyyur-bench.db"
+BENCH_OUTPUT = "/tmp/fyyur-bench.json"
+# checked in and held to on query counts, the numbers that don't depend on
+# the machine; refresh it with benchmarks.run --output when a change is meant
+# to move them
+BENCH_BASELINE = "benchmarks/baseline.json"
+
+
 def test():
     with settings(warn_only=True):
-        result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
-        )
+        result = local("python -m pytest")
+        if result.succeeded:
+            result = local("python -m benchmarks.metrics_overhead")
+        if result.succeeded:
+            result = local("python -m benchmarks.dates")
+        if result.succeeded:
+            result = local(
+                "python -m benchmarks.run --database {} --reseed --output {}".format(
+                    BENCH_DATABASE, BENCH_OUTPUT
+                )
+            )
+        if result.succeeded:
+            result = local(
+                "python -m benchmarks.compare --queries-only {} {}".format(BENCH_BASELINE, BENCH_OUTPUT)
+            )
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
 
@@ -39,9 +59,8 @@ def heroku():
 
 
 def heroku_test():
-    local(
-        "heroku run python test_tasks.py -v && heroku run python test_users.py -v"
-    )
+    # the route benchmark reseeds its database, so it never runs against heroku's
+    local("heroku run python -m benchmarks.metrics_overhead")
 
 
 def deploy():
@@ -0,0 +1,29 @@
+#----------------------------------------------------------------------------#
+# gunicorn settings.
+#
+#   gunicorn -c gunicorn.conf.py
+#
+# The app is built and warmed up once in the parent process and forked into
+# WEB_CONCURRENCY workers that share it copy-on-write (see wsgi.py).
+# PRELOAD=0 builds it in every worker instead, at the cost of a copy each.
+#----------------------------------------------------------------------------#
+
+import multiprocessing
+import os
+
+from wsgi import after_fork, before_fork
+
+wsgi_app = 'wsgi:create_app()'
+bind = '0.0.0.0:' + os.environ.get('PORT', '8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+preload_app = os.environ.get('PRELOAD', '1') != '0'
+
+
+def when_ready(server):
+    # in the parent, after the preload and before the first fork
+    if preload_app:
+        before_fork(server.app.wsgi())
+
+
+def post_worker_init(worker):
+    after_fork(worker.wsgi)
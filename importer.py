@@ -0,0 +1,272 @@
+#----------------------------------------------------------------------------#
+# Bulk import of venues, artists and shows, run as `flask import KIND FILE`.
+#
+# Rows are streamed from CSV or JSONL and validated with the same forms the
+# HTML pages use.  Each chunk resolves its cities and genres with one registry
+# call, writes its rows with one multi-row upsert (venues and artists, keyed
+# on the unique name) or one insert that skips shows already listed, links
+# genres with one insert that ignores existing links, and commits.  Show
+# rows naming an artist or venue that doesn't exist are skipped, found with
+# one lookup of each per chunk, and show chunks then recount the upcoming
+# show counts of the venues and artists they touched.  Only one chunk is
+# held in memory at a time.
+#----------------------------------------------------------------------------#
+
+import csv
+import json
+import time
+from datetime import datetime, timezone
+from itertools import islice
+
+import click
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from werkzeug.datastructures import MultiDict
+
+from app import db, Venue, Artist, Show, GenreVenue, GenreArtist, reference_data, page_cache, reconcile_upcoming_counts
+from forms import VenueForm, ArtistForm, ShowForm
+
+# CSV cells holding several genres separate them with this
+LIST_SEPARATOR = ';'
+FALSE_VALUES = ('', '0', 'false', 'no', 'n', 'off')
+# what ShowForm's DateTimeField parses
+FORM_TIME = '%Y-%m-%d %H:%M:%S'
+
+
+def read_rows(path, fmt):
+    # yields (line number, row dict or None when the line cannot be parsed)
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'jsonl':
+            for n, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield n, row if isinstance(row, dict) else None
+        else:
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def formdata(row, list_fields=(), bool_fields=()):
+    data = MultiDict()
+    for key, value in row.items():
+        if value is None:
+            continue
+        if key in list_fields:
+            if not isinstance(value, list):
+                value = [v for v in str(value).split(LIST_SEPARATOR)]
+            for v in value:
+                if str(v).strip():
+                    data.add(key, str(v).strip())
+        elif key in bool_fields:
+            if value is True or str(value).strip().lower() not in FALSE_VALUES:
+                data.add(key, 'y')
+        else:
+            data.add(key, str(value))
+    return data
+
+
+def is_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def upsert_by_name(model, rows):
+    # insert or update on the unique name; returns {name: id}
+    table = model.__table__
+    dialect = postgresql if is_postgres() else sqlite
+    ins = dialect.insert(table).values(rows)
+    updates = {key: ins.excluded[key] for key in rows[0] if key != 'name'}
+    updates['updated_at'] = func.now()
+    ins = ins.on_conflict_do_update(index_elements=[table.c.name], set_=updates)
+    if is_postgres():
+        return dict((name, key) for key, name in db.session.execute(ins.returning(table.c.id, table.c.name)))
+    db.session.execute(ins)
+    found = db.session.execute(select([table.c.id, table.c.name]).where(table.c.name.in_([r['name'] for r in rows])))
+    return dict((name, key) for key, name in found)
+
+
+def insert_ignoring_duplicates(model, rows):
+    if not rows:
+        return
+    table = model.__table__
+    if is_postgres():
+        db.session.execute(postgresql.insert(table).on_conflict_do_nothing(), rows)
+    else:
+        db.session.execute(table.insert().prefix_with('OR IGNORE'), rows)
+
+
+class EntityImport:
+    # venues and artists: a form, the columns it fills and the genre link table
+
+    def __init__(self, model, form, link, link_key, columns, flag):
+        self.model = model
+        self.form = form
+        self.link = link
+        self.link_key = link_key
+        self.columns = columns
+        self.flag = flag
+        self.list_fields = ('genres',)
+        self.bool_fields = (flag,)
+
+    def formdata(self, row):
+        return formdata(row, self.list_fields, self.bool_fields)
+
+    def known(self, records, rejected):
+        return [record for n, record in records]
+
+    def record(self, form):
+        record = {column: form[field].data for column, field in self.columns}
+        record[self.flag] = bool(form[self.flag].data)
+        record['city'] = (form.city.data, form.state.data)
+        record['genres'] = form.genres.data
+        return record
+
+    def write(self, records):
+        # later rows win when a chunk names the same entity twice
+        records = list({r['name']: r for r in records}.values())
+        city_ids, genre_ids = reference_data.resolve_many(
+            [r['city'] for r in records], [g for r in records for g in r['genres']])
+        rows = []
+        for r in records:
+            row = {column: r[column] for column, field in self.columns}
+            row[self.flag] = r[self.flag]
+            row['city_id'] = city_ids[r['city']]
+            rows.append(row)
+        ids = upsert_by_name(self.model, rows)
+        insert_ignoring_duplicates(self.link, [
+            {'genre_id': genre_ids[g], self.link_key: ids[r['name']]}
+            for r in records for g in r['genres']
+        ])
+
+
+class ShowImport:
+    form = ShowForm
+    required = ('artist_id', 'venue_id', 'start_time')
+
+    def formdata(self, row):
+        # exports and most other tools write ISO 8601 ('2035-04-01T20:00:00',
+        # with an offset or Z); the form takes 'YYYY-MM-DD HH:MM:SS'
+        value = str(row['start_time']).strip()
+        try:
+            start = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+        except ValueError:
+            raise ValueError('start_time: %r is not an ISO 8601 date and time' % value)
+        if start.tzinfo is not None:
+            # stored times are naive UTC (see dates.py), whatever the host's zone
+            start = start.astimezone(timezone.utc).replace(tzinfo=None)
+        return formdata(dict(row, start_time=start.strftime(FORM_TIME)))
+
+    def known(self, records, rejected):
+        # rows naming an artist or venue that isn't there would fail the
+        # chunk's insert on the foreign keys, so they are skipped first
+        artist_ids = {record['artist_id'] for n, record in records}
+        venue_ids = {record['venue_id'] for n, record in records}
+        artist_ids = {key for key, in db.session.execute(select([Artist.id]).where(Artist.id.in_(artist_ids)))}
+        venue_ids = {key for key, in db.session.execute(select([Venue.id]).where(Venue.id.in_(venue_ids)))}
+        found = []
+        for n, record in records:
+            if record['artist_id'] not in artist_ids:
+                rejected(n, 'no artist %d' % record['artist_id'])
+            elif record['venue_id'] not in venue_ids:
+                rejected(n, 'no venue %d' % record['venue_id'])
+            else:
+                found.append(record)
+        return found
+
+    def record(self, form):
+        return {
+            'artist_id': int(form.artist_id.data),
+            'venue_id': int(form.venue_id.data),
+            'time': form.start_time.data
+        }
+
+    def write(self, records):
+        # a show already listed (same venue, time and artist) is left alone
+        insert_ignoring_duplicates(Show, records)
+        # which rows were new is not known, so the touched counts are recounted
+        reconcile_upcoming_counts({r['venue_id'] for r in records}, {r['artist_id'] for r in records})
+
+
+KINDS = {
+    'venues': EntityImport(Venue, VenueForm, GenreVenue, 'venue_id', (
+        ('name', 'name'), ('address', 'address'), ('phone', 'phone'),
+        ('image_link', 'image_link'), ('facebook_link', 'facebook_link'),
+        ('website', 'website_link'), ('seeking_description', 'seeking_description')
+    ), 'seeking_talent'),
+    'artists': EntityImport(Artist, ArtistForm, GenreArtist, 'artist_id', (
+        ('name', 'name'), ('phone', 'phone'),
+        ('image_link', 'image_link'), ('facebook_link', 'facebook_link'),
+        ('website', 'website_link'), ('seeking_description', 'seeking_description')
+    ), 'seeking_venue'),
+    'shows': ShowImport()
+}
+
+
+def validated(spec, rows, rejected):
+    for n, row in rows:
+        if row is None:
+            rejected(n, 'not a valid row')
+            continue
+        missing = [key for key in getattr(spec, 'required', ()) if not row.get(key)]
+        if missing:
+            rejected(n, 'missing ' + ', '.join(missing))
+            continue
+        try:
+            form = spec.form(formdata=spec.formdata(row), meta={'csrf': False})
+        except ValueError as e:
+            rejected(n, str(e))
+            continue
+        if not form.validate():
+            rejected(n, '; '.join('%s: %s' % (field, ' '.join(errors)) for field, errors in form.errors.items()))
+            continue
+        try:
+            yield n, spec.record(form)
+        except (TypeError, ValueError) as e:
+            rejected(n, str(e))
+
+
+def import_file(kind, path, fmt=None, chunk_size=1000):
+    spec = KINDS[kind]
+    fmt = fmt or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    counts = {'imported': 0, 'skipped': 0}
+    started = time.perf_counter()
+
+    def rejected(n, reason):
+        counts['skipped'] += 1
+        click.echo('%s line %d skipped: %s' % (path, n, reason), err=True)
+
+    for chunk in chunked(validated(spec, read_rows(path, fmt), rejected), chunk_size):
+        try:
+            records = spec.known(chunk, rejected)
+            if records:
+                spec.write(records)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            raise click.ClickException('chunk after %d imported rows failed: %s' % (counts['imported'], e))
+        counts['imported'] += len(records)
+        elapsed = time.perf_counter() - started
+        click.echo('%s: %d imported, %d skipped, %.0f rows/s' % (
+            kind, counts['imported'], counts['skipped'], counts['imported'] / elapsed))
+
+    # cached pages may show any of the touched rows.  This only empties a
+    # shared (redis) cache; the servers' memory caches key their pages by
+    # version, so they don't serve the old ones, they age them out.
+    page_cache.clear()
+    elapsed = time.perf_counter() - started
+    click.echo('%s: done, %d imported, %d skipped in %.1fs' % (
+        kind, counts['imported'], counts['skipped'], elapsed))
+    return counts
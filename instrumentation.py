@@ -0,0 +1,125 @@
+#----------------------------------------------------------------------------#
+# Per-request SQL statistics.
+#
+# Cursor events on the engine count every statement a request runs and time
+# it.  Statements are also grouped by shape (the SQL with literals and IN
+# lists folded), so one shape run many times in a request stands out: that
+# is the N+1 signature.  Each request ends with a structured log line and,
+# when enabled, a Server-Timing header.  Routes listed in
+# SQL_QUERY_BUDGETS log a warning when they go over their budget.  With
+# SQL_BUDGET_STRICT on they raise instead, which fails a test run.
+# Statements run with the execution option sql_stats=False are left out:
+# upkeep that lands on whichever request comes along, not the request's own.
+#----------------------------------------------------------------------------#
+
+import json
+import logging
+import re
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+IN_LIST = re.compile(r'\bIN\s*\((?:\s*(?:\?|%\(\w+\)s|:\w+|\d+)\s*,?)+\)', re.I)
+NUMBER = re.compile(r'\b\d+\b')
+STRING = re.compile(r"'(?:[^']|'')*'")
+SPACE = re.compile(r'\s+')
+
+
+def shape(statement):
+    statement = STRING.sub('?', statement)
+    statement = IN_LIST.sub('IN (...)', statement)
+    statement = NUMBER.sub('?', statement)
+    return SPACE.sub(' ', statement).strip()
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestQueries:
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.time += elapsed
+        self.shapes[statement] += 1
+
+    def repeated(self, threshold):
+        # shapes only get folded here, once per distinct statement
+        folded = Counter()
+        for statement, n in self.shapes.items():
+            folded[shape(statement)] += n
+        return [(s, n) for s, n in folded.most_common() if n >= threshold]
+
+
+class SQLInstrumentation:
+
+    def __init__(self, app, engine):
+        self.app = app
+        self.logger = logging.getLogger(app.logger.name + '.sql')
+        app.config.setdefault('SQL_STATS', True)
+        app.config.setdefault('SQL_SERVER_TIMING', False)
+        app.config.setdefault('SQL_REPEAT_THRESHOLD', 3)
+        app.config.setdefault('SQL_QUERY_BUDGETS', {})
+        app.config.setdefault('SQL_BUDGET_STRICT', False)
+        self.watch(engine)
+        app.before_request(self.start)
+        app.after_request(self.finish)
+
+    def watch(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before)
+        event.listen(engine, 'after_cursor_execute', self._after)
+        event.listen(engine, 'handle_error', self._error)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append((context, time.perf_counter()))
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        context, started = conn.info['query_started'].pop()
+        if has_request_context() and 'sql' in g and context.execution_options.get('sql_stats', True):
+            g.sql.record(statement, time.perf_counter() - started)
+
+    def _error(self, exception_context):
+        # a statement that raised never reaches _after; errors raised after it
+        # (fetching, post-execute) belong to a statement already popped
+        conn = exception_context.connection
+        started = conn.info.get('query_started') if conn is not None else None
+        if started and started[-1][0] is exception_context.execution_context:
+            started.pop()
+
+    def start(self):
+        if self.app.config['SQL_STATS']:
+            g.sql = RequestQueries()
+
+    def finish(self, response):
+        stats = g.pop('sql', None)
+        if stats is None:
+            return response
+        config = self.app.config
+        repeated = stats.repeated(config['SQL_REPEAT_THRESHOLD'])
+        if config['SQL_SERVER_TIMING']:
+            response.headers.add('Server-Timing', 'db;dur=%.2f;desc="queries: %d"' % (stats.time * 1000, stats.count))
+        self.logger.info(json.dumps({
+            'endpoint': request.endpoint,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': stats.count,
+            'db_ms': round(stats.time * 1000, 2),
+            'repeated': [{'statement': s, 'count': n} for s, n in repeated]
+        }))
+        if repeated:
+            self.logger.warning('%s ran the same statement %d times: %s',
+                                request.endpoint, repeated[0][1], repeated[0][0])
+        budget = config['SQL_QUERY_BUDGETS'].get(request.endpoint)
+        if budget is not None and stats.count > budget:
+            message = '%s ran %d queries, over its budget of %d' % (request.endpoint, stats.count, budget)
+            if config['SQL_BUDGET_STRICT']:
+                raise QueryBudgetExceeded(message)
+            self.logger.warning(message)
+        return response
@@ -0,0 +1,238 @@
+#----------------------------------------------------------------------------#
+# Request metrics in the Prometheus text format, served at /metrics.
+#
+# Every request is observed into latency histograms per endpoint: the whole
+# request (with its method and status), the view alone and the template
+# rendering it did.  An in-flight gauge counts requests being handled.
+#
+# Each thread records into its own shard, so the request path never takes a
+# lock or shares a counter with another thread.  A scrape adds the shards
+# up.  Shards of threads that have exited are folded into one retired shard
+# when the next thread registers or the next scrape runs.
+#
+# Requests are timed by a WSGI middleware around app.wsgi_app rather than
+# before/after_request hooks: it sees the whole request, including the
+# context push and error handling, and skips both Flask's per-hook dispatch
+# and the flask.g/request proxies, which cost more than the bookkeeping.
+# A request is recorded when the server closes its response body, so a
+# streamed export is timed, and counted in flight, until its last chunk.
+#----------------------------------------------------------------------------#
+
+import threading
+from bisect import bisect_left
+from time import perf_counter
+
+from flask import Response
+from jinja2 import Template
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HISTOGRAMS = (
+    ('request_duration_seconds', 'Time to handle a request, by endpoint, method and status.'),
+    ('view_duration_seconds', 'Time spent in the view, template rendering excluded.'),
+    ('render_duration_seconds', 'Time spent rendering templates.'),
+    ('pool_wait_seconds', 'Time to check a connection out of the pool, by database.')
+)
+
+# started and render time of the request this thread is handling
+current = threading.local()
+
+REQUEST_KEY = 'metrics.request'
+
+
+class Shard:
+    def __init__(self):
+        # (name, labels) -> [count per bucket ..., count above the last bucket, sum]
+        self.histograms = {}
+        # (endpoint, method, status) -> that request's three histograms, so
+        # recording a request is a single lookup
+        self.requests = {}
+        self.in_flight = 0
+
+    def merge(self, other):
+        for key, values in list(other.histograms.items()):
+            mine = self.histograms.setdefault(key, [0] * len(values[:-1]) + [0.0])
+            for i, v in enumerate(values):
+                mine[i] += v
+        self.in_flight += other.in_flight
+
+
+class TimedTemplate(Template):
+    # adds its render time to the request's running total
+
+    def render(self, *args, **kwargs):
+        started = perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            if getattr(current, 'started', None) is not None:
+                current.render += perf_counter() - started
+
+
+class MeasuredBody:
+    # the app's response body, recording the request when the server closes
+    # it, as werkzeug's ClosingIterator does with fewer calls
+
+    __slots__ = ('metrics', 'body', 'shard', 'environ', 'status')
+
+    def __init__(self, metrics, body, shard, environ, status):
+        self.metrics = metrics
+        self.body = body
+        self.shard = shard
+        self.environ = environ
+        self.status = status
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.metrics._record(self.shard, self.environ, self.status[0])
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+
+    def __init__(self, app=None, prefix='fyyur_', buckets=BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.local = threading.local()
+        self.shards = []
+        self.retired = Shard()
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.jinja_env.template_class = TimedTemplate
+        app.wsgi_app = self.middleware(app.wsgi_app)
+
+        # flask clears environ['werkzeug.request'] when the request context
+        # pops, so the request also leaves itself under a key of ours
+        class MeasuredRequest(app.request_class):
+            def __init__(self, environ, *args, **kwargs):
+                super().__init__(environ, *args, **kwargs)
+                environ[REQUEST_KEY] = self
+
+        app.request_class = MeasuredRequest
+        app.add_url_rule('/metrics', 'metrics', self.expose)
+
+    def middleware(self, wsgi_app):
+        def measured(environ, start_response):
+            # a request that raises out of the app never starts a response
+            status = [500]
+
+            def capture(status_line, headers, exc_info=None):
+                status[0] = int(status_line[:3])
+                return start_response(status_line, headers, exc_info)
+
+            shard = self.shard()
+            shard.in_flight += 1
+            current.render = 0.0
+            current.started = perf_counter()
+            try:
+                body = wsgi_app(environ, capture)
+            except BaseException:
+                self._record(shard, environ, status[0])
+                raise
+            return MeasuredBody(self, body, shard, environ, status)
+        return measured
+
+    def shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = Shard()
+            with self.lock:
+                self._reap()
+                self.shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _reap(self):
+        # called with the lock held
+        live = []
+        for thread, shard in self.shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self.retired.merge(shard)
+        self.shards = live
+
+    def histogram(self, shard, name, labels):
+        values = shard.histograms.get((name, labels))
+        if values is None:
+            values = shard.histograms[(name, labels)] = [0] * (len(self.buckets) + 1) + [0.0]
+        return values
+
+    def observe(self, name, labels, value):
+        values = self.histogram(self.shard(), name, labels)
+        values[bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def _record(self, shard, environ, status):
+        elapsed = perf_counter() - current.started
+        render = current.render
+        current.started = None
+        req = environ.pop(REQUEST_KEY, None)
+        rule = getattr(req, 'url_rule', None)
+        endpoint = rule.endpoint if rule is not None else None
+        method = environ['REQUEST_METHOD']
+        series = shard.requests.get((endpoint, method, status))
+        if series is None:
+            by_endpoint = (('endpoint', endpoint),)
+            series = shard.requests[(endpoint, method, status)] = (
+                self.histogram(shard, 'request_duration_seconds', by_endpoint + (('method', method), ('status', status))),
+                self.histogram(shard, 'view_duration_seconds', by_endpoint),
+                self.histogram(shard, 'render_duration_seconds', by_endpoint))
+        total, view, rendering = series
+        buckets = self.buckets
+        total[bisect_left(buckets, elapsed)] += 1
+        total[-1] += elapsed
+        view[bisect_left(buckets, elapsed - render)] += 1
+        view[-1] += elapsed - render
+        if render:
+            rendering[bisect_left(buckets, render)] += 1
+            rendering[-1] += render
+        shard.in_flight -= 1
+
+    def collect(self):
+        total = Shard()
+        with self.lock:
+            self._reap()
+            total.merge(self.retired)
+            for thread, shard in self.shards:
+                total.merge(shard)
+        return total
+
+    def render(self):
+        total = self.collect()
+        lines = []
+        for name, help in HISTOGRAMS:
+            full = self.prefix + name
+            lines.append('# HELP %s %s' % (full, help))
+            lines.append('# TYPE %s histogram' % full)
+            for (series, labels), values in sorted(total.histograms.items(), key=lambda item: str(item[0])):
+                # endpoints that never rendered a template have an empty render series
+                if series != name or not any(values[:-1]):
+                    continue
+                label = ','.join('%s="%s"' % (k, escape(v)) for k, v in labels)
+                count = 0
+                for le, n in zip(self.buckets + ('+Inf',), values[:-1]):
+                    count += n
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (full, label, le, count))
+                lines.append('%s_sum{%s} %.6f' % (full, label, values[-1]))
+                lines.append('%s_count{%s} %d' % (full, label, count))
+        full = self.prefix + 'requests_in_flight'
+        lines.append('# HELP %s Requests being handled.' % full)
+        lines.append('# TYPE %s gauge' % full)
+        lines.append('%s %d' % (full, total.in_flight))
+        return '\n'.join(lines) + '\n'
+
+    def expose(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,50 @@
+"""upcoming show counters
+
+Revision ID: 355088182b18
+Revises: 5846405eed46
+Create Date: 2026-10-18 19:44:31.988146
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '355088182b18'
+down_revision = '5846405eed46'
+branch_labels = None
+depends_on = None
+
+
+# Venue and Artist carry their upcoming show count, counted against
+# ShowCounterClock.as_of.  The clock starts at the time of the upgrade and
+# the counts are filled in from the shows.
+
+COUNTED = (('Venue', 'venue_id'), ('Artist', 'artist_id'))
+
+
+def upgrade():
+    clock = op.create_table('ShowCounterClock',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('as_of', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    for table, key in COUNTED:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(sa.Column('upcoming_show_count', sa.Integer(), server_default='0', nullable=False))
+
+    op.execute(clock.insert().values(id=1, as_of=sa.func.now()))
+    show = sa.table('Show', sa.column('time'), sa.column('venue_id'), sa.column('artist_id'))
+    as_of = sa.select([clock.c.as_of]).where(clock.c.id == 1).scalar_subquery()
+    for table, key in COUNTED:
+        owner = sa.table(table, sa.column('id'), sa.column('upcoming_show_count'))
+        upcoming = sa.select([sa.func.count()]).select_from(show).where(
+            show.c[key] == owner.c.id).where(show.c.time >= as_of).scalar_subquery()
+        op.execute(owner.update().values(upcoming_show_count=upcoming))
+
+
+def downgrade():
+    for table, key in reversed(COUNTED):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('upcoming_show_count')
+    op.drop_table('ShowCounterClock')
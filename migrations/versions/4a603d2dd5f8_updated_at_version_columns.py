@@ -0,0 +1,32 @@
+"""updated_at version columns
+
+Revision ID: 4a603d2dd5f8
+Revises: b2f7ef38075f
+Create Date: 2026-10-18 19:16:16.500222
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4a603d2dd5f8'
+down_revision = 'b2f7ef38075f'
+branch_labels = None
+depends_on = None
+
+
+TABLES = ('City', 'Venue', 'Artist', 'Show')
+
+
+def upgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(timezone=True),
+                                          server_default=sa.func.now(), nullable=False))
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
@@ -0,0 +1,34 @@
+"""reference data natural keys
+
+Revision ID: 4c2fe5e11c3a
+Revises: 4a603d2dd5f8
+Create Date: 2026-10-18 19:17:37.838476
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c2fe5e11c3a'
+down_revision = '4a603d2dd5f8'
+branch_labels = None
+depends_on = None
+
+
+# City and Genre are looked up and upserted by their natural keys, which
+# ON CONFLICT needs to be backed by unique constraints.  Duplicate rows left
+# over from before have to be merged by hand before this can be applied.
+
+def upgrade():
+    with op.batch_alter_table('City') as batch_op:
+        batch_op.create_unique_constraint('uq_City_name_state', ['name', 'state'])
+    with op.batch_alter_table('Genre') as batch_op:
+        batch_op.create_unique_constraint('uq_Genre_name', ['name'])
+
+
+def downgrade():
+    with op.batch_alter_table('Genre') as batch_op:
+        batch_op.drop_constraint('uq_Genre_name', type_='unique')
+    with op.batch_alter_table('City') as batch_op:
+        batch_op.drop_constraint('uq_City_name_state', type_='unique')
@@ -0,0 +1,44 @@
+"""query pattern indexes
+
+Revision ID: 5846405eed46
+Revises: 9a645773a533
+Create Date: 2026-10-18 19:25:42.812723
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5846405eed46'
+down_revision = '9a645773a533'
+branch_labels = None
+depends_on = None
+
+
+# Indexes for the filters every page runs: a venue's or artist's show timeline,
+# the (time, id) keyset of the shows feed, venues and artists by city and the
+# genres of one venue or artist.  (venue_id, time, artist_id) is a show's
+# natural key and doubles as the venue timeline index.  Existing duplicate
+# shows must be removed before upgrading.
+
+def upgrade():
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.create_unique_constraint('uq_Show_venue_time_artist', ['venue_id', 'time', 'artist_id'])
+    op.create_index('ix_Show_artist_id_time', 'Show', ['artist_id', 'time'], unique=False)
+    op.create_index('ix_Show_time_id', 'Show', ['time', 'id'], unique=False)
+    op.create_index('ix_Venue_city_id', 'Venue', ['city_id'], unique=False)
+    op.create_index('ix_Artist_city_id', 'Artist', ['city_id'], unique=False)
+    op.create_index('ix_GenreVenue_venue_id', 'GenreVenue', ['venue_id'], unique=False)
+    op.create_index('ix_GenreArtist_artist_id', 'GenreArtist', ['artist_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_GenreArtist_artist_id', table_name='GenreArtist')
+    op.drop_index('ix_GenreVenue_venue_id', table_name='GenreVenue')
+    op.drop_index('ix_Artist_city_id', table_name='Artist')
+    op.drop_index('ix_Venue_city_id', table_name='Venue')
+    op.drop_index('ix_Show_time_id', table_name='Show')
+    op.drop_index('ix_Show_artist_id_time', table_name='Show')
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.drop_constraint('uq_Show_venue_time_artist', type_='unique')
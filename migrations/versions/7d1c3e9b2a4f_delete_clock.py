@@ -0,0 +1,32 @@
+"""delete clock
+
+Revision ID: 7d1c3e9b2a4f
+Revises: 355088182b18
+Create Date: 2026-10-19 09:12:40.215734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d1c3e9b2a4f'
+down_revision = '355088182b18'
+branch_labels = None
+depends_on = None
+
+
+# When rows of each versioned table were last deleted, for the conditional
+# GET validators; a delete leaves no updated_at behind.
+
+
+def upgrade():
+    op.create_table('DeleteClock',
+    sa.Column('table_name', sa.String(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('table_name')
+    )
+
+
+def downgrade():
+    op.drop_table('DeleteClock')
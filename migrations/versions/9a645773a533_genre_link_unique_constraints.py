@@ -0,0 +1,34 @@
+"""genre link unique constraints
+
+Revision ID: 9a645773a533
+Revises: 4c2fe5e11c3a
+Create Date: 2026-10-18 19:18:29.797610
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a645773a533'
+down_revision = '4c2fe5e11c3a'
+branch_labels = None
+depends_on = None
+
+
+# A genre is linked to a venue or artist at most once, which is what the
+# set-based genre sync assumes.  Existing duplicate links must be removed
+# before upgrading.
+
+def upgrade():
+    with op.batch_alter_table('GenreVenue') as batch_op:
+        batch_op.create_unique_constraint('uq_GenreVenue_genre_venue', ['genre_id', 'venue_id'])
+    with op.batch_alter_table('GenreArtist') as batch_op:
+        batch_op.create_unique_constraint('uq_GenreArtist_genre_artist', ['genre_id', 'artist_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('GenreArtist') as batch_op:
+        batch_op.drop_constraint('uq_GenreArtist_genre_artist', type_='unique')
+    with op.batch_alter_table('GenreVenue') as batch_op:
+        batch_op.drop_constraint('uq_GenreVenue_genre_venue', type_='unique')
@@ -0,0 +1,36 @@
+"""search trigram indexes
+
+Revision ID: b2f7ef38075f
+Revises: f8e7fcab6b26
+Create Date: 2026-10-18 19:12:15.260852
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2f7ef38075f'
+down_revision = 'f8e7fcab6b26'
+branch_labels = None
+depends_on = None
+
+
+# Trigram GIN indexes let Postgres answer ILIKE '%term%' name searches without a
+# sequential scan.  Other databases use the in-process n-gram index in search.py.
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_Venue_name_trgm', 'Venue', ['name'],
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_Artist_name_trgm', 'Artist', ['name'],
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_Artist_name_trgm', table_name='Artist')
+    op.drop_index('ix_Venue_name_trgm', table_name='Venue')
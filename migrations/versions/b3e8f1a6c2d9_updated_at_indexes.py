@@ -0,0 +1,31 @@
+"""updated_at indexes
+
+Revision ID: b3e8f1a6c2d9
+Revises: 7d1c3e9b2a4f
+Create Date: 2026-10-18 21:40:12.318904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e8f1a6c2d9'
+down_revision = '7d1c3e9b2a4f'
+branch_labels = None
+depends_on = None
+
+
+# The name indexes of search.py look for rows written by other processes by
+# updated_at every few seconds; without these each look scans the table.
+
+def upgrade():
+    op.create_index('ix_Venue_updated_at', 'Venue', ['updated_at'], unique=False)
+    op.create_index('ix_Artist_updated_at', 'Artist', ['updated_at'], unique=False)
+    op.create_index('ix_City_updated_at', 'City', ['updated_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_City_updated_at', table_name='City')
+    op.drop_index('ix_Artist_updated_at', table_name='Artist')
+    op.drop_index('ix_Venue_updated_at', table_name='Venue')
@@ -0,0 +1,158 @@
+#----------------------------------------------------------------------------#
+# In-process registry of the City and Genre reference rows.
+#
+# Write paths resolve a form's city and genres to ids through resolve().  Known
+# keys cost nothing; unknown ones are get-or-created together in a single
+# INSERT ... ON CONFLICT statement on Postgres (INSERT OR IGNORE plus a
+# select on SQLite).  Ids learnt inside a transaction only reach the registry
+# once it commits, so a rollback cannot leave ids for rows that never existed.
+#----------------------------------------------------------------------------#
+
+import threading
+
+from sqlalchemy import event, literal, null, select, tuple_, union_all
+from sqlalchemy.dialects import postgresql
+
+from search import track_commits
+
+PENDING = 'reference_pending'
+
+
+class ReferenceRegistry:
+
+    def __init__(self, db, city, genre):
+        self.db = db
+        self.City = city
+        self.Genre = genre
+        self.cities = {}
+        self.genres = {}
+        self.warmed = False
+        self.lock = threading.Lock()
+        self.subscribers = []
+        track_commits(db, city, lambda c: (c.name, c.state), self._merge_cities)
+        track_commits(db, genre, lambda g: g.name, self._merge_genres)
+        event.listen(db.session, 'after_commit', self._commit)
+        event.listen(db.session, 'after_rollback', self._rollback)
+
+    def subscribe(self, callback):
+        # callback(kind, [(id, natural key), ...]) for rows the upserts committed;
+        # they bypass the ORM, so indexes fed by ORM events would miss them
+        self.subscribers.append(callback)
+
+    def warm(self):
+        cities = {(name, state): key for key, name, state in
+                  self.db.session.query(self.City.id, self.City.name, self.City.state)}
+        genres = {name: key for key, name in
+                  self.db.session.query(self.Genre.id, self.Genre.name)}
+        with self.lock:
+            self.cities = cities
+            self.genres = genres
+            self.warmed = True
+
+    def resolve(self, city=None, genres=()):
+        # city is a (name, state) pair; returns (city id or None, {genre name: id})
+        city_ids, genre_ids = self.resolve_many([city] if city else (), genres)
+        return city_ids.get(city), genre_ids
+
+    def resolve_many(self, cities=(), genres=()):
+        # returns ({(name, state): id}, {genre name: id}) in at most one round trip
+        if not self.warmed:
+            self.warm()
+        cities = list(dict.fromkeys(cities))
+        genres = list(dict.fromkeys(genres))
+        with self.lock:
+            city_ids = {city: self.cities[city] for city in cities if city in self.cities}
+            genre_ids = {name: self.genres[name] for name in genres if name in self.genres}
+        missing_cities = [city for city in cities if city not in city_ids]
+        missing_genres = [name for name in genres if name not in genre_ids]
+        if missing_cities or missing_genres:
+            session = self.db.session()
+            pending = session.info.setdefault(PENDING, [])
+            for kind, key, name, state in self._upsert(missing_cities, missing_genres):
+                pending.append((kind, key, name, state))
+                if kind == 'city':
+                    city_ids[(name, state)] = key
+                else:
+                    genre_ids[name] = key
+        return city_ids, genre_ids
+
+    def _upsert(self, cities, genres):
+        if self.db.engine.dialect.name == 'postgresql':
+            return self._upsert_returning(cities, genres)
+        return self._upsert_then_select(cities, genres)
+
+    def _upsert_returning(self, cities, genres):
+        # DO UPDATE (a no-op SET) rather than DO NOTHING so existing rows come
+        # back from RETURNING too; both inserts ride in one statement as CTEs
+        parts = []
+        if cities:
+            table = self.City.__table__
+            ins = postgresql.insert(table).values([{'name': name, 'state': state} for name, state in cities])
+            ins = ins.on_conflict_do_update(
+                index_elements=[table.c.name, table.c.state],
+                set_={'name': ins.excluded.name}
+            ).returning(table.c.id, table.c.name, table.c.state).cte('new_cities')
+            parts.append(select([literal('city').label('kind'), ins.c.id, ins.c.name, ins.c.state]))
+        if genres:
+            table = self.Genre.__table__
+            ins = postgresql.insert(table).values([{'name': name} for name in genres])
+            ins = ins.on_conflict_do_update(
+                index_elements=[table.c.name],
+                set_={'name': ins.excluded.name}
+            ).returning(table.c.id, table.c.name).cte('new_genres')
+            parts.append(select([literal('genre').label('kind'), ins.c.id, ins.c.name, null().label('state')]))
+        stmt = parts[0] if len(parts) == 1 else union_all(*parts)
+        return [tuple(row) for row in self.db.session.execute(stmt)]
+
+    def _upsert_then_select(self, cities, genres):
+        session = self.db.session
+        rows = []
+        if cities:
+            table = self.City.__table__
+            session.execute(table.insert().prefix_with('OR IGNORE'),
+                            [{'name': name, 'state': state} for name, state in cities])
+            found = session.execute(select([table.c.id, table.c.name, table.c.state]).where(
+                tuple_(table.c.name, table.c.state).in_(cities)))
+            for key, name, state in found:
+                rows.append(('city', key, name, state))
+        if genres:
+            table = self.Genre.__table__
+            session.execute(table.insert().prefix_with('OR IGNORE'), [{'name': name} for name in genres])
+            for key, name in session.execute(select([table.c.id, table.c.name]).where(table.c.name.in_(genres))):
+                rows.append(('genre', key, name, None))
+        return rows
+
+    def _commit(self, session):
+        pending = session.info.pop(PENDING, None)
+        if not pending:
+            return
+        committed = {'city': [], 'genre': []}
+        with self.lock:
+            for kind, key, name, state in pending:
+                if kind == 'city':
+                    self.cities[(name, state)] = key
+                    committed[kind].append((key, (name, state)))
+                else:
+                    self.genres[name] = key
+                    committed[kind].append((key, name))
+        for kind, rows in committed.items():
+            if rows:
+                for callback in self.subscribers:
+                    callback(kind, rows)
+
+    def _rollback(self, session):
+        session.info.pop(PENDING, None)
+
+    def _merge_cities(self, changes):
+        self._merge(self.cities, changes)
+
+    def _merge_genres(self, changes):
+        self._merge(self.genres, changes)
+
+    def _merge(self, registry, changes):
+        with self.lock:
+            for key, natural in changes:
+                for old in [k for k, v in registry.items() if v == key]:
+                    del registry[old]
+                if natural is not None:
+                    registry[natural] = key
@@ -0,0 +1,177 @@
+#----------------------------------------------------------------------------#
+# Connection pools and read-replica routing.
+#
+# RoutingSQLAlchemy is Flask-SQLAlchemy with two additions.  Every engine,
+# primary and replicas, gets its pool from the DB_POOL_* settings (SQLite
+# keeps SQLAlchemy's own pools) and times each checkout, which is where a
+# request waits when the pool is exhausted; on_pool_wait() callbacks get the
+# database name and the seconds waited.
+#
+# With SQLALCHEMY_REPLICA_URIS set, the session sends the reads of GET and
+# HEAD requests to one of the replicas, picked round-robin per request.
+# Everything else goes to the primary: other methods, CLI commands, DML,
+# SELECT ... FOR UPDATE/SHARE, and whatever a request runs once it has
+# written.  A client that wrote keeps reading from the primary for
+# REPLICA_STICKY_SECONDS afterwards, so it sees its own write through
+# replication lag.  The page cache is shared by clients reading either side,
+# but its entries are keyed by the version the page was built at (see
+# cache.py), so a page built off a lagging replica is never handed to a
+# client reading the primary.
+#
+# dispose() and prime() are for pre-forking servers: the parent drops its
+# connections before forking and each worker opens its own before traffic
+# arrives.
+#----------------------------------------------------------------------------#
+
+import threading
+import time
+from itertools import count
+from time import perf_counter
+
+from flask import current_app, has_request_context, request, session as client_session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+# when a client that wrote may read from a replica again, in its cookie session
+STICKY_KEY = '_primary_until'
+
+
+class TimedPool:
+    # mixed into the engine's pool class by timed_pool()
+    database = None
+    db = None
+
+    def connect(self):
+        started = perf_counter()
+        try:
+            return super().connect()
+        finally:
+            self.db.pool_waited(self.database, perf_counter() - started)
+
+
+def timed_pool(base, database, db):
+    return type('Timed' + base.__name__, (TimedPool, base), {'database': database, 'db': db})
+
+
+def reading():
+    # a GET or HEAD request by a client that has not just written
+    if not has_request_context() or request.method not in ('GET', 'HEAD'):
+        return False
+    return client_session.get(STICKY_KEY, 0) < time.time()
+
+
+class RoutingSession(SignallingSession):
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is not None:
+            return bind
+        primary = super().get_bind(mapper, clause)
+        if self.info.get('wrote') or self._flushing:
+            return primary
+        if clause is not None and (clause.is_dml or getattr(clause, '_for_update_arg', None) is not None):
+            self.info['wrote'] = True
+            return primary
+        if not reading():
+            return primary
+        replicas = self.db.get_replicas(self.app)
+        if not replicas:
+            return primary
+        if 'replica' not in self.info:
+            self.info['replica'] = replicas[next(self.db.turns) % len(replicas)]
+        return self.info['replica']
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def flushing(session, flush_context, instances):
+    session.info['wrote'] = True
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def __init__(self, app=None, **kwargs):
+        self.replicas = {}
+        self.turns = count()
+        self.wait_callbacks = []
+        self.lock = threading.Lock()
+        super().__init__(app, **kwargs)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('REPLICA_STICKY_SECONDS', 10)
+        for key, value in (('POOL_SIZE', 5), ('MAX_OVERFLOW', 10), ('POOL_TIMEOUT', 30),
+                           ('POOL_RECYCLE', -1), ('POOL_PRE_PING', False)):
+            app.config.setdefault('DB_' + key, value)
+        super().init_app(app)
+        app.after_request(self.stick)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        # create_replica names its engine in the options, the primary is the default
+        database = options.pop('database_name', 'primary')
+        sa_url, options = super().apply_driver_hacks(app, sa_url, options)
+        if sa_url.get_backend_name() != 'sqlite':
+            config = app.config
+            options.update(
+                pool_size=config['DB_POOL_SIZE'],
+                max_overflow=config['DB_MAX_OVERFLOW'],
+                pool_timeout=config['DB_POOL_TIMEOUT'],
+                pool_recycle=config['DB_POOL_RECYCLE'],
+                pool_pre_ping=config['DB_POOL_PRE_PING'])
+        base = options.get('poolclass') or sa_url.get_dialect().get_pool_class(sa_url)
+        options['poolclass'] = timed_pool(base, database, self)
+        return sa_url, options
+
+    def get_replicas(self, app):
+        # the replica engines, made on first use with the primary's options
+        with self.lock:
+            engines = self.replicas.get(app)
+            if engines is None:
+                engines = self.replicas[app] = [
+                    self.create_replica(app, uri, 'replica%d' % i)
+                    for i, uri in enumerate(app.config['SQLALCHEMY_REPLICA_URIS'])]
+            return engines
+
+    def create_replica(self, app, uri, name):
+        options = self.apply_pool_defaults(app, {'database_name': name})
+        sa_url, options = self.apply_driver_hacks(app, make_url(uri), options)
+        options.update(app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+        options.update(self._engine_options)
+        return self.create_engine(sa_url, options)
+
+    def engines(self, app):
+        return [self.get_engine(app)] + self.get_replicas(app)
+
+    def dispose(self, app, close=True):
+        # drops the pooled connections; a forked worker passes close=False so
+        # the sockets it inherited stay open for the process that owns them
+        for engine in self.engines(app):
+            engine.dispose(close=close)
+
+    def prime(self, app, connections):
+        # opens up to `connections` per pool now rather than on the first
+        # requests; pools that don't keep connections are left alone
+        for engine in self.engines(app):
+            if isinstance(engine.pool, QueuePool):
+                opened = [engine.connect() for i in range(min(connections, engine.pool.size()))]
+                for connection in opened:
+                    connection.close()
+
+    def on_pool_wait(self, callback):
+        self.wait_callbacks.append(callback)
+
+    def pool_waited(self, database, seconds):
+        for callback in self.wait_callbacks:
+            callback(database, seconds)
+
+    def stick(self, response):
+        if self.session.registry.has() and self.session().info.get('wrote'):
+            client_session[STICKY_KEY] = time.time() + current_app.config['REPLICA_STICKY_SECONDS']
+        return response
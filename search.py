@@ -0,0 +1,388 @@
+#----------------------------------------------------------------------------#
+# Name search for venues and artists.
+#
+# On Postgres the query is an ILIKE served by the pg_trgm GIN indexes from the
+# "search trigram indexes" migration, ranked by trigram similarity.  Anywhere
+# else (SQLite in dev) an in-process n-gram inverted index is built on first
+# use and kept current from the ORM's insert/update/delete events.
+#
+# The type-ahead prefix index behind /api/autocomplete lives here as well and
+# is kept current the same way.
+#
+# Those events only carry this process's writes.  What other workers and
+# `flask import` write is caught up by Freshness, at most every
+# SEARCH_REFRESH_SECONDS: the rows changed since the last look are applied,
+# and a count that no longer matches (rows deleted elsewhere) rebuilds.
+#----------------------------------------------------------------------------#
+
+import heapq
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import timedelta
+from time import monotonic
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import object_session
+
+GRAM = 3
+# more rows changed elsewhere than this are applied by rebuilding the index
+CATCH_UP_ROWS = 1000
+
+
+def grams(text):
+    text = text.lower()
+    return {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+
+def rank(term, lowered):
+    # earlier matches first, then shorter (closer) names, then alphabetical
+    return (lowered.find(term), len(lowered), lowered)
+
+
+def like_pattern(term):
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return '%' + escaped + '%'
+
+
+class NgramIndex:
+    # Maps each trigram of a lower-cased name to the ids containing it.  A
+    # substring query only has to intersect the postings of its own trigrams
+    # and then confirm the candidates, instead of scanning every name.
+
+    def __init__(self):
+        self.names = {}
+        self.lowered = {}
+        self.postings = defaultdict(set)
+
+    def add(self, key, name):
+        self.remove(key)
+        if name is None:
+            return
+        self.names[key] = name
+        self.lowered[key] = name.lower()
+        for g in grams(name):
+            self.postings[g].add(key)
+
+    def remove(self, key):
+        name = self.names.pop(key, None)
+        if name is None:
+            return
+        del self.lowered[key]
+        for g in grams(name):
+            keys = self.postings.get(g)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.postings[g]
+
+    def candidates(self, term):
+        if len(term) < GRAM:
+            # too short to have a trigram; fall back to every name
+            return self.names.keys()
+        sets = sorted((self.postings.get(g, ()) for g in grams(term)), key=len)
+        if not sets or not sets[0]:
+            return ()
+        found = set(sets[0])
+        for keys in sets[1:]:
+            found &= keys
+            if not found:
+                break
+        return found
+
+    def search(self, term, limit=None, offset=0):
+        # (total, ranked hits from offset); only the hits up to offset + limit
+        # are ranked in order, which keeps a term most names contain cheap
+        term = term.lower()
+        lowered = self.lowered
+        keys = [key for key in self.candidates(term) if term in lowered[key]]
+        total = len(keys)
+        order = lambda key: rank(term, lowered[key])
+        if limit is None:
+            keys.sort(key=order)
+        else:
+            keys = heapq.nsmallest(offset + limit, keys, key=order)
+        return total, [(key, self.names[key]) for key in keys[offset:]]
+
+
+def track_commits(db, model, label, apply):
+    # Calls apply([(id, label or None), ...]) after each successful commit
+    # that inserted, updated or deleted `model` rows through the ORM.
+    # Changes are staged per session, so a rollback drops them.
+    key = ('tracked', model.__name__, apply)
+
+    def changed(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault(key, []).append((target.id, label(target)))
+
+    def deleted(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault(key, []).append((target.id, None))
+
+    def committed(session):
+        pending = session.info.pop(key, None)
+        if pending:
+            apply(pending)
+
+    def rolled_back(session):
+        session.info.pop(key, None)
+
+    event.listen(model, 'after_insert', changed)
+    event.listen(model, 'after_update', changed)
+    event.listen(model, 'after_delete', deleted)
+    event.listen(db.session, 'after_commit', committed)
+    event.listen(db.session, 'after_rollback', rolled_back)
+
+
+class Freshness:
+    # Writes an in-process index wasn't told about, from model.updated_at.
+    # check() runs at most every `every` seconds (None: never) and returns
+    # None, or (rows with a label now, rows written since the last look).
+    # Looks are timed by the database's clock, as updated_at is, and reach a
+    # second further back: SQLite's now() has one second resolution, and a
+    # row from the second of the last look is read again rather than missed.
+    # A transaction committing more than that after its now() can slip past,
+    # renames in it until the next rebuild; its inserts show in the count.
+    # The looks stay out of the request's query count and budget.
+
+    def __init__(self, model, column, every):
+        self.model = model
+        self.column = column
+        self.every = every
+        self.since = None
+        self.checked = None
+
+    def start(self, session):
+        # before a build, so what is written during it is read next time
+        self.since = session.execute(select(func.now())).scalar()
+        self.checked = monotonic()
+
+    def check(self, session, *columns):
+        if self.every is None or monotonic() - self.checked < self.every:
+            return None
+        self.checked = monotonic()
+        model = self.model
+        count, now = session.execute(
+            select(func.count(self.column), func.now()).execution_options(sql_stats=False)).one()
+        rows = session.execute(select(model.id, *columns).where(
+            model.updated_at >= self.since - timedelta(seconds=1)).execution_options(sql_stats=False)).all()
+        self.since = now
+        return count, rows
+
+
+class NameSearch:
+    # Case-insensitive substring search over model.name returning
+    # (total, [(id, name), ...]) for one page of ranked hits.
+
+    def __init__(self, db, model, refresh=None):
+        self.db = db
+        self.model = model
+        self.index = None
+        self.fresh = Freshness(model, model.name, refresh)
+        self.lock = threading.Lock()
+        track_commits(db, model, lambda row: row.name, self._apply)
+
+    def search(self, term, limit=20, offset=0):
+        if self.db.engine.dialect.name == 'postgresql':
+            return self._search_trigram(term, limit, offset)
+        with self.lock:
+            return self._ngram_index().search(term, limit, offset)
+
+    def trigram_statements(self, term, limit, offset):
+        # (total count, one page of hits) on Postgres; they don't depend on
+        # each other, so the async mode runs them at the same time
+        name = self.model.name
+        matches = name.ilike(like_pattern(term), escape='\\')
+        total = select(func.count(self.model.id)).where(matches)
+        hits = select(self.model.id, name).where(matches) \
+            .order_by(func.similarity(name, term).desc(), name).limit(limit).offset(offset)
+        return total, hits
+
+    def _search_trigram(self, term, limit, offset):
+        total, hits = self.trigram_statements(term, limit, offset)
+        session = self.db.session
+        return session.execute(total).scalar(), [tuple(hit) for hit in session.execute(hits)]
+
+    def _ngram_index(self):
+        # called with the lock held
+        session = self.db.session
+        if self.index is not None:
+            found = self.fresh.check(session, self.model.name)
+            if found is not None:
+                count, rows = found
+                names = self.index.names
+                changed = [(key, name) for key, name in rows if names.get(key) != name]
+                if len(changed) > CATCH_UP_ROWS:
+                    self.index = None
+                else:
+                    for key, name in changed:
+                        self.index.add(key, name)
+                    if len(names) != count:
+                        # rows were deleted elsewhere, only a rebuild finds which
+                        self.index = None
+        if self.index is None:
+            self.fresh.start(session)
+            index = NgramIndex()
+            for key, name in session.query(self.model.id, self.model.name):
+                index.add(key, name)
+            self.index = index
+        return self.index
+
+    def warm(self):
+        # builds the index ahead of the first search; Postgres needs none
+        if self.db.engine.dialect.name != 'postgresql':
+            with self.lock:
+                self._ngram_index()
+
+    def invalidate(self):
+        # for writes that bypass the ORM (bulk statements); rebuilt on next search
+        with self.lock:
+            self.index = None
+
+    def _apply(self, changes):
+        with self.lock:
+            if self.index is None:
+                return
+            for key, name in changes:
+                self.index.add(key, name)
+
+
+class PrefixIndex:
+    # One sorted array of (folded word-suffix, id) per kind, searched with
+    # bisect.  Each label is entered once per word, so "mus" finds "The
+    # Musical Hop"; a search for some kinds only reads their arrays.
+
+    def __init__(self):
+        self.keys = {}
+        self.labels = {}
+        # labels per kind
+        self.sizes = defaultdict(int)
+
+    @staticmethod
+    def suffixes(label):
+        words = label.lower().split()
+        return {' '.join(words[i:]) for i in range(len(words))}
+
+    def load(self, kind, rows):
+        # bulk entry of (id, label) rows not in the index yet: one sort
+        # instead of an O(n) insort per suffix
+        entries = self.keys.setdefault(kind, [])
+        for key, label in rows:
+            if label is not None:
+                self.labels[(kind, key)] = label
+                self.sizes[kind] += 1
+                entries.extend((suffix, key) for suffix in self.suffixes(label))
+        entries.sort()
+
+    def add(self, kind, key, label):
+        self.remove(kind, key)
+        if label is None:
+            return
+        self.labels[(kind, key)] = label
+        self.sizes[kind] += 1
+        entries = self.keys.setdefault(kind, [])
+        for suffix in self.suffixes(label):
+            insort(entries, (suffix, key))
+
+    def remove(self, kind, key):
+        label = self.labels.pop((kind, key), None)
+        if label is None:
+            return
+        self.sizes[kind] -= 1
+        entries = self.keys[kind]
+        for suffix in self.suffixes(label):
+            i = bisect_left(entries, (suffix, key))
+            if i < len(entries) and entries[i] == (suffix, key):
+                del entries[i]
+
+    def _matches(self, kind, prefix, limit):
+        # the first limit ids of a kind with a suffix starting with prefix
+        entries = self.keys.get(kind, ())
+        found = []
+        seen = set()
+        i = bisect_left(entries, (prefix,))
+        while i < len(entries) and len(found) < limit:
+            suffix, key = entries[i]
+            if not suffix.startswith(prefix):
+                break
+            i += 1
+            if key not in seen:
+                seen.add(key)
+                found.append((suffix, kind, key))
+        return found
+
+    def complete(self, prefix, limit=10, kinds=None):
+        prefix = ' '.join(prefix.lower().split())
+        if not prefix:
+            return []
+        found = []
+        for kind in (self.keys if kinds is None else kinds):
+            found.extend(self._matches(kind, prefix, limit))
+        # merged in suffix order, as one array would give them
+        found.sort()
+        return [(kind, key, self.labels[(kind, key)]) for suffix, kind, key in found[:limit]]
+
+
+class Autocomplete:
+    # Name suggestions for several models from one in-process PrefixIndex.
+    # sources maps a kind ('venue', ...) to (model, label function, columns);
+    # a row has a label when its first column isn't null.
+
+    def __init__(self, db, sources, refresh=None):
+        self.db = db
+        self.sources = sources
+        self.index = None
+        self.fresh = {kind: Freshness(model, columns[0], refresh) for kind, (model, label, columns) in sources.items()}
+        self.lock = threading.Lock()
+        for kind, (model, label, columns) in sources.items():
+            track_commits(db, model, label, self._applier(kind))
+
+    def warm(self):
+        # builds the index, or catches it up with other processes' writes
+        with self.lock:
+            session = self.db.session
+            if self.index is not None:
+                for kind, (model, label, columns) in self.sources.items():
+                    found = self.fresh[kind].check(session, *columns)
+                    if found is None:
+                        continue
+                    count, rows = found
+                    labels = self.index.labels
+                    changed = [(row.id, label(row)) for row in rows]
+                    changed = [(key, name) for key, name in changed if labels.get((kind, key)) != name]
+                    if len(changed) <= CATCH_UP_ROWS:
+                        for key, name in changed:
+                            self.index.add(kind, key, name)
+                    if len(changed) > CATCH_UP_ROWS or self.index.sizes[kind] != count:
+                        # a bulk write, or rows deleted elsewhere, which only a rebuild finds
+                        self.index = None
+                        break
+            if self.index is None:
+                index = PrefixIndex()
+                for kind, (model, label, columns) in self.sources.items():
+                    self.fresh[kind].start(session)
+                    index.load(kind, ((row.id, label(row)) for row in session.query(model.id, *columns)))
+                self.index = index
+        return self.index
+
+    def invalidate(self):
+        with self.lock:
+            self.index = None
+
+    def complete(self, prefix, limit=10, kinds=None):
+        index = self.warm()
+        with self.lock:
+            return index.complete(prefix, limit, kinds)
+
+    def update(self, kind, changes):
+        # changes are (id, label or None) pairs, e.g. from writes outside the ORM
+        with self.lock:
+            if self.index is None:
+                return
+            for key, label in changes:
+                self.index.add(kind, key, label)
+
+    def _applier(self, kind):
+        return lambda changes: self.update(kind, changes)
@@ -2,3 +2,30 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// Type-ahead for the navbar search boxes, fed by /api/autocomplete.
+document.querySelectorAll('form.search input[name="search_term"]').forEach(function (input, n) {
+  var type = input.form.getAttribute('action').indexOf('/artists') === 0 ? 'artist' : 'venue';
+  var list = document.createElement('datalist');
+  list.id = 'search-suggestions-' + n;
+  input.setAttribute('list', list.id);
+  input.setAttribute('autocomplete', 'off');
+  input.form.appendChild(list);
+
+  var pending = null;
+  input.addEventListener('input', function () {
+    clearTimeout(pending);
+    pending = setTimeout(function () {
+      fetch('/api/autocomplete?types=' + type + '&q=' + encodeURIComponent(input.value))
+        .then(function (response) { return response.json(); })
+        .then(function (data) {
+          list.innerHTML = '';
+          data.suggestions.forEach(function (s) {
+            var option = document.createElement('option');
+            option.value = s.name;
+            list.appendChild(option);
+          });
+        });
+    }, 100);
+  });
+});
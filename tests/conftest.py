@@ -0,0 +1,85 @@
+#----------------------------------------------------------------------------#
+# The app against a scratch SQLite database seeded by benchmarks.dataset.
+#
+#   python -m pytest
+#
+# config.py reads the environment when app is first imported, so it is set
+# here before any test imports it.  seeded(params) (re)seeds the database
+# when it holds another dataset, rebuilds the in-process indexes and empties
+# the caches, so every request a test makes runs its queries.  Tests that
+# write take writable(params) instead, which reseeds after them.  Query
+# budgets are strict: an endpoint over its SQL_QUERY_BUDGETS entry raises.
+#----------------------------------------------------------------------------#
+
+import os
+import re
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRATCH = tempfile.mkdtemp(prefix='fyyur-tests-')
+DATABASE = os.path.join(SCRATCH, 'fyyur.db')
+
+sys.path.insert(0, ROOT)
+os.environ['DATABASE_URL'] = 'sqlite:///' + DATABASE
+os.environ['DATABASE_REPLICA_URLS'] = ''
+os.environ['SECRET_KEY'] = 'tests'
+# debug mode off, as in production
+os.environ.pop('FLASK_DEBUG', None)
+os.environ.pop('FLASK_ENV', None)
+os.environ['TEMPLATE_CACHE_DIR'] = os.path.join(SCRATCH, 'templates')
+os.environ['ERROR_LOG'] = os.path.join(SCRATCH, 'error.log')
+
+SMALL = {'cities': 5, 'venues': 20, 'artists': 30, 'shows': 200, 'seed': 1}
+LARGE = {'cities': 5, 'venues': 200, 'artists': 300, 'shows': 4000, 'seed': 1}
+
+
+@pytest.fixture(scope='session')
+def fyyur():
+    import app
+    app.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False, SQL_SERVER_TIMING=True, SQL_BUDGET_STRICT=True)
+    return app
+
+
+class Datasets:
+
+    def __init__(self, fyyur):
+        self.fyyur = fyyur
+        self.params = None
+
+    def __call__(self, params):
+        fyyur = self.fyyur
+        with fyyur.app.app_context():
+            if self.params != params:
+                from benchmarks.dataset import seed
+                seed(fyyur.db, params, echo=lambda line: None)
+                self.params = params
+                for index in (fyyur.autocomplete, fyyur.venue_search, fyyur.artist_search):
+                    index.invalidate()
+                fyyur.warm_up()
+            fyyur.db.session.remove()
+        fyyur.page_cache.clear()
+        fyyur.fragment_cache.clear()
+        return fyyur
+
+    def forget(self):
+        # the database no longer holds the dataset it was seeded with
+        self.params = None
+
+
+@pytest.fixture(scope='session')
+def seeded(fyyur):
+    return Datasets(fyyur)
+
+
+@pytest.fixture
+def writable(seeded):
+    yield seeded
+    seeded.forget()
+
+
+def queries(response):
+    # statements the request ran, from the Server-Timing header of instrumentation.py
+    return int(re.search(r'queries: (\d+)', response.headers['Server-Timing']).group(1))
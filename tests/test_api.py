@@ -0,0 +1,34 @@
+from conftest import SMALL
+
+
+def test_api_venues_pages_by_cursor(seeded):
+    fyyur = seeded(SMALL)
+    client = fyyur.app.test_client()
+    with fyyur.app.app_context():
+        areas = fyyur.venues_by_city()
+        fyyur.db.session.remove()
+    expected = [(area['id'], venue['id']) for area in areas for venue in area['venues']]
+
+    listed, cities, pages = [], set(), 0
+    path = '/api/v1/venues?limit=7'
+    while path:
+        body = client.get(path).get_json()
+        pages += 1
+        assert body['meta']['limit'] == 7
+        assert body['links']['next'] == (None if body['meta']['next'] is None else
+                                         '/api/v1/venues?limit=7&after=%s' % body['meta']['next'])
+        for area in body['data']:
+            cities.add(area['id'])
+            listed.extend((area['id'], venue['id']) for venue in area['venues'])
+        path = body['links']['next']
+    assert listed == expected
+    # venueless cities included
+    assert cities == {area['id'] for area in areas}
+    assert pages > 1
+
+
+def test_api_venues_rejects_a_malformed_cursor(seeded):
+    fyyur = seeded(SMALL)
+    response = fyyur.app.test_client().get('/api/v1/venues?after=bm9wZQ')
+    assert response.status_code == 400
+    assert response.get_json()['error']['status'] == 400
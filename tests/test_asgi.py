@@ -0,0 +1,57 @@
+import asyncio
+from urllib.parse import urlencode
+
+from conftest import SMALL
+
+
+def call(application, scope, chunks):
+    # the response status and body of one request, its body sent in chunks
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+    asyncio.run(application(scope, receive, send))
+    status = next(message['status'] for message in sent if message['type'] == 'http.response.start')
+    return status, b''.join(message.get('body', b'') for message in sent if message['type'] == 'http.response.body')
+
+
+def test_a_chunked_search_post_reaches_the_form(seeded):
+    fyyur = seeded(SMALL)
+    import asgi
+    with fyyur.app.app_context():
+        # the highest id, its name is part of no other
+        term = fyyur.Venue.query.get(SMALL['venues']).name
+        fyyur.db.session.remove()
+    form = urlencode({'search_term': term}).encode('utf-8')
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+        'path': '/venues/search', 'raw_path': b'/venues/search', 'root_path': '', 'query_string': b'',
+        'server': ('localhost', 80), 'client': ('127.0.0.1', 5000),
+        # no Content-Length, as a chunked request has none
+        'headers': [(b'host', b'localhost'), (b'content-type', b'application/x-www-form-urlencoded'),
+                    (b'transfer-encoding', b'chunked')]
+    }
+    status, body = call(asgi.application, scope, [form[:7], form[7:]])
+    assert status == 200
+    assert ('results for "%s": 1' % term).encode('utf-8') in body
+
+
+def test_requests_passed_to_the_wsgi_app_are_recorded(seeded):
+    fyyur = seeded(SMALL)
+    import asgi
+    from test_metrics import recorded
+    count, in_flight = recorded(fyyur, 'export_shows_file')
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': '/shows/export.csv', 'raw_path': b'/shows/export.csv', 'root_path': '', 'query_string': b'',
+        'server': ('localhost', 80), 'client': ('127.0.0.1', 5000), 'headers': [(b'host', b'localhost')]
+    }
+    status, body = call(asgi.application, scope, [b''])
+    assert status == 200
+    assert body.count(b'\n') == SMALL['shows'] + 1
+    assert recorded(fyyur, 'export_shows_file') == (count + 1, in_flight)
@@ -0,0 +1,32 @@
+from conftest import LARGE, queries
+
+
+def busiest_and_quietest(fyyur, column):
+    # ids of the entities with the most and the fewest shows
+    with fyyur.app.app_context():
+        count = fyyur.db.func.count(fyyur.Show.id)
+        found = fyyur.db.session.query(column, count).group_by(column).order_by(count, column).all()
+        fyyur.db.session.remove()
+    (quietest, few), (busiest, many) = found[0], found[-1]
+    assert few == 1 and many >= 300
+    return busiest, quietest
+
+
+def page_queries(fyyur, path):
+    response = fyyur.app.test_client().get(path)
+    assert response.status_code == 200
+    return queries(response)
+
+
+def test_venue_page_query_count_does_not_grow_with_its_shows(seeded):
+    fyyur = seeded(LARGE)
+    busiest, quietest = busiest_and_quietest(fyyur, fyyur.Show.venue_id)
+    budget = fyyur.app.config['SQL_QUERY_BUDGETS']['show_venue']
+    assert page_queries(fyyur, '/venues/%d' % busiest) == page_queries(fyyur, '/venues/%d' % quietest) == budget == 4
+
+
+def test_artist_page_query_count_does_not_grow_with_its_shows(seeded):
+    fyyur = seeded(LARGE)
+    busiest, quietest = busiest_and_quietest(fyyur, fyyur.Show.artist_id)
+    budget = fyyur.app.config['SQL_QUERY_BUDGETS']['show_artist']
+    assert page_queries(fyyur, '/artists/%d' % busiest) == page_queries(fyyur, '/artists/%d' % quietest) == budget == 4
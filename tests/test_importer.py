@@ -0,0 +1,41 @@
+import json
+import time
+from datetime import datetime
+
+from conftest import SMALL
+
+
+def test_show_import_takes_iso_times_and_skips_unknown_ids(writable, tmp_path, monkeypatch):
+    # times with an offset are stored as naive UTC, not in the host's zone
+    monkeypatch.setenv('TZ', 'America/New_York')
+    time.tzset()
+    fyyur = writable(SMALL)
+    from importer import import_file
+    rows = [
+        {'artist_id': 1, 'venue_id': 1, 'start_time': '2035-04-01T20:00:00'},
+        {'artist_id': 1, 'venue_id': 2, 'start_time': '2035-04-01T20:00:00Z'},
+        {'artist_id': 2, 'venue_id': 1, 'start_time': '2035-04-01 21:00:00'},
+        {'artist_id': 2, 'venue_id': 2, 'start_time': '2035-04-01T22:00:00+02:00'},
+        {'artist_id': 999, 'venue_id': 1, 'start_time': '2035-04-02T20:00:00'},
+        {'artist_id': 1, 'venue_id': 999, 'start_time': '2035-04-03T20:00:00'},
+        {'artist_id': 1, 'venue_id': 1, 'start_time': 'next friday'},
+    ]
+    path = tmp_path / 'shows.jsonl'
+    path.write_text(''.join(json.dumps(row) + '\n' for row in rows))
+    try:
+        with fyyur.app.app_context():
+            counts = import_file('shows', str(path))
+            Show = fyyur.Show
+            listed = {(artist_id, venue_id): start.replace(tzinfo=None) for artist_id, venue_id, start in
+                      fyyur.db.session.query(Show.artist_id, Show.venue_id, Show.time).filter(Show.time >= '2035-01-01')}
+            fyyur.db.session.remove()
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+    assert counts == {'imported': 4, 'skipped': 3}
+    assert listed == {
+        (1, 1): datetime(2035, 4, 1, 20),
+        (1, 2): datetime(2035, 4, 1, 20),
+        (2, 1): datetime(2035, 4, 1, 21),
+        (2, 2): datetime(2035, 4, 1, 20)
+    }
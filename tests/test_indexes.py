@@ -0,0 +1,91 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from conftest import LARGE
+
+
+@contextmanager
+def selects(fyyur):
+    # the SELECTs the app sends the driver, with their parameters
+    found = []
+
+    def executing(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            found.append((statement, parameters))
+    with fyyur.app.app_context():
+        engine = fyyur.db.engine
+    event.listen(engine, 'before_cursor_execute', executing)
+    try:
+        yield found
+    finally:
+        event.remove(engine, 'before_cursor_execute', executing)
+
+
+def plans(fyyur, statements):
+    # the EXPLAIN QUERY PLAN details of every statement, as one list
+    with fyyur.app.app_context():
+        conn = fyyur.db.session.connection()
+        found = [row[-1] for statement, parameters in statements
+                 for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)]
+        fyyur.db.session.remove()
+    return found
+
+
+def index_on(fyyur, table, *columns):
+    # the name of the index over exactly these columns; unique constraints
+    # get sqlite_autoindex_ names
+    with fyyur.app.app_context():
+        conn = fyyur.db.session.connection()
+        for row in conn.exec_driver_sql('PRAGMA index_list("%s")' % table):
+            found = [info[2] for info in conn.exec_driver_sql('PRAGMA index_info("%s")' % row[1])]
+            if tuple(found) == columns:
+                fyyur.db.session.remove()
+                return row[1]
+    raise AssertionError('no index on %s%r' % (table, columns))
+
+
+def searched(fyyur, path, method='get', **kwargs):
+    with selects(fyyur) as found:
+        response = getattr(fyyur.app.test_client(), method)(path, **kwargs)
+    assert response.status_code == 200
+    return plans(fyyur, found)
+
+
+def uses(found, table, index):
+    return any(detail.startswith(('SEARCH %s ' % table, 'SCAN %s ' % table)) and ' INDEX %s' % index in detail
+               for detail in found)
+
+
+def test_venue_page_reads_its_shows_and_genres_through_indexes(seeded):
+    fyyur = seeded(LARGE)
+    found = searched(fyyur, '/venues/1')
+    assert uses(found, 'Show', index_on(fyyur, 'Show', 'venue_id', 'time', 'artist_id'))
+    assert uses(found, 'GenreVenue', 'ix_GenreVenue_venue_id')
+
+
+def test_artist_page_reads_its_shows_and_genres_through_indexes(seeded):
+    fyyur = seeded(LARGE)
+    found = searched(fyyur, '/artists/1')
+    assert uses(found, 'Show', 'ix_Show_artist_id_time')
+    assert uses(found, 'GenreArtist', 'ix_GenreArtist_artist_id')
+
+
+def test_shows_feed_pages_through_the_time_index(seeded):
+    fyyur = seeded(LARGE)
+    assert uses(searched(fyyur, '/shows'), 'Show', 'ix_Show_time_id')
+    assert uses(searched(fyyur, '/shows?city_id=2'), 'Venue', 'ix_Venue_city_id')
+
+
+def test_venues_listing_joins_venues_by_city(seeded):
+    fyyur = seeded(LARGE)
+    assert uses(searched(fyyur, '/venues'), 'Venue', 'ix_Venue_city_id')
+
+
+def test_new_cities_are_looked_up_by_name_and_state(writable):
+    fyyur = writable(LARGE)
+    found = searched(fyyur, '/venues/create', method='post', data={
+        'name': 'The Index Room', 'city': 'Nowhere', 'state': 'CA', 'address': '1 Main St',
+        'phone': '555-555-5555', 'image_link': 'https://images.example.com/x.jpg', 'genres': ['Jazz']
+    })
+    assert uses(found, 'City', index_on(fyyur, 'City', 'name', 'state'))
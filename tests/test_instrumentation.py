@@ -0,0 +1,24 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from conftest import SMALL
+
+
+def test_an_endpoint_over_its_query_budget_fails(seeded, monkeypatch):
+    fyyur = seeded(SMALL)
+    from instrumentation import QueryBudgetExceeded
+    # /venues runs two
+    monkeypatch.setitem(fyyur.app.config['SQL_QUERY_BUDGETS'], 'venues', 1)
+    with pytest.raises(QueryBudgetExceeded, match='venues ran 2 queries, over its budget of 1'):
+        fyyur.app.test_client().get('/venues')
+
+
+def test_a_statement_that_raises_leaves_no_timer_behind(fyyur):
+    with fyyur.app.app_context():
+        with fyyur.db.engine.connect() as conn:
+            with pytest.raises(OperationalError):
+                conn.exec_driver_sql('SELECT * FROM no_such_table')
+            assert conn.info['query_started'] == []
+            # and the next statement is timed against its own start
+            assert conn.exec_driver_sql('SELECT 1').scalar() == 1
+            assert conn.info['query_started'] == []
@@ -0,0 +1,69 @@
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from conftest import LARGE, SMALL, queries
+
+
+@contextmanager
+def loaded(fyyur):
+    # counts the instances the ORM builds from fetched rows, by model
+    found = Counter()
+
+    def load(target, context):
+        found[type(target).__name__] += 1
+    event.listen(fyyur.db.Model, 'load', load, propagate=True)
+    try:
+        yield found
+    finally:
+        event.remove(fyyur.db.Model, 'load', load)
+
+
+def busiest(fyyur, model, key):
+    with fyyur.app.app_context():
+        found = fyyur.db.session.query(key).group_by(key).order_by(fyyur.db.func.count().desc()).first()[0]
+        fyyur.db.session.remove()
+    return found
+
+
+def test_listing_cities_and_finding_a_genre_load_nothing_else(seeded):
+    fyyur = seeded(LARGE)
+    with fyyur.app.app_context():
+        with loaded(fyyur) as found:
+            cities = fyyur.City.query.all()
+            fyyur.Genre.query.filter_by(name='Jazz').first()
+        fyyur.db.session.remove()
+    assert found == {'City': len(cities), 'Genre': 1}
+
+
+def edit_page(fyyur, kind, model, key):
+    key = busiest(fyyur, model, key)
+    client = fyyur.app.test_client()
+    # templates compile on first use, outside what is measured
+    client.get('/%ss/%d/edit' % (kind, key))
+    with loaded(fyyur) as found:
+        tracemalloc.start()
+        try:
+            response = client.get('/%ss/%d/edit' % (kind, key))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    assert response.status_code == 200
+    return found, queries(response), peak
+
+
+def test_edit_pages_load_the_entity_its_city_and_genres_only(seeded):
+    for kind, model in (('venue', 'Venue'), ('artist', 'Artist')):
+        small = edit_page(seeded(SMALL), kind, model, getattr(seeded.fyyur.Show, kind + '_id'))
+        large = edit_page(seeded(LARGE), kind, model, getattr(seeded.fyyur.Show, kind + '_id'))
+        for found, count, peak in (small, large):
+            links = 'Genre' + model
+            assert set(found) == {model, 'City', links, 'Genre'}
+            assert found[model] == found['City'] == 1
+            assert found[links] == found['Genre']
+            # the entity with its city, then the genre links with their genres
+            assert count == 2
+        # the busiest entity of ten times the shows costs no more to edit
+        assert large[2] < small[2] * 1.5
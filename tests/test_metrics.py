@@ -0,0 +1,27 @@
+from conftest import SMALL
+
+
+def recorded(fyyur, endpoint):
+    # requests to endpoint in the request histogram, and requests in flight
+    total = fyyur.request_metrics.collect()
+    count = sum(sum(values[:-1]) for (name, labels), values in total.histograms.items()
+                if name == 'request_duration_seconds' and ('endpoint', endpoint) in labels)
+    return count, total.in_flight
+
+
+def test_a_streamed_export_is_recorded_once_its_body_is_closed(seeded):
+    fyyur = seeded(SMALL)
+    count, in_flight = recorded(fyyur, 'export_shows_file')
+    response = fyyur.app.test_client().get('/shows/export.csv')
+    assert response.is_streamed
+    # started, not sent yet
+    assert recorded(fyyur, 'export_shows_file') == (count, in_flight + 1)
+    assert response.get_data().count(b'\n') == SMALL['shows'] + 1
+    response.close()
+    assert recorded(fyyur, 'export_shows_file') == (count + 1, in_flight)
+
+
+def test_cache_stats_are_not_served_outside_debug_mode(seeded):
+    fyyur = seeded(SMALL)
+    assert not fyyur.app.debug
+    assert fyyur.app.test_client().get('/cache/stats').status_code == 404
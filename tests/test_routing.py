@@ -0,0 +1,45 @@
+import shutil
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import DATABASE, SMALL
+
+
+@pytest.fixture
+def replica(writable, tmp_path):
+    # a copy of the seeded primary that never hears of later writes
+    fyyur = writable(SMALL)
+    path = tmp_path / 'replica.db'
+    shutil.copy(DATABASE, path)
+    app, db = fyyur.app, fyyur.db
+    app.config['SQLALCHEMY_REPLICA_URIS'] = ['sqlite:///%s' % path]
+    db.replicas.pop(app, None)
+    yield fyyur
+    for engine in db.replicas.pop(app, []):
+        engine.dispose()
+    app.config['SQLALCHEMY_REPLICA_URIS'] = []
+
+
+def upcoming_heading(response):
+    assert response.status_code == 200
+    return response.get_data(as_text=True).split('Upcoming')[0].rsplit('>', 1)[1].strip()
+
+
+def test_reads_go_to_the_replica(replica):
+    with replica.app.app_context():
+        replica.db.session.query(replica.Venue).filter_by(id=1).update({'name': 'Primary Only'})
+        replica.db.session.commit()
+    page = replica.app.test_client().get('/venues/1').get_data(as_text=True)
+    assert 'Primary Only' not in page
+
+
+def test_a_writer_reads_its_own_write_past_the_page_cache(replica):
+    writer, other = replica.app.test_client(), replica.app.test_client()
+    before = upcoming_heading(other.get('/venues/1'))
+    start = (datetime.today() + timedelta(days=3)).strftime('%Y-%m-%d %H:%M:%S')
+    writer.post('/shows/create', data={'artist_id': '1', 'venue_id': '1', 'start_time': start})
+    # another client caches the page as the replica has it
+    assert upcoming_heading(other.get('/venues/1')) == before
+    # the writer reads the primary, and must not be handed that page
+    assert upcoming_heading(writer.get('/venues/1')) == str(int(before) + 1)
@@ -0,0 +1,100 @@
+import sqlite3
+
+from conftest import DATABASE, SMALL, queries
+from search import NgramIndex, PrefixIndex
+
+
+def index():
+    found = PrefixIndex()
+    found.load('venue', [(1, 'The Musical Hop'), (2, 'Park Square Live Music & Coffee'), (3, None)])
+    found.load('artist', [(1, 'Guns N Petals'), (2, 'The Wild Sax Band'), (3, 'Matt Quevedo')])
+    return found
+
+
+def test_complete_matches_any_word_across_kinds_in_suffix_order():
+    assert index().complete('m') == [
+        ('artist', 3, 'Matt Quevedo'), ('venue', 2, 'Park Square Live Music & Coffee'), ('venue', 1, 'The Musical Hop')]
+
+
+def test_complete_reads_only_the_kinds_asked_for():
+    found = index()
+    assert found.complete('the', kinds={'artist'}) == [('artist', 2, 'The Wild Sax Band')]
+    assert found.complete('the', kinds={'city'}) == []
+
+
+def test_add_replaces_and_remove_drops_a_label():
+    found = index()
+    found.add('venue', 1, 'The Dueling Pianos Bar')
+    found.add('venue', 4, 'Mad Hatter')
+    found.remove('artist', 3)
+    assert found.complete('m', limit=2) == [('venue', 4, 'Mad Hatter'), ('venue', 2, 'Park Square Live Music & Coffee')]
+    assert found.complete('duel') == [('venue', 1, 'The Dueling Pianos Bar')]
+
+
+def test_ngram_search_ranks_the_page_and_counts_every_hit():
+    found = NgramIndex()
+    for key, name in enumerate(['The Dueling Pianos Bar', 'Park Square Live Music & Coffee', 'The Musical Hop',
+                                'Musical Chairs', 'Hopscotch']):
+        found.add(key, name)
+    ranked = [(3, 'Musical Chairs'), (2, 'The Musical Hop'), (1, 'Park Square Live Music & Coffee')]
+    assert found.search('music') == (3, ranked)
+    assert found.search('music', limit=1, offset=1) == (3, ranked[1:2])
+    assert found.search('MUSIC', limit=5, offset=2) == (3, ranked[2:])
+
+
+def elsewhere(statement, *params):
+    # a write this process isn't told about, as another worker's or `flask import`'s
+    other = sqlite3.connect(DATABASE)
+    try:
+        other.execute(statement, params)
+        other.commit()
+    finally:
+        other.close()
+
+
+def looking_every_time(monkeypatch, *indexes):
+    for fresh in indexes:
+        monkeypatch.setattr(fresh, 'every', 0)
+
+
+def test_autocomplete_catches_up_with_writes_from_elsewhere(writable, monkeypatch):
+    fyyur = writable(SMALL)
+    autocomplete = fyyur.autocomplete
+    looking_every_time(monkeypatch, *autocomplete.fresh.values())
+    with fyyur.app.app_context():
+        autocomplete.warm()
+        elsewhere('INSERT INTO "Venue" (id, name, city_id, address, phone) VALUES (?, ?, 1, ?, ?)',
+                  1000, 'Zanzibar Lounge', '1 Main St', '555-555-5555')
+        assert autocomplete.complete('zanz') == [('venue', 1000, 'Zanzibar Lounge')]
+        elsewhere('UPDATE "Venue" SET name = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?', 'Quokka Lounge', 1000)
+        assert autocomplete.complete('zanz') == []
+        assert autocomplete.complete('quok') == [('venue', 1000, 'Quokka Lounge')]
+        elsewhere('DELETE FROM "Venue" WHERE id = ?', 1000)
+        assert autocomplete.complete('quok') == []
+        fyyur.db.session.remove()
+
+
+def test_sqlite_search_catches_up_with_writes_from_elsewhere(writable, monkeypatch):
+    fyyur = writable(SMALL)
+    search = fyyur.venue_search
+    looking_every_time(monkeypatch, search.fresh)
+    with fyyur.app.app_context():
+        search.warm()
+        elsewhere('INSERT INTO "Venue" (id, name, city_id, address, phone) VALUES (?, ?, 1, ?, ?)',
+                  1000, 'Zanzibar Lounge', '1 Main St', '555-555-5555')
+        assert search.search('zanzibar') == (1, [(1000, 'Zanzibar Lounge')])
+        elsewhere('UPDATE "Venue" SET name = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?', 'Quokka Lounge', 1000)
+        assert search.search('zanzibar') == (0, [])
+        assert search.search('quokka') == (1, [(1000, 'Quokka Lounge')])
+        elsewhere('DELETE FROM "Venue" WHERE id = ?', 1000)
+        assert search.search('quokka') == (0, [])
+        fyyur.db.session.remove()
+
+
+def test_looking_for_writes_from_elsewhere_is_not_counted_against_the_request(seeded, monkeypatch):
+    fyyur = seeded(SMALL)
+    client = fyyur.app.test_client()
+    before = queries(client.post('/venues/search', data={'search_term': 'the'}))
+    looking_every_time(monkeypatch, fyyur.venue_search.fresh)
+    # over its budget, and raising, if the look were counted
+    assert queries(client.post('/venues/search', data={'search_term': 'the'})) == before
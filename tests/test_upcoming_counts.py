@@ -0,0 +1,82 @@
+from datetime import timedelta
+
+from conftest import SMALL
+
+
+def stored(fyyur, model, key):
+    return fyyur.db.session.query(model.upcoming_show_count).filter(model.id == key).scalar()
+
+
+def upcoming(fyyur, as_of, *criteria):
+    Show = fyyur.Show
+    return fyyur.db.session.query(Show.id).filter(Show.time >= as_of, *criteria).count()
+
+
+def no_drift(fyyur):
+    return fyyur.reconcile_upcoming_counts(repair=False) == {'venue': [], 'artist': []}
+
+
+def test_the_roll_takes_a_show_that_started_off_the_counts(writable):
+    fyyur = writable(SMALL)
+    Show, Venue, Artist = fyyur.Show, fyyur.Venue, fyyur.Artist
+    client = fyyur.app.test_client()
+    with fyyur.app.app_context():
+        as_of = fyyur.counter_clock().as_of
+        fyyur.db.session.remove()
+    starts = as_of.replace(microsecond=0) + timedelta(minutes=30)
+    client.post('/shows/create', data={'artist_id': 1, 'venue_id': 1, 'start_time': starts.isoformat(sep=' ')})
+    now = starts + timedelta(minutes=1)
+    with fyyur.app.app_context():
+        assert upcoming(fyyur, as_of, Show.time == starts, Show.artist_id == 1, Show.venue_id == 1) == 1
+        venue, artist = stored(fyyur, Venue, 1), stored(fyyur, Artist, 1)
+        # the new one and whatever else the seed put in those 31 minutes
+        passing = (Show.time < now,)
+        venue_passing = upcoming(fyyur, as_of, Show.venue_id == 1, *passing)
+        artist_passing = upcoming(fyyur, as_of, Show.artist_id == 1, *passing)
+        passed = fyyur.roll_upcoming_counts(now)
+        fyyur.db.session.commit()
+        assert passed == upcoming(fyyur, as_of, *passing)
+        assert fyyur.counter_clock().as_of == now
+        assert stored(fyyur, Venue, 1) == venue - venue_passing
+        assert stored(fyyur, Artist, 1) == artist - artist_passing
+        assert no_drift(fyyur)
+        fyyur.db.session.remove()
+
+
+def test_creating_a_show_and_deleting_a_venue_keep_the_counts_in_step(writable):
+    fyyur = writable(SMALL)
+    Show, Venue, Artist = fyyur.Show, fyyur.Venue, fyyur.Artist
+    client = fyyur.app.test_client()
+    with fyyur.app.app_context():
+        venue, artist = stored(fyyur, Venue, 2), stored(fyyur, Artist, 3)
+        fyyur.db.session.remove()
+    client.post('/shows/create', data={'artist_id': 3, 'venue_id': 2, 'start_time': '2035-04-01 20:00:00'})
+    with fyyur.app.app_context():
+        assert (stored(fyyur, Venue, 2), stored(fyyur, Artist, 3)) == (venue + 1, artist + 1)
+        as_of = fyyur.counter_clock().as_of
+        artist_at_venue = upcoming(fyyur, as_of, Show.artist_id == 3, Show.venue_id == 2)
+        fyyur.db.session.remove()
+    client.get('/venues/2/delete')
+    with fyyur.app.app_context():
+        assert fyyur.Venue.query.get(2) is None
+        assert stored(fyyur, Artist, 3) == artist + 1 - artist_at_venue
+        assert no_drift(fyyur)
+        fyyur.db.session.remove()
+
+
+def test_reconcile_reports_drift_and_repairs_it(writable):
+    fyyur = writable(SMALL)
+    Venue = fyyur.Venue
+    with fyyur.app.app_context():
+        actual = stored(fyyur, Venue, 1)
+        Venue.query.filter(Venue.id == 1).update({Venue.upcoming_show_count: actual + 5})
+        fyyur.db.session.commit()
+        drift = {'venue': [(1, actual + 5, actual)], 'artist': []}
+        assert fyyur.reconcile_upcoming_counts(repair=False) == drift
+        fyyur.db.session.commit()
+        assert stored(fyyur, Venue, 1) == actual + 5
+        assert fyyur.reconcile_upcoming_counts(repair=True) == drift
+        fyyur.db.session.commit()
+        assert stored(fyyur, Venue, 1) == actual
+        assert no_drift(fyyur)
+        fyyur.db.session.remove()
@@ -0,0 +1,27 @@
+from conftest import LARGE, SMALL, queries
+
+
+def venues_queries(fyyur):
+    response = fyyur.app.test_client().get('/venues')
+    assert response.status_code == 200
+    return queries(response)
+
+
+def test_venues_query_count_is_constant(seeded):
+    small = venues_queries(seeded(SMALL))
+    large = venues_queries(seeded(LARGE))
+    # the version lookup and the grouped listing, however many venues there are
+    assert small == large == 2
+
+
+def test_venues_lists_every_venue_with_its_upcoming_count(seeded):
+    fyyur = seeded(SMALL)
+    with fyyur.app.app_context():
+        areas = fyyur.venues_by_city()
+        listed = {venue['id']: venue['num_upcoming_shows'] for area in areas for venue in area['venues']}
+        as_of = fyyur.counter_clock().as_of
+        counts = dict(fyyur.db.session.query(fyyur.Show.venue_id, fyyur.db.func.count(fyyur.Show.id))
+                      .filter(fyyur.Show.time >= as_of).group_by(fyyur.Show.venue_id))
+        fyyur.db.session.remove()
+    assert len(listed) == SMALL['venues']
+    assert listed == {key: counts.get(key, 0) for key in listed}
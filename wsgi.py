@@ -0,0 +1,47 @@
+#----------------------------------------------------------------------------#
+# App factory for WSGI servers.
+#
+#   gunicorn -c gunicorn.conf.py        (preloads 'wsgi:create_app()')
+#
+# app.py builds the app when it is first imported, so a process has one app.
+# create_app(config) names the config module it is built from (config.py by
+# default) before importing it, then warms it up (see app.warm_up) so no
+# request pays for loading the indexes or compiling templates.
+#
+# With the app preloaded, the server calls create_app() once in its parent
+# process and forks the workers from it; everything warm_up() loaded is then
+# shared copy-on-write.  before_fork() and after_fork() are the hooks that
+# make that safe: the parent drops its database connections, and each worker
+# opens its own.  gunicorn.conf.py wires them up.
+#----------------------------------------------------------------------------#
+
+import gc
+import os
+import sys
+
+
+def create_app(config=None, warm=True):
+    config = config or os.environ.get('FYYUR_CONFIG', 'config')
+    if 'app' in sys.modules and os.environ.get('FYYUR_CONFIG', 'config') != config:
+        raise RuntimeError('app was already built from %s' % os.environ.get('FYYUR_CONFIG', 'config'))
+    os.environ['FYYUR_CONFIG'] = config
+    from app import app, warm_up
+    if warm:
+        with app.app_context():
+            warm_up()
+    return app
+
+
+def before_fork(app):
+    from app import db
+    db.dispose(app)
+    # what is loaded now is never freed, so the collector can stop visiting
+    # (and so writing to) the pages the workers share
+    gc.freeze()
+
+
+def after_fork(app):
+    from app import db
+    db.dispose(app, close=False)
+    with app.app_context():
+        db.prime(app, app.config['DB_POOL_WARM'])